@@ -0,0 +1,58 @@
+import hashlib
+import logging
+import os
+import queue
+import threading
+
+# Arquivo de imagens endereçado por conteúdo: cada foto é salva uma única vez em
+# recibos/arquivo/<2 primeiros hex>/<sha256>.<ext>, então envios repetidos não ocupam espaço.
+PASTA_ARQUIVO = os.getenv("PASTA_ARQUIVO_RECIBOS", os.path.join("recibos", "arquivo"))
+
+_fila_arquivo = queue.Queue()
+_thread_arquivo = None
+_lock_thread = threading.Lock()
+
+def caminho_arquivo(digest, extensao=".jpg"):
+    return os.path.join(PASTA_ARQUIVO, digest[:2], f"{digest}{extensao}")
+
+def gravar_no_arquivo(conteudo, extensao=".jpg", digest=None):
+    """Grava a imagem no arquivo (se ainda não existir) e devolve o caminho final."""
+    digest = digest or hashlib.sha256(conteudo).hexdigest()
+    destino = caminho_arquivo(digest, extensao)
+    if os.path.exists(destino):
+        logging.debug(f"Imagem {digest[:12]} já arquivada, ignorando duplicata.")
+        return destino
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    # Grava em arquivo temporário e renomeia, para nunca deixar uma imagem pela metade
+    temporario = f"{destino}.{threading.get_ident()}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(conteudo)
+    os.replace(temporario, destino)
+    logging.debug(f"Imagem arquivada em {destino}")
+    return destino
+
+def _trabalhador_arquivo():
+    while True:
+        conteudo, extensao, digest = _fila_arquivo.get()
+        try:
+            gravar_no_arquivo(conteudo, extensao, digest)
+        except OSError as e:
+            logging.error(f"Erro ao arquivar imagem: {e}")
+        finally:
+            _fila_arquivo.task_done()
+
+def arquivar_imagem(conteudo, extensao=".jpg", assincrono=True):
+    """Arquiva a imagem; no modo assíncrono a gravação acontece numa thread de fundo."""
+    global _thread_arquivo
+    if not assincrono:
+        return gravar_no_arquivo(conteudo, extensao)
+    with _lock_thread:
+        if _thread_arquivo is None:
+            _thread_arquivo = threading.Thread(target=_trabalhador_arquivo, name="arquivo-recibos", daemon=True)
+            _thread_arquivo.start()
+    digest = hashlib.sha256(conteudo).hexdigest()
+    _fila_arquivo.put((bytes(conteudo), extensao, digest))
+    return caminho_arquivo(digest, extensao)
+
+def aguardar_arquivamento():
+    _fila_arquivo.join()
@@ -0,0 +1,67 @@
+import argparse
+import hmac
+import json
+import logging
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import fila_jobs
+
+# Broker da fila de consultas: expõe as operações do fila_jobs.py por HTTP, para workers e réplicas
+# do bot em outras máquinas. Só este processo abre o arquivo SQLite (FILA_ARQUIVO).
+# Uso: python broker_fila.py --escutar 0.0.0.0 --porta 8770
+# e nas outras máquinas: FILA_URL=http://maquina-do-broker:8770 python worker.py
+# Com FILA_SEGREDO definido (igual nos dois lados), chamadas sem o segredo são recusadas.
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+class BrokerHandler(BaseHTTPRequestHandler):
+    def responder(self, corpo, status=200):
+        dados = json.dumps(fila_jobs.codificar(corpo), ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_POST(self):
+        if fila_jobs.SEGREDO_BROKER and not hmac.compare_digest(self.headers.get("X-Fila-Segredo", ""), fila_jobs.SEGREDO_BROKER):
+            self.responder({"erro": "segredo inválido"}, status=403)
+            return
+        operacao = fila_jobs.OPERACOES.get(self.path.strip("/"))
+        if operacao is None:
+            self.responder({"erro": f"operação desconhecida: {self.path}"}, status=404)
+            return
+        try:
+            tamanho = int(self.headers.get("Content-Length", 0))
+            chamada = fila_jobs.decodificar(json.loads(self.rfile.read(tamanho)))
+            resultado = operacao(*chamada.get("args", []), **chamada.get("kwargs", {}))
+        except Exception as e:
+            logging.error(f"Erro na operação {self.path}: {e}")
+            self.responder({"erro": str(e)}, status=500)
+            return
+        self.responder({"resultado": resultado})
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Broker HTTP da fila de consultas (fila_jobs.py)")
+    parser.add_argument("--escutar", default="127.0.0.1", help="Endereço (padrão 127.0.0.1; 0.0.0.0 para outras máquinas)")
+    parser.add_argument("--porta", type=int, default=8770, help="Porta HTTP (padrão 8770)")
+    args = parser.parse_args()
+
+    # O broker sempre usa o arquivo local, mesmo que FILA_URL esteja no .env desta máquina
+    fila_jobs.URL_BROKER = ""
+    servidor = ThreadingHTTPServer((args.escutar, args.porta), BrokerHandler)
+    logging.info(f"Broker da fila em http://{args.escutar}:{args.porta} ({fila_jobs.ARQUIVO_FILA})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+if __name__ == "__main__":
+    main()
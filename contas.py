@@ -0,0 +1,255 @@
+import argparse
+import collections
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+import limitador
+import particoes
+import planilha
+from modelo import centavos
+from produtos import obter_indice
+
+# Compras separadas por chat do Telegram (usuário ou grupo). Com CONTAS_POR_CHAT=1, os recibos
+# enviados por um chat vão para a aba CONTA_<chat_id> (que pode ser particionada por mês como a
+# DADOS: python particoes.py migrar --conta <chat_id>), e a verificação de duplicatas e os insights
+# desse chat leem só as abas dele: o custo de cada consulta acompanha o histórico de quem pergunta,
+# não o da casa inteira. Recibos sem chat (execução em lote, pasta vigiada, importador) e tudo o
+# que foi gravado antes continuam na aba DADOS, a conta "compartilhada".
+# Os agregados entre contas (preço médio em outras lojas) vêm do resumo de cada conta em
+# CONTAS_PASTA/resumo_<conta>.json, com soma e quantidade de cada produto por loja, atualizado a
+# cada gravação: nenhuma consulta lê as abas das outras contas.
+# Os roteadores das contas (abas abertas e cache de leitura) ficam num LRU de CONTAS_CACHE contas.
+# Uso: python contas.py listar
+#      python contas.py resumir [--conta CHAT]   (refaz os resumos a partir das abas)
+ATIVO = os.getenv("CONTAS_POR_CHAT", "0") == "1"
+PASTA_CONTAS = os.getenv("CONTAS_PASTA", "contas")
+TAMANHO_CACHE = int(os.getenv("CONTAS_CACHE", "32"))
+PREFIXO = "CONTA_"
+COMPARTILHADA = "compartilhada"
+
+_PADRAO_ABA = re.compile(r"^CONTA_(-?\d+)$")
+_PADRAO_ABA_DA_CONTA = re.compile(r"^CONTA_(-?\d+)(?:_|$)")  # a aba da conta e as partições mensais dela
+_lock = threading.Lock()
+_resumos = {}  # arquivo -> (mtime, resumo)
+
+def conta_do_chat(chat_id):
+    """Conta onde ficam as compras do chat (a compartilhada sem chat ou com CONTAS_POR_CHAT desligado)."""
+    if not ATIVO or chat_id is None:
+        return COMPARTILHADA
+    return str(chat_id)
+
+def conta_da_linha(row):
+    """Conta de uma linha da aba chaves44 (a terceira coluna; vazia nas linhas da conta compartilhada)."""
+    return (row[2].strip() if len(row) > 2 else "") or COMPARTILHADA
+
+def conta_da_aba(titulo):
+    """Conta dona de uma aba de dados: CONTA_<chat> (e partições) ou a compartilhada (DADOS e partições)."""
+    encontrado = _PADRAO_ABA_DA_CONTA.match(titulo)
+    return encontrado.group(1) if encontrado else COMPARTILHADA
+
+# O mesmo recibo enviado por dois chats fica nas abas das duas contas, mas entra uma vez só nas
+# estatísticas de preço e nos resumos: na conta que o gravou primeiro na aba chaves44.
+
+def donos_dos_recibos(linhas_chaves44):
+    """Conta que gravou primeiro cada recibo, pela ordem da aba chaves44: {(CNPJ, número): conta}."""
+    donos = {}
+    for row in linhas_chaves44:
+        chave = row[0].strip() if row else ""
+        if len(chave) == 44 and chave.isdigit() and len(row) > 1:
+            # Posições 7-20 da chave de acesso: CNPJ do emitente
+            donos.setdefault((chave[6:20], row[1].strip()), conta_da_linha(row))
+    return donos
+
+def conta_soma_a_linha(row, conta, donos):
+    """Se a linha de dados (CNPJ na coluna 1, número na 2) entra nas somas da conta."""
+    if not donos:
+        return True
+    dono = donos.get((re.sub(r"\D", "", row[1]), row[2].strip()))
+    return dono is None or dono == conta
+
+class Contas:
+    """Roteador de cada conta, num cache LRU."""
+
+    def __init__(self, spreadsheet, roteador_compartilhado):
+        self.spreadsheet = spreadsheet
+        self.compartilhado = roteador_compartilhado
+        self._roteadores = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.estatisticas = {"acertos": 0, "aberturas": 0, "descartes": 0}
+
+    def roteador(self, conta):
+        if conta == COMPARTILHADA:
+            return self.compartilhado
+        with self._lock:
+            roteador = self._roteadores.get(conta)
+            if roteador is not None:
+                self._roteadores.move_to_end(conta)
+                self.estatisticas["acertos"] += 1
+                return roteador
+            roteador = self._roteadores[conta] = self._abrir(conta)
+            self.estatisticas["aberturas"] += 1
+            while len(self._roteadores) > TAMANHO_CACHE:
+                _, descartado = self._roteadores.popitem(last=False)
+                self.estatisticas["descartes"] += 1
+                # As linhas lidas da conta saem da memória junto com o roteador
+                for aba in [descartado.aba_unica] + list(descartado._abas.values()):
+                    planilha.invalidar(aba)
+            return roteador
+
+    def do_chat(self, chat_id):
+        return self.roteador(conta_do_chat(chat_id))
+
+    def _abrir(self, conta):
+        # Chamado com self._lock
+        nome = f"{PREFIXO}{conta}"
+        try:
+            aba = limitador.executar("sheets_leitura", self.spreadsheet.worksheet, nome)
+        except Exception:
+            aba = limitador.executar("sheets_escrita", self.spreadsheet.add_worksheet, title=nome, rows=1, cols=planilha.LARGURA_DADOS)
+            logging.info(f"Aba {nome} criada para a conta {conta}")
+        if not limitador.executar("sheets_leitura", aba.row_values, 1):
+            cabecalho = limitador.executar("sheets_leitura", self.compartilhado.aba_unica.row_values, 1)
+            limitador.executar("sheets_escrita", aba.append_rows, [cabecalho], value_input_option="RAW")
+        os.makedirs(PASTA_CONTAS, exist_ok=True)
+        return particoes.Roteador(self.spreadsheet, aba, prefixo=f"{nome}_", arquivo=os.path.join(PASTA_CONTAS, f"particoes_{conta}.json"))
+
+    def contas(self):
+        """Contas com aba na planilha (além da compartilhada)."""
+        abas = limitador.executar("sheets_leitura", self.spreadsheet.worksheets)
+        return [encontrado.group(1) for encontrado in (_PADRAO_ABA.match(aba.title) for aba in abas) if encontrado]
+
+    def todas_as_abas(self):
+        """Abas de dados de todas as contas (backup, exportação, reconstrução das estatísticas)."""
+        abas = list(self.compartilhado.todas())
+        if ATIVO:
+            for conta in self.contas():
+                abas.extend(self.roteador(conta).todas())
+        return abas
+
+    def resumo_cache(self):
+        with self._lock:
+            e = dict(self.estatisticas)
+            abertas = len(self._roteadores)
+        return f"{abertas} conta(s) abertas, {e['acertos']} acertos, {e['aberturas']} aberturas, {e['descartes']} descartes"
+
+# Resumo de cada conta: {"linhas": n, "produtos": {id_produto: {empresa: [soma em centavos, quantidade]}}}
+
+def _arquivo_resumo(conta):
+    return os.path.join(PASTA_CONTAS, f"resumo_{conta}.json")
+
+def _ler_resumo(caminho):
+    try:
+        mtime = os.stat(caminho).st_mtime_ns
+    except OSError:
+        return {"linhas": 0, "produtos": {}}
+    cache = _resumos.get(caminho)
+    if cache and cache[0] == mtime:
+        return cache[1]
+    try:
+        with open(caminho, encoding="utf-8") as f:
+            resumo = json.load(f)
+    except (OSError, ValueError):
+        resumo = {"linhas": 0, "produtos": {}}
+    _resumos[caminho] = (mtime, resumo)
+    return resumo
+
+def _gravar_resumo(caminho, resumo):
+    temporario = f"{caminho}.tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(resumo, f, ensure_ascii=False)
+    os.replace(temporario, caminho)
+
+def _somar(resumo, id_produto, empresa, valor):
+    lojas = resumo["produtos"].setdefault(str(id_produto), {})
+    soma = lojas.setdefault(empresa, [0, 0])
+    soma[0] += valor
+    soma[1] += 1
+    resumo["linhas"] += 1
+
+def registrar(conta, recibos):
+    """Soma os itens dos recibos gravados ao resumo da conta."""
+    caminho = _arquivo_resumo(conta)
+    indice = obter_indice()
+    os.makedirs(PASTA_CONTAS, exist_ok=True)
+    # A trava de produtos.json vem antes da do resumo, na mesma ordem de todos os processos
+    with indice.alocando(), _lock, limitador.trava_arquivo(caminho + ".lock"):
+        resumo = _ler_resumo(caminho)
+        for recibo in recibos:
+            for item in recibo.itens:
+                id_produto = indice.identificar(item.descricao, recibo.cnpj, item.codigo)
+                if id_produto is not None:
+                    _somar(resumo, id_produto, recibo.empresa, item.vl_total)
+        try:
+            _gravar_resumo(caminho, resumo)
+        except OSError:
+            # O resumo em memória já tem os recibos: relido do arquivo na próxima vez
+            _resumos.pop(caminho, None)
+            raise
+        _resumos[caminho] = (os.stat(caminho).st_mtime_ns, resumo)
+
+def precos_em_outras_lojas(ids_produtos, empresa):
+    """Soma e quantidade de cada produto nas outras lojas, juntando os resumos de todas as contas."""
+    procurados = {str(id_produto) for id_produto in ids_produtos if id_produto is not None}
+    totais = {}
+    with _lock:
+        for caminho in glob.glob(os.path.join(PASTA_CONTAS, "resumo_*.json")):
+            produtos = _ler_resumo(caminho)["produtos"]
+            for id_produto in procurados.intersection(produtos):
+                for loja, (soma, quantidade) in produtos[id_produto].items():
+                    if loja != empresa:
+                        total = totais.setdefault(int(id_produto), [0, 0])
+                        total[0] += soma
+                        total[1] += quantidade
+    return totais
+
+def resumir(conta, abas, donos=None):
+    """Refaz o resumo da conta lendo as suas abas; devolve o número de linhas.
+
+    donos (de donos_dos_recibos) deixa de fora os recibos que outra conta gravou primeiro.
+    """
+    indice = obter_indice()
+    resumo = {"linhas": 0, "produtos": {}}
+    linhas = [row for aba in abas for row in planilha.ler_colunas(aba, (0, 1, 2, 4, 7, 11))]
+    with indice.alocando():
+        for row in linhas:
+            if len(row) > 11 and row[7] and conta_soma_a_linha(row, conta, donos):
+                id_produto = indice.identificar(row[7], row[1], row[4])
+                if id_produto is not None:
+                    _somar(resumo, id_produto, row[0], centavos(row[11]))
+    caminho = _arquivo_resumo(conta)
+    os.makedirs(PASTA_CONTAS, exist_ok=True)
+    with _lock, limitador.trava_arquivo(caminho + ".lock"):
+        _gravar_resumo(caminho, resumo)
+        _resumos.pop(caminho, None)
+    return resumo["linhas"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Contas por chat do Telegram (abas CONTA_<chat>)")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    subcomandos.add_parser("listar", help="Mostra as contas, as abas e as linhas de cada uma")
+    resumo = subcomandos.add_parser("resumir", help="Refaz os resumos usados nos agregados entre contas")
+    resumo.add_argument("--conta", help="Só esta conta (padrão: todas, inclusive a compartilhada)")
+    args = parser.parse_args()
+
+    # Só aqui a planilha é necessária
+    import nfce_automation
+    contas_chat = nfce_automation.contas_chat
+    nomes = [args.conta] if getattr(args, "conta", None) else [COMPARTILHADA] + contas_chat.contas()
+    inicio = time.perf_counter()
+    donos = nfce_automation.donos_dos_recibos() if args.comando == "resumir" else None
+    for conta in nomes:
+        roteador = contas_chat.roteador(conta)
+        if args.comando == "resumir":
+            linhas = resumir(conta, roteador.todas(), donos)
+            logging.info(f"Conta {conta}: resumo refeito com {linhas} linhas")
+        else:
+            resumo_conta = _ler_resumo(_arquivo_resumo(conta))
+            print(f"{conta}: {', '.join(aba.title for aba in roteador.todas())} ({resumo_conta['linhas']} linhas no resumo)")
+    logging.info(f"Concluído em {time.perf_counter() - inicio:.1f}s; cache de contas: {contas_chat.resumo_cache()}")
+
+if __name__ == "__main__":
+    main()
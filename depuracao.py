@@ -0,0 +1,125 @@
+import collections
+import gzip
+import itertools
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+# Captura de páginas para depuração: em vez de sobrescrever debug_*.html a cada consulta,
+# as páginas são comprimidas e guardadas por chave em debug/<chave>/, fora do caminho da
+# consulta (numa thread de fundo). Por padrão só falhas são capturadas; DEBUG_AMOSTRAGEM
+# (0 a 1) captura também uma fração das consultas bem-sucedidas.
+PASTA_DEBUG = os.getenv("PASTA_DEBUG", "debug")
+TAXA_AMOSTRAGEM = float(os.getenv("DEBUG_AMOSTRAGEM", "0"))
+LIMITE_BYTES = int(float(os.getenv("DEBUG_LIMITE_MB", "50")) * 1024 * 1024)
+MAXIMO_POR_CHAVE = int(os.getenv("DEBUG_MAXIMO_POR_CHAVE", "5"))
+
+_fila_capturas = queue.Queue(maxsize=256)
+_thread_capturas = None
+_lock_thread = threading.Lock()
+# Arquivos já gravados, do mais antigo para o mais novo: [caminho, tamanho, pasta, ativo], numa fila
+# geral e numa por pasta de chave (a mesma entrada nas duas). Quem sai pelo limite da chave só é
+# marcado como inativo e descartado quando chega à frente da fila geral.
+_arquivos = None
+_por_chave = {}
+_total_bytes = 0
+_sequencia = itertools.count()
+
+def _carregar_arquivos():
+    global _arquivos, _total_bytes
+    _por_chave.clear()
+    encontrados = []
+    if os.path.isdir(PASTA_DEBUG):
+        for raiz, _, nomes in os.walk(PASTA_DEBUG):
+            for nome in nomes:
+                if nome.endswith(".html.gz"):
+                    caminho = os.path.join(raiz, nome)
+                    estado = os.stat(caminho)
+                    encontrados.append((estado.st_mtime, caminho, estado.st_size))
+    encontrados.sort()
+    _arquivos = collections.deque()
+    _total_bytes = 0
+    for _, caminho, tamanho in encontrados:
+        _acrescentar(caminho, tamanho)
+
+def _acrescentar(caminho, tamanho):
+    global _total_bytes
+    entrada = [caminho, tamanho, os.path.dirname(caminho), True]
+    _arquivos.append(entrada)
+    _por_chave.setdefault(entrada[2], collections.deque()).append(entrada)
+    _total_bytes += tamanho
+    return entrada
+
+def _remover(entrada):
+    # Sempre a captura mais antiga da sua chave
+    global _total_bytes
+    caminho, tamanho, pasta, _ = entrada
+    entrada[3] = False
+    da_chave = _por_chave[pasta]
+    da_chave.popleft()
+    if not da_chave:
+        del _por_chave[pasta]
+    try:
+        os.remove(caminho)
+    except OSError:
+        pass
+    _total_bytes -= tamanho
+
+def _mais_antigo():
+    while _arquivos and not _arquivos[0][3]:
+        _arquivos.popleft()
+    return _arquivos[0] if _arquivos else None
+
+def _gravar(chave, nome, html, falha):
+    if _arquivos is None:
+        _carregar_arquivos()
+    pasta = os.path.join(PASTA_DEBUG, re.sub(r"[^\w-]", "_", chave or "sem_chave"))
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, f"{time.strftime('%Y%m%d_%H%M%S')}_{next(_sequencia):06d}_{nome}{'_falha' if falha else ''}.html.gz")
+    with gzip.open(caminho, "wt", encoding="utf-8", compresslevel=6) as f:
+        f.write(html)
+    tamanho = os.path.getsize(caminho)
+    entrada = _acrescentar(caminho, tamanho)
+
+    # Mantém no máximo MAXIMO_POR_CHAVE capturas por chave e LIMITE_BYTES no total (as mais antigas saem)
+    da_chave = _por_chave[pasta]
+    while len(da_chave) > MAXIMO_POR_CHAVE:
+        _remover(da_chave[0])
+    # A captura que acabou de ser gravada fica, mesmo sozinha acima do limite
+    while _total_bytes > LIMITE_BYTES and _mais_antigo() not in (None, entrada):
+        _remover(_mais_antigo())
+    logging.debug(f"Página de depuração salva em {caminho} ({tamanho} bytes)")
+
+def _trabalhador_capturas():
+    while True:
+        chave, nome, html, falha = _fila_capturas.get()
+        try:
+            _gravar(chave, nome, html, falha)
+        except OSError as e:
+            logging.error(f"Erro ao gravar página de depuração: {e}")
+        finally:
+            _fila_capturas.task_done()
+
+def capturar_html(chave, nome, html, falha=False):
+    """Agenda a gravação da página; sucessos só são guardados quando sorteados pela amostragem."""
+    global _thread_capturas
+    if not html or (not falha and random.random() >= TAXA_AMOSTRAGEM):
+        return False
+    with _lock_thread:
+        if _thread_capturas is None:
+            _thread_capturas = threading.Thread(target=_trabalhador_capturas, name="depuracao", daemon=True)
+            _thread_capturas.start()
+    try:
+        _fila_capturas.put_nowait((chave, nome, html, falha))
+    except queue.Full:
+        # Depuração nunca pode travar uma consulta: se a fila encher, a captura é descartada
+        logging.debug(f"Fila de depuração cheia, captura de {nome} ({chave}) descartada.")
+        return False
+    return True
+
+def aguardar_capturas():
+    _fila_capturas.join()
@@ -0,0 +1,394 @@
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import queue
+import re
+import struct
+import threading
+import time
+import urllib.request
+import contas
+import limitador
+import planilha
+from modelo import centavos, data_da_compra, formatar_reais, numero
+from produtos import obter_indice
+
+# Estatísticas de preço por (produto canônico, loja), atualizadas a cada recibo gravado, sem reler
+# a planilha: média e variância pelo método de Welford, média móvel exponencial (EWMA) e o último
+# preço visto. Cada par ocupa um registro de tamanho fixo em PRECOS_ARQUIVO, atualizado no lugar
+# (o arquivo só cresce quando aparece um par novo) e protegido por trava entre processos, então
+# o bot, o worker e a execução em lote dividem as mesmas estatísticas e elas sobrevivem a reinícios.
+# Um item custando mais de PRECOS_K desvios-padrão acima da própria média aparece na resposta do
+# bot e é avisado a quem assinou o produto com /alertas.
+# Uso: python estatisticas_precos.py reconstruir   (refaz o arquivo a partir das abas DADOS)
+#      python estatisticas_precos.py mostrar "ARROZ 5KG"
+ARQUIVO_PRECOS = os.getenv("PRECOS_ARQUIVO", "precos.bin")
+ARQUIVO_TRAVA = ARQUIVO_PRECOS + ".lock"
+ARQUIVO_ASSINATURAS = os.getenv("ALERTAS_ARQUIVO", "alertas.json")
+DESVIOS_ALERTA = float(os.getenv("PRECOS_K", "2.5"))
+# Com poucas compras a variância não diz nada: o alerta só vale a partir de PRECOS_MINIMO compras
+MINIMO_AMOSTRAS = int(os.getenv("PRECOS_MINIMO", "3"))
+ALFA_EWMA = float(os.getenv("PRECOS_ALFA", "0.3"))
+# Desvio mínimo, em fração da média: sem ele, um produto sempre ao mesmo preço alertaria por 1 centavo
+DESVIO_MINIMO = float(os.getenv("PRECOS_DESVIO_MINIMO", "0.03"))
+API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+
+# Cabeçalho (identificação e versão do formato) e registro de 60 bytes:
+# id do produto, CNPJ (só dígitos), compras, média, M2 de Welford, EWMA (centavos), último preço
+# (centavos), desvios do último preço em relação à média anterior e quando foi visto (epoch)
+CABECALHO = struct.Struct("<4sI")
+IDENTIFICACAO = b"PRC1"
+REGISTRO = struct.Struct("<IQIdddqdI")
+ID, CNPJ, COMPRAS, MEDIA, M2, EWMA, ULTIMO, DESVIOS, VISTO_EM = range(9)
+
+_lock = threading.Lock()
+_posicoes = {}  # (id_produto, cnpj) -> número do registro no arquivo
+_arquivo_lido = {"inode": None, "tamanho": CABECALHO.size}
+_assinaturas = {"mtime": None, "dados": {}}
+# Alertas aos assinantes saem numa thread de fundo, fora da gravação dos recibos
+_fila_alertas = queue.Queue()
+_thread_alertas = None
+_lock_thread = threading.Lock()
+
+def _cnpj(cnpj):
+    digitos = re.sub(r"\D", "", cnpj or "")
+    return int(digitos) if digitos else 0
+
+def _formatar_cnpj(valor):
+    return f"{valor:014d}" if valor else "sem CNPJ"
+
+def preco_do_item(item):
+    """Preço unitário em centavos (recibos sem valor unitário usam total / quantidade)."""
+    if item.vl_unitario:
+        return item.vl_unitario
+    return round(item.vl_total / item.quantidade) if item.quantidade else item.vl_total
+
+def desvio_padrao(valores):
+    if valores[COMPRAS] < 2:
+        return 0.0
+    return math.sqrt(valores[M2] / (valores[COMPRAS] - 1))
+
+def _atualizar_valores(valores, preco, agora):
+    """Soma o preço às estatísticas (Welford + EWMA), em O(1); guarda os desvios do preço antes da soma."""
+    compras, media, m2, ewma = valores[COMPRAS], valores[MEDIA], valores[M2], valores[EWMA]
+    desvios = 0.0
+    if compras >= MINIMO_AMOSTRAS:
+        referencia = max(desvio_padrao(valores), media * DESVIO_MINIMO, 1.0)
+        desvios = (preco - media) / referencia
+    compras += 1
+    delta = preco - media
+    media += delta / compras
+    m2 += delta * (preco - media)
+    ewma = float(preco) if compras == 1 else ALFA_EWMA * preco + (1 - ALFA_EWMA) * ewma
+    valores[COMPRAS:] = [compras, media, m2, ewma, preco, desvios, int(agora)]
+    return valores
+
+def _abrir():
+    """Abre o arquivo de estatísticas (criando-o) e indexa os registros acrescentados por outros processos.
+
+    Deve ser chamada com a trava do arquivo.
+    """
+    novo = not os.path.exists(ARQUIVO_PRECOS)
+    f = open(ARQUIVO_PRECOS, "w+b" if novo else "r+b")
+    if novo:
+        f.write(CABECALHO.pack(IDENTIFICACAO, REGISTRO.size))
+        f.flush()
+    info = os.fstat(f.fileno())
+    if info.st_ino != _arquivo_lido["inode"] or info.st_size < _arquivo_lido["tamanho"]:
+        # Arquivo novo ou reconstruído: indexa tudo de novo
+        f.seek(0)
+        identificacao, tamanho = CABECALHO.unpack(f.read(CABECALHO.size))
+        if identificacao != IDENTIFICACAO or tamanho != REGISTRO.size:
+            f.close()
+            raise RuntimeError(f"{ARQUIVO_PRECOS} não é um arquivo de estatísticas de preço desta versão; refaça com: python estatisticas_precos.py reconstruir")
+        _posicoes.clear()
+        _arquivo_lido.update(inode=info.st_ino, tamanho=CABECALHO.size)
+    if info.st_size > _arquivo_lido["tamanho"]:
+        f.seek(_arquivo_lido["tamanho"])
+        dados = f.read(info.st_size - _arquivo_lido["tamanho"])
+        primeiro = (_arquivo_lido["tamanho"] - CABECALHO.size) // REGISTRO.size
+        completos = len(dados) // REGISTRO.size
+        for i in range(completos):
+            valores = REGISTRO.unpack_from(dados, i * REGISTRO.size)
+            _posicoes[(valores[ID], valores[CNPJ])] = primeiro + i
+        _arquivo_lido["tamanho"] += completos * REGISTRO.size
+    return f
+
+def _ler(f, posicao):
+    f.seek(CABECALHO.size + posicao * REGISTRO.size)
+    return list(REGISTRO.unpack(f.read(REGISTRO.size)))
+
+def _gravar(f, posicao, valores):
+    f.seek(CABECALHO.size + posicao * REGISTRO.size)
+    f.write(REGISTRO.pack(*valores))
+
+def atualizar(precos):
+    """Soma cada (id_produto, cnpj, preço) às estatísticas; devolve os registros atualizados, na mesma ordem."""
+    agora = time.time()
+    atualizados = []
+    with _lock, limitador.trava_arquivo(ARQUIVO_TRAVA):
+        with _abrir() as f:
+            for id_produto, cnpj, preco in precos:
+                chave = (id_produto, _cnpj(cnpj))
+                posicao = _posicoes.get(chave)
+                if posicao is None:
+                    # Par novo: registro acrescentado no fim do arquivo
+                    posicao = _posicoes[chave] = (_arquivo_lido["tamanho"] - CABECALHO.size) // REGISTRO.size
+                    _arquivo_lido["tamanho"] += REGISTRO.size
+                    valores = [chave[0], chave[1], 0, 0.0, 0.0, 0.0, 0, 0.0, 0]
+                else:
+                    valores = _ler(f, posicao)
+                atualizados.append(_atualizar_valores(valores, preco, agora))
+                _gravar(f, posicao, valores)
+    return atualizados
+
+def consultar(pares):
+    """Registros dos pares (id_produto, cnpj) pedidos: lista com None para os pares sem compras."""
+    with _lock, limitador.trava_arquivo(ARQUIVO_TRAVA):
+        with _abrir() as f:
+            posicoes = [_posicoes.get((id_produto, _cnpj(cnpj))) for id_produto, cnpj in pares]
+            return [_ler(f, posicao) if posicao is not None else None for posicao in posicoes]
+
+def registros_do_produto(id_produto):
+    """Registros do produto em todas as lojas."""
+    with _lock, limitador.trava_arquivo(ARQUIVO_TRAVA):
+        with _abrir() as f:
+            posicoes = sorted(posicao for (produto, _), posicao in _posicoes.items() if produto == id_produto)
+            return [_ler(f, posicao) for posicao in posicoes]
+
+def acima_do_normal(valores):
+    # Os desvios só são calculados com MINIMO_AMOSTRAS compras anteriores (senão ficam em zero)
+    return valores[DESVIOS] > DESVIOS_ALERTA
+
+def registrar_recibos(recibos, notificar=True):
+    """Soma os itens dos recibos recém-gravados às estatísticas e avisa os assinantes dos preços fora do normal."""
+    indice = obter_indice()
+    itens = []
+    # Os produtos novos ganham ID e vão para produtos.json antes de entrar nas estatísticas
+    with indice.alocando():
+        for recibo in recibos:
+            for item in recibo.itens:
+                id_produto = indice.identificar(item.descricao, recibo.cnpj, item.codigo)
+                if id_produto is not None and preco_do_item(item) > 0:
+                    itens.append((recibo, item, id_produto))
+    if not itens:
+        return []
+    atualizados = atualizar([(id_produto, recibo.cnpj, preco_do_item(item)) for recibo, item, id_produto in itens])
+    alertas = [(recibo, item, valores) for (recibo, item, _), valores in zip(itens, atualizados) if acima_do_normal(valores)]
+    for recibo, item, valores in alertas:
+        logging.info(f"Preço acima do normal: {item.descricao} a {formatar_reais(valores[ULTIMO])} em {recibo.empresa} ({valores[DESVIOS]:.1f} desvios)")
+    if notificar and alertas:
+        _notificar_assinantes(alertas)
+    return alertas
+
+def alertas_do_recibo(recibo):
+    """Itens do recibo recém-processado cujo preço ficou acima do normal: [{"descricao", "pago", "media", "desvios"}]."""
+    if recibo.is_duplicate:
+        return []
+    indice = obter_indice()
+    itens = [(item, indice.identificar(item.descricao, recibo.cnpj, item.codigo, criar=False)) for item in recibo.itens]
+    itens = [(item, id_produto) for item, id_produto in itens if id_produto is not None]
+    registros = consultar([(id_produto, recibo.cnpj) for _, id_produto in itens])
+    alertas = []
+    for (item, _), valores in zip(itens, registros):
+        # O registro só é deste recibo se o último preço visto é o do item
+        if valores and valores[ULTIMO] == preco_do_item(item) and acima_do_normal(valores):
+            # A média guardada já inclui este preço; a de antes dele é a que foi comparada
+            compras = valores[COMPRAS]
+            media_anterior = (valores[MEDIA] * compras - valores[ULTIMO]) / (compras - 1)
+            alertas.append({
+                "descricao": item.descricao,
+                "pago": valores[ULTIMO],
+                "media": round(media_anterior),
+                "desvios": valores[DESVIOS],
+            })
+    return alertas
+
+# Assinaturas de alertas: {"id_produto": [chat_id, ...]}
+
+def _ler_assinaturas():
+    try:
+        mtime = os.stat(ARQUIVO_ASSINATURAS).st_mtime_ns
+    except OSError:
+        return {}
+    if mtime != _assinaturas["mtime"]:
+        try:
+            with open(ARQUIVO_ASSINATURAS, encoding="utf-8") as f:
+                _assinaturas["dados"] = json.load(f)
+        except (OSError, ValueError):
+            _assinaturas["dados"] = {}
+        _assinaturas["mtime"] = mtime
+    return _assinaturas["dados"]
+
+def _gravar_assinaturas(dados):
+    temporario = f"{ARQUIVO_ASSINATURAS}.tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(dados, f)
+    os.replace(temporario, ARQUIVO_ASSINATURAS)
+
+def assinar(chat_id, descricao):
+    """Assina os alertas do produto com essa descrição; devolve o nome canônico, ou None se o produto não é conhecido."""
+    indice = obter_indice()
+    id_produto = indice.identificar(descricao, criar=False)
+    if id_produto is None:
+        return None
+    with _lock, limitador.trava_arquivo(ARQUIVO_TRAVA):
+        dados = {chave: list(chats) for chave, chats in _ler_assinaturas().items()}
+        chats = dados.setdefault(str(id_produto), [])
+        if chat_id not in chats:
+            chats.append(chat_id)
+            _gravar_assinaturas(dados)
+    return indice.nomes[id_produto]
+
+def cancelar(chat_id, descricao):
+    """Cancela a assinatura; devolve o nome canônico do produto, ou None se não havia assinatura."""
+    indice = obter_indice()
+    id_produto = indice.identificar(descricao, criar=False)
+    if id_produto is None:
+        return None
+    with _lock, limitador.trava_arquivo(ARQUIVO_TRAVA):
+        dados = {chave: list(chats) for chave, chats in _ler_assinaturas().items()}
+        chats = dados.get(str(id_produto), [])
+        if chat_id not in chats:
+            return None
+        chats.remove(chat_id)
+        if not chats:
+            del dados[str(id_produto)]
+        _gravar_assinaturas(dados)
+    return indice.nomes[id_produto]
+
+def assinaturas(chat_id):
+    """Produtos assinados pelo chat: [(id_produto, nome)]."""
+    with _lock:
+        dados = _ler_assinaturas()
+    nomes = obter_indice().nomes
+    return [(int(chave), nomes[int(chave)]) for chave, chats in dados.items() if chat_id in chats and int(chave) < len(nomes)]
+
+def resumo_produto(id_produto):
+    """Linhas com as estatísticas do produto em cada loja, para o /alertas e o comando mostrar."""
+    linhas = []
+    for valores in registros_do_produto(id_produto):
+        visto = datetime.datetime.fromtimestamp(valores[VISTO_EM]).strftime("%d/%m/%Y")
+        linhas.append(
+            f"  • CNPJ {_formatar_cnpj(valores[CNPJ])}: média {formatar_reais(round(valores[MEDIA]))} "
+            f"± {formatar_reais(round(desvio_padrao(valores)))} em {valores[COMPRAS]} compra(s), "
+            f"tendência {formatar_reais(round(valores[EWMA]))}, último {formatar_reais(valores[ULTIMO])} em {visto}"
+        )
+    return linhas
+
+def _enviar_mensagem(chat_id, texto):
+    # Sem depender do python-telegram-bot: a execução em lote também avisa
+    token = os.getenv("TELEGRAM_TOKEN")
+    if not token:
+        logging.debug("TELEGRAM_TOKEN não definido: alerta de preço não enviado")
+        return
+    corpo = json.dumps({"chat_id": chat_id, "text": texto}).encode("utf-8")
+    requisicao = urllib.request.Request(f"{API_URL}{token}/sendMessage", data=corpo, headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(requisicao, timeout=10) as resposta:
+            resposta.read()
+    except OSError as e:
+        logging.warning(f"Falha ao enviar alerta de preço ao chat {chat_id}: {e}")
+
+def _notificar_assinantes(alertas):
+    with _lock:
+        dados = _ler_assinaturas()
+    mensagens = {}
+    for recibo, item, valores in alertas:
+        for chat_id in dados.get(str(valores[ID]), []):
+            mensagens.setdefault(chat_id, []).append(
+                f"  • {item.descricao}: {formatar_reais(valores[ULTIMO])} em {recibo.empresa or 'loja desconhecida'} "
+                f"({recibo.data}), {valores[DESVIOS]:.1f} desvios acima da média"
+            )
+    if not mensagens:
+        return
+    global _thread_alertas
+    with _lock_thread:
+        if _thread_alertas is None:
+            _thread_alertas = threading.Thread(target=_trabalhador_alertas, name="alertas-precos", daemon=True)
+            _thread_alertas.start()
+    for chat_id, linhas in mensagens.items():
+        _fila_alertas.put((chat_id, "🔔 Preço acima do normal em produto assinado:\n" + "\n".join(linhas)))
+
+def _trabalhador_alertas():
+    while True:
+        chat_id, texto = _fila_alertas.get()
+        try:
+            _enviar_mensagem(chat_id, texto)
+        except Exception as e:
+            logging.error(f"Erro ao enviar alerta de preço ao chat {chat_id}: {e}")
+        finally:
+            _fila_alertas.task_done()
+
+def aguardar_alertas():
+    _fila_alertas.join()
+
+def _data_ordenavel(texto):
+    # AAAA-MM-DD nas NFCe, dd/mm/aaaa nos SAT; sem data, antes de todas
+    data = data_da_compra(texto)
+    return (data.year, data.month, data.day) if data else (0, 0, 0)
+
+def reconstruir(abas, donos=None):
+    """Refaz o arquivo de estatísticas com todas as compras das abas, em ordem de data; devolve (linhas, pares).
+
+    donos (de contas.donos_dos_recibos) conta uma vez só o recibo gravado por mais de uma conta.
+    """
+    indice = obter_indice()
+    linhas = [
+        row
+        for aba in abas
+        for row in planilha.ler_colunas(aba, (1, 2, 4, 7, 8, 10, 11, 12))
+        if len(row) > 11 and contas.conta_soma_a_linha(row, contas.conta_da_aba(aba.title), donos)
+    ]
+    linhas.sort(key=lambda row: _data_ordenavel(row[12]))  # sort estável: mesma data fica na ordem da aba
+    registros = {}
+    agora = time.time()
+    with indice.alocando():
+        for row in linhas:
+            id_produto = indice.identificar(row[7], row[1], row[4])
+            quantidade = numero(row[8], 1.0)
+            preco = centavos(row[10]) or (round(centavos(row[11]) / quantidade) if quantidade else 0)
+            if id_produto is None or preco <= 0:
+                continue
+            chave = (id_produto, _cnpj(row[1]))
+            valores = registros.setdefault(chave, [chave[0], chave[1], 0, 0.0, 0.0, 0.0, 0, 0.0, 0])
+            _atualizar_valores(valores, preco, agora)
+    temporario = f"{ARQUIVO_PRECOS}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(CABECALHO.pack(IDENTIFICACAO, REGISTRO.size))
+        for valores in registros.values():
+            f.write(REGISTRO.pack(*valores))
+    with _lock, limitador.trava_arquivo(ARQUIVO_TRAVA):
+        os.replace(temporario, ARQUIVO_PRECOS)
+    return len(linhas), len(registros)
+
+def main():
+    parser = argparse.ArgumentParser(description="Estatísticas de preço por produto e loja")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    subcomandos.add_parser("reconstruir", help="Refaz o arquivo a partir de todas as abas DADOS")
+    mostrar = subcomandos.add_parser("mostrar", help="Mostra as estatísticas de um produto")
+    mostrar.add_argument("descricao")
+    args = parser.parse_args()
+
+    if args.comando == "mostrar":
+        id_produto = obter_indice().identificar(args.descricao, criar=False)
+        if id_produto is None:
+            parser.error(f"Produto não encontrado: {args.descricao}")
+        print(obter_indice().nomes[id_produto])
+        print("\n".join(resumo_produto(id_produto)) or "  sem compras registradas")
+        return
+
+    # Só aqui a planilha é necessária
+    import nfce_automation
+    inicio = time.perf_counter()
+    linhas, pares = reconstruir(nfce_automation.contas_chat.todas_as_abas(), nfce_automation.donos_dos_recibos())
+    logging.info(
+        f"Estatísticas reconstruídas em {time.perf_counter() - inicio:.1f}s: {linhas} linhas, {pares} pares produto/loja "
+        f"({os.path.getsize(ARQUIVO_PRECOS) / 1024:.1f} KB em {ARQUIVO_PRECOS})"
+    )
+
+if __name__ == "__main__":
+    main()
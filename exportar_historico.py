@@ -0,0 +1,240 @@
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+import planilha
+from modelo import centavos, data_da_compra, numero, reais
+
+# pyarrow é opcional: só o exportador e a leitura dos insights a partir dos arquivos precisam dele
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Exportação do histórico de compras (abas DADOS / DADOS_AAAA_MM e as das contas por chat) para arquivos colunares tipados:
+#   historico/ano=2025/mes=04/cnpj=11111111000111/parte-DADOS_2025_04-000001234.parquet
+# Valores em centavos (int64), quantidade float64, data como date32, is_sat booleano e empresa,
+# CNPJ, categoria e unidade com dictionary encoding. Cada execução lê só as linhas acrescentadas
+# desde a anterior (o estado fica em historico/_exportacao.json) e grava arquivos novos; o nome de
+# cada arquivo vem da primeira linha exportada, então repetir uma execução interrompida sobrescreve
+# os mesmos arquivos em vez de duplicar recibos. Como o cache da planilha, supõe abas só acrescidas.
+# Uso: python exportar_historico.py [--formato parquet|arrow] [--refazer]
+# Com --formato arrow os arquivos são Arrow IPC sem compressão: abertos com memory map, as colunas
+# são lidas direto do arquivo, sem cópia nem decodificação (ler_arquivo, ler_tabela). Os insights do
+# bot ainda trabalham com linhas de texto como as da planilha: elas são montadas dos arquivos da aba
+# uma vez por exportação e ficam em cache.
+PASTA_HISTORICO = os.getenv("HISTORICO_PASTA", "historico")
+# Com HISTORICO_INSIGHTS=1, os insights do bot leem dos arquivos os meses já fechados na última exportação
+INSIGHTS_DOS_ARQUIVOS = os.getenv("HISTORICO_INSIGHTS", "0") == "1"
+EXTENSOES = {"parquet": ".parquet", "arrow": ".arrow"}
+
+_PADRAO_MES = re.compile(r"_(\d{4})_(\d{2})$")  # DADOS_2025_04, CONTA_<chat>_2025_04
+_lock = threading.Lock()
+_cache_insights = {}  # aba -> (exportado_em, linhas)
+
+def _esquema():
+    texto_repetido = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("empresa", texto_repetido),
+        ("cnpj", texto_repetido),
+        ("numero", pa.string()),
+        ("consumidor", pa.string()),
+        ("codigo", pa.string()),
+        ("nome_curto", pa.string()),
+        ("categoria", texto_repetido),
+        ("descricao", pa.string()),
+        ("quantidade", pa.float64()),
+        ("unidade", texto_repetido),
+        ("vl_unitario", pa.int64()),  # centavos
+        ("vl_total", pa.int64()),  # centavos
+        ("data", pa.date32()),
+        ("hora", pa.string()),
+        ("is_sat", pa.bool_()),
+    ])
+
+# AAAA-MM-DD nas NFCe, dd/mm/aaaa nos SAT
+_data = data_da_compra
+
+def _pasta_particao(data, cnpj):
+    digitos = re.sub(r"\D", "", cnpj or "") or "sem_cnpj"
+    if data is None:
+        return os.path.join(PASTA_HISTORICO, "ano=sem_data", "mes=sem_data", f"cnpj={digitos}")
+    return os.path.join(PASTA_HISTORICO, f"ano={data.year:04d}", f"mes={data.month:02d}", f"cnpj={digitos}")
+
+def _tabela(linhas):
+    """Linhas da aba DADOS (texto) -> pyarrow.Table tipada."""
+    colunas = {
+        "empresa": [linha[0] for linha in linhas],
+        "cnpj": [linha[1] for linha in linhas],
+        "numero": [linha[2].strip() for linha in linhas],
+        "consumidor": [linha[3] for linha in linhas],
+        "codigo": [linha[4] for linha in linhas],
+        "nome_curto": [linha[5] for linha in linhas],
+        "categoria": [linha[6] for linha in linhas],
+        "descricao": [linha[7] for linha in linhas],
+        "quantidade": [numero(linha[8]) for linha in linhas],
+        "unidade": [linha[9] for linha in linhas],
+        "vl_unitario": [centavos(linha[10]) for linha in linhas],
+        "vl_total": [centavos(linha[11]) for linha in linhas],
+        "data": [_data(linha[12]) for linha in linhas],
+        "hora": [linha[13] for linha in linhas],
+        "is_sat": [str(linha[14]).strip().lower() == "true" for linha in linhas],
+    }
+    return pa.Table.from_pydict(colunas, schema=_esquema())
+
+def _gravar_arquivo(tabela, caminho, formato):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f"{caminho}.tmp"
+    if formato == "arrow":
+        with pa.OSFile(temporario, "wb") as destino, pa.ipc.new_file(destino, tabela.schema) as escritor:
+            escritor.write_table(tabela)
+    else:
+        pq.write_table(tabela, temporario, compression="zstd")
+    os.replace(temporario, caminho)
+
+def _carregar_estado():
+    try:
+        with open(os.path.join(PASTA_HISTORICO, "_exportacao.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _gravar_estado(estado):
+    caminho = os.path.join(PASTA_HISTORICO, "_exportacao.json")
+    temporario = f"{caminho}.tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(estado, f, ensure_ascii=False, indent=1)
+    os.replace(temporario, caminho)
+
+def exportar(abas, formato="parquet"):
+    """Exporta as linhas novas de cada aba; devolve (linhas, arquivos) gravados nesta execução."""
+    if pa is None:
+        raise RuntimeError("pyarrow não está instalado: pip install pyarrow")
+    os.makedirs(PASTA_HISTORICO, exist_ok=True)
+    estado = _carregar_estado()
+    titulos = {aba.title for aba in abas}
+    if any(titulo not in titulos and registro["linhas"] for titulo, registro in estado.items()):
+        # Ex.: a aba DADOS foi exportada e depois migrada para partições: as mesmas linhas voltariam
+        raise RuntimeError(f"As abas mudaram desde a última exportação ({', '.join(sorted(set(estado) - titulos))}); refaça com --refazer")
+    total_linhas = total_arquivos = 0
+    for aba in abas:
+        registro = estado.setdefault(aba.title, {"linhas": 0})
+        inicio = registro["linhas"]
+        linhas = [linha for linha in planilha.ler_a_partir(aba, inicio) if any(str(valor).strip() for valor in linha)]
+        if linhas:
+            # Um arquivo por (ano, mês, CNPJ) tocado, nomeado pela primeira linha exportada agora
+            grupos = {}
+            for linha in linhas:
+                grupos.setdefault(_pasta_particao(_data(linha[12]), linha[1]), []).append(linha)
+            for pasta, grupo in grupos.items():
+                _gravar_arquivo(_tabela(grupo), os.path.join(pasta, f"parte-{aba.title}-{inicio:09d}{EXTENSOES[formato]}"), formato)
+            total_linhas += len(linhas)
+            total_arquivos += len(grupos)
+            logging.info(f"{aba.title}: {len(linhas)} linhas novas em {len(grupos)} arquivo(s)")
+        registro["linhas"] = inicio + len(linhas)
+        registro["exportado_em"] = time.time()
+        _gravar_estado(estado)
+    return total_linhas, total_arquivos
+
+def _ordem(caminho):
+    # Ordem de gravação: linhas exportadas depois ficam depois (o índice de produtos indexa por posição)
+    nome = os.path.basename(caminho)
+    return (nome.rsplit("-", 1)[-1], caminho)
+
+def arquivos(ano=None, mes=None, aba=None):
+    """Arquivos exportados (de um mês e de uma aba, se pedidos), na ordem em que foram gravados."""
+    padrao = os.path.join(
+        PASTA_HISTORICO,
+        f"ano={ano:04d}" if ano else "ano=*",
+        f"mes={mes:02d}" if mes else "mes=*",
+        "cnpj=*",
+        f"parte-{glob.escape(aba)}-*" if aba else "parte-*",
+    )
+    return sorted((caminho for caminho in glob.glob(padrao) if caminho.endswith(tuple(EXTENSOES.values()))), key=_ordem)
+
+def ler_arquivo(caminho, colunas=None):
+    """Lê um arquivo exportado com memory map (Arrow IPC sem cópia; Parquet sem ler o arquivo para a memória)."""
+    if caminho.endswith(EXTENSOES["arrow"]):
+        tabela = pa.ipc.open_file(pa.memory_map(caminho, "r")).read_all()
+        return tabela.select(colunas) if colunas else tabela
+    return pq.read_table(caminho, columns=colunas, memory_map=True)
+
+def ler_tabela(ano=None, mes=None, colunas=None, aba=None):
+    """Tabela com o histórico exportado (um mês e uma aba, se pedidos), para análises locais."""
+    tabelas = [ler_arquivo(caminho, colunas) for caminho in arquivos(ano, mes, aba)]
+    if not tabelas:
+        return _esquema().empty_table() if not colunas else _esquema().empty_table().select(colunas)
+    return pa.concat_tables(tabelas) if len(tabelas) > 1 else tabelas[0]
+
+def linhas_insights(titulo_aba):
+    """Linhas no formato de COLUNAS_INSIGHTS lidas dos arquivos, ou None se a aba deve ser lida da planilha.
+
+    Só vale para partições mensais de meses que já tinham terminado na última exportação.
+    """
+    if not INSIGHTS_DOS_ARQUIVOS or pa is None:
+        return None
+    encontrado = _PADRAO_MES.search(titulo_aba)
+    registro = _carregar_estado().get(titulo_aba)
+    if not encontrado or not registro or "exportado_em" not in registro:
+        return None
+    ano, mes = int(encontrado.group(1)), int(encontrado.group(2))
+    # Exportada no primeiro dia do mês seguinte, a aba ainda pode receber recibos do último dia
+    mes_seguinte = datetime.date(ano + mes // 12, mes % 12 + 1, 1)
+    if datetime.date.fromtimestamp(registro["exportado_em"]) <= mes_seguinte:
+        return None
+    with _lock:
+        cache = _cache_insights.get(titulo_aba)
+        if cache and cache[0] == registro["exportado_em"]:
+            return cache[1]
+    # Só os arquivos desta aba: o mesmo mês tem os das contas dos outros chats e os de exportações da aba DADOS
+    tabela = ler_tabela(ano, mes, ["empresa", "cnpj", "codigo", "descricao", "vl_total", "data", "is_sat"], aba=titulo_aba)
+    # A data volta como estava na planilha: AAAA-MM-DD nas NFCe, dd/mm/aaaa nos SAT
+    datas = tabela.column("data").cast(pa.timestamp("s"))
+    datas = pc.if_else(
+        tabela.column("is_sat"),
+        pc.strftime(datas, format="%d/%m/%Y"),
+        pc.strftime(datas, format="%Y-%m-%d"),
+    ).fill_null("N/A")
+    empresas, cnpjs, codigos, descricoes, totais = (tabela.column(i).to_pylist() for i in range(5))
+    # Mesmo formato de planilha.ler_colunas(aba, COLUNAS_INSIGHTS): colunas 0, 1, 4, 7, 11 e 12
+    linhas = [
+        [empresa, cnpj, "", "", codigo, "", "", descricao, "", "", "", str(reais(total)), data]
+        for empresa, cnpj, codigo, descricao, total, data in zip(empresas, cnpjs, codigos, descricoes, totais, datas.to_pylist())
+    ]
+    with _lock:
+        _cache_insights[titulo_aba] = (registro["exportado_em"], linhas)
+    return linhas
+
+def apagar_exportacao():
+    for caminho in arquivos():
+        os.remove(caminho)
+    if os.path.exists(os.path.join(PASTA_HISTORICO, "_exportacao.json")):
+        os.remove(os.path.join(PASTA_HISTORICO, "_exportacao.json"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta o histórico de compras para arquivos Parquet/Arrow particionados")
+    parser.add_argument("--formato", default="parquet", choices=sorted(EXTENSOES), help="parquet (comprimido) ou arrow (memory map sem cópia)")
+    parser.add_argument("--refazer", action="store_true", help="Apaga a exportação anterior e exporta tudo de novo")
+    args = parser.parse_args()
+    if pa is None:
+        parser.error("pyarrow não está instalado: pip install pyarrow")
+    if args.refazer:
+        apagar_exportacao()
+
+    # Só aqui a planilha é necessária
+    import nfce_automation
+    inicio = time.perf_counter()
+    linhas, gravados = exportar(nfce_automation.contas_chat.todas_as_abas(), args.formato)
+    logging.info(f"Exportação concluída em {time.perf_counter() - inicio:.1f}s: {linhas} linhas novas em {gravados} arquivo(s) em {PASTA_HISTORICO}/")
+    logging.info(f"Leituras da planilha: {planilha.resumo_leituras()}")
+
+if __name__ == "__main__":
+    main()
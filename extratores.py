@@ -0,0 +1,283 @@
+from bs4 import BeautifulSoup
+import re
+from modelo import Item, Recibo
+
+# Funções de extração sem efeitos colaterais (sem navegador nem planilha), usadas pela
+# consulta online em nfce_automation.py e pelo importador de históricos.
+
+# Função para log
+def log(message, debug_level=0):
+    if debug_level == 1:
+        print(message)
+    elif debug_level == 0:
+        keywords = ["processando imagem", "empresa:", "data:", "total:", "código:", "✅", "imagem renomeada"]
+        if any(kw in message.lower() for kw in keywords):
+            print(message)
+
+def limpar_valor(texto, debug_level=0):
+    if not texto:
+        return "0.0"
+    texto = texto.strip()
+    texto_limpo = texto.replace('\xa0', '').replace('\n', '').replace('\t', '').replace('R$', '').replace('$', '').replace(',', '.').strip()
+    texto_limpo = re.sub(r'[^\d.]', '', texto_limpo)
+    log(f"Valor bruto recebido: '{texto}'", debug_level)
+    log(f"Valor limpo: '{texto_limpo}'", debug_level)
+    try:
+        return str(float(texto_limpo))
+    except ValueError:
+        log(f"Erro: Não foi possível converter '{texto}' -> '{texto_limpo}' para float", debug_level)
+        return "0.0"
+
+# Tabela de tradução pré-compilada: uma única passada em C em vez de um dicionário por caractere
+TABELA_ACENTOS = str.maketrans(
+    "àáâãäåÀÁÂÃÄÅèéêëÈÉÊËìíîïÌÍÎÏòóôõöÒÓÔÕÖùúûüÙÚÛÜçÇñÑ",
+    "aaaaaaAAAAAAeeeeEEEEiiiiIIIIoooooOOOOOuuuuUUUUcCnN",
+)
+
+def remover_acentos(texto):
+    return texto.translate(TABELA_ACENTOS)
+
+def extrair_empresa(html):
+    inicio = remover_acentos('<div id="u20" class="txtTopo">')
+    fim = remover_acentos('</div>')
+    return extrair_texto_entre(html, inicio, fim)
+
+def extrair_cnpj(html):
+    inicio = remover_acentos('CNPJ:')
+    start = html.index(inicio) if inicio in html else -1
+    if start == -1:
+        return ""
+    fim = remover_acentos('</div>')
+    end = html.index(fim, start) if fim in html[start:] else -1
+    if end == -1:
+        return ""
+    return extrair_texto_entre(html, inicio, fim)
+
+def extrair_emissao(html):
+    regex_data_hora = r'(\d{2}/\d{2}/\d{4})\s(\d{2}:\d{2}:\d{2})'
+    match = re.search(regex_data_hora, html)
+    if match:
+        data_original = match.group(1)
+        partes_data = data_original.split('/')
+        data = f"{partes_data[2]}-{partes_data[1]}-{partes_data[0]}"
+        hora = match.group(2)
+        return {"data": data, "hora": hora}
+    return {"data": "Não encontrado", "hora": "Não encontrado"}
+
+def extrair_itens(html, debug_level=0):
+    log("Iniciando parsing do HTML com BeautifulSoup.", debug_level)
+    soup = BeautifulSoup(html, 'html.parser')
+    itens = []
+
+    # Procurar a tabela com id="tabResult"
+    tabela = soup.find('table', {'id': 'tabResult'})
+    if not tabela:
+        log("Erro: Nenhuma tabela com id='tabResult' encontrada.", debug_level)
+        return itens
+
+    log(f"Tabela com id='tabResult' encontrada com {len(tabela.find_all('tr'))} linhas.", debug_level)
+    linhas = tabela.find_all('tr')
+
+    for i, linha in enumerate(linhas):
+        log(f"Processando linha {i + 1}.", debug_level)
+        colunas = linha.find_all('td')
+        log(f"Linha contém {len(colunas)} colunas.", debug_level)
+
+        # Esperamos 2 colunas por linha
+        if len(colunas) != 2:
+            log(f"Linha ignorada: esperado 2 colunas, mas encontrou {len(colunas)}.", debug_level)
+            continue
+
+        try:
+            # Primeira coluna: contém descrição, código, quantidade, unidade, valor unitário
+            primeira_coluna = colunas[0]
+            # Descrição
+            descricao_elem = primeira_coluna.find('span', {'class': 'txtTit'})
+            descricao = descricao_elem.get_text(strip=True) if descricao_elem else "N/A"
+            # Código
+            codigo_elem = primeira_coluna.find('span', {'class': 'RCod'})
+            codigo_raw = codigo_elem.get_text(strip=True) if codigo_elem else "N/A"
+            # Limpar o código, removendo "(Código: ", ")", quebras de linha e espaços extras
+            codigo = re.sub(r'\(Código:\s*', '', codigo_raw).replace(')', '').strip()
+            codigo = re.sub(r'\s+', '', codigo)  # Remove quebras de linha e espaços extras
+            # Quantidade
+            quantidade_elem = primeira_coluna.find('span', {'class': 'Rqtd'})
+            quantidade = quantidade_elem.get_text(strip=True).replace('Qtde.:', '').strip() if quantidade_elem else "1"
+            # Unidade
+            unidade_elem = primeira_coluna.find('span', {'class': 'RUN'})
+            unidade_raw = unidade_elem.get_text(strip=True) if unidade_elem else "UN"
+            # Limpar a unidade, removendo "UN: " e espaços extras
+            unidade = re.sub(r'UN:\s*', '', unidade_raw).strip()
+            # Valor Unitário
+            vl_unitario_elem = primeira_coluna.find('span', {'class': 'RvlUnit'})
+            vl_unitario = vl_unitario_elem.get_text(strip=True).replace('Vl. Unit.:', '').strip() if vl_unitario_elem else "0"
+
+            # Segunda coluna: contém o valor total
+            segunda_coluna = colunas[1]
+            vl_total_elem = segunda_coluna.find('span', {'class': 'valor'})
+            vl_total = vl_total_elem.get_text(strip=True) if vl_total_elem else vl_unitario
+
+            # Verificar se os campos obrigatórios foram preenchidos
+            if descricao and descricao != "N/A":
+                # Quantidade e valores são convertidos aqui, uma única vez (valores em centavos)
+                item = Item.criar(codigo, descricao, quantidade, unidade, vl_unitario, vl_total)
+                log(f"Item adicionado: {item}", debug_level)
+                itens.append(item)
+            else:
+                log("Linha ignorada: descrição não encontrada.", debug_level)
+        except Exception as e:
+            log(f"Erro ao processar linha {i + 1}: {e}", debug_level)
+
+    log(f"Total de itens extraídos: {len(itens)}", debug_level)
+
+    return itens
+
+def extrair_numero_nfce(html):
+    inicio = '<strong>Número: </strong>'
+    start = html.index(inicio) if inicio in html else -1
+    if start == -1:
+        return "Não encontrado"
+    start += len(inicio)
+    end = html.find('<', start)
+    return html[start:end].strip()
+
+def extrair_consumidor(html):
+    soup = BeautifulSoup(html, "html.parser")
+    # Procurar o elemento <strong> dentro da seção "Consumidor"
+    consumidor_section = soup.find('div', {'data-role': 'collapsible'}, string=lambda text: 'Consumidor' in str(text))
+    if consumidor_section:
+        consumidor = consumidor_section.find('strong')
+        return consumidor.get_text(strip=True) if consumidor else "Não identificado"
+    return "Não identificado"
+
+def extrair_texto_entre(html, inicio, fim):
+    start = html.index(inicio) if inicio in html else -1
+    if start == -1:
+        return ""
+    start += len(inicio)
+    end = html.index(fim, start) if fim in html[start:] else -1
+    if end == -1:
+        return ""
+    texto = html[start:end].strip()
+    return texto.replace('\xa0', '')
+
+def clean_float(value):
+    """Remove símbolos e caracteres não numéricos de um valor monetário e converte para float."""
+    if not value:
+        return 0.0
+    # Remove $, espaços, e substitui vírgula por ponto (se necessário)
+    cleaned = value.replace('$', '').replace(' ', '').replace(',', '.').strip()
+    try:
+        return float(cleaned)
+    except ValueError:
+        return 0.0
+
+def extrair_dados_nfce(html, debug_level=0, chave=None):
+    """Extrai empresa, emissão, itens e número do HTML da consulta pública da NFCe."""
+    html_limpo = html
+    html_limpo_sem_acentos = remover_acentos(html_limpo)
+    emissao = extrair_emissao(html_limpo)
+    return Recibo.criar(
+        empresa=extrair_empresa(html_limpo_sem_acentos),
+        cnpj=extrair_cnpj(html_limpo_sem_acentos),
+        numero=extrair_numero_nfce(html_limpo),
+        consumidor=extrair_consumidor(html_limpo),
+        data=emissao["data"],
+        hora=emissao["hora"],
+        itens=extrair_itens(html_limpo, debug_level),
+        chave=chave,
+    )
+
+def extrair_chave_acesso(html):
+    """Procura a chave de acesso (44 dígitos, com ou sem espaços) no HTML salvo de uma consulta."""
+    texto = re.sub(r'<[^>]+>', ' ', html)
+    match = re.search(r'Chave[^0-9]{0,40}((?:\d{4}\s*){11})', texto, re.IGNORECASE)
+    if not match:
+        match = re.search(r'(?<!\d)((?:\d{4}\s?){10}\d{4})(?!\d)', texto)
+    return re.sub(r'\s+', '', match.group(1)) if match else None
+
+def tipo_de_pagina(html):
+    """Identifica se um HTML salvo é da consulta SAT, da NFCe ou de nenhuma delas."""
+    if 'divTelaImpressao' in html or 'conteudo_lblNumeroCfe' in html:
+        return "sat"
+    if 'tabResult' in html:
+        return "nfce"
+    return None
+
+def extrair_dados_sat(html, debug_level=0, chave=None):
+    """Extrai emitente, cupom e itens do HTML da consulta pública do SAT."""
+    def campo(id_elemento):
+        return extrair_texto_entre(html, f'id="{id_elemento}">', '</span>').strip()
+
+    try:
+        emitente = campo("conteudo_lblNomeEmitente") or "N/A"
+        log(f"Emitente extraído: {emitente}", debug_level)
+        cnpj = campo("conteudo_lblCnpjEmitente") or "N/A"
+        log(f"CNPJ extraído: {cnpj}", debug_level)
+        endereco = campo("conteudo_lblEnderecoEmintente")
+        bairro = campo("conteudo_lblBairroEmitente")
+        cidade = campo("conteudo_lblMunicipioEmitente")
+        cep = campo("conteudo_lblCepEmitente")
+        endereco = f"{endereco}, {bairro}, {cidade}, CEP {cep}".strip()
+        log(f"Endereço extraído: {endereco}", debug_level)
+    except Exception as e:
+        log(f"Erro ao extrair emitente: {e}", debug_level)
+        emitente = cnpj = endereco = "N/A"
+
+    try:
+        numero_sat = campo("conteudo_lblNumeroCfe") or "N/A"
+        log(f"Número SAT extraído: {numero_sat}", debug_level)
+        data = campo("conteudo_lblDataEmissao") or "N/A"
+        log(f"Data extraída: {data}", debug_level)
+        emissao = {
+            "data": data.split(" - ")[0] if " - " in data else data,
+            "hora": data.split(" - ")[1] if " - " in data else "N/A"
+        }
+        consumidor = campo("conteudo_lblRazaoSocial") or "N/A"
+        log(f"Consumidor extraído: {consumidor}", debug_level)
+    except Exception as e:
+        log(f"Erro ao extrair cupom: {e}", debug_level)
+        numero_sat = "N/A"
+        emissao = {"data": "N/A", "hora": "N/A"}
+        consumidor = "N/A"
+
+    itens = []
+    try:
+        soup = BeautifulSoup(html, 'html.parser')
+        tabela = soup.find('table', {'id': 'tableItens'})
+        if tabela:
+            log("Tabela encontrada via BeautifulSoup, processando...", debug_level)
+            for row in tabela.find_all('tr')[1:]:
+                cols = row.find_all('td')
+                if len(cols) >= 8:
+                    try:
+                        item = Item.criar(
+                            codigo=cols[1].text.strip(),
+                            descricao=cols[2].text.strip(),
+                            quantidade=cols[3].text.strip(),
+                            unidade=cols[4].text.strip(),
+                            vl_unitario=cols[5].text.strip(),
+                            vl_total=cols[7].text.strip()
+                        )
+                        log(f"Item extraído: {item}", debug_level)
+                        itens.append(item)
+                    except Exception as e:
+                        log(f"Erro ao extrair item: {e}", debug_level)
+                        continue
+        else:
+            log("Tabela de itens não encontrada no HTML.", debug_level)
+    except Exception as e:
+        log(f"Erro ao extrair itens: {e}", debug_level)
+
+    return Recibo.criar(
+        empresa=emitente,
+        cnpj=cnpj,
+        numero=numero_sat,
+        consumidor=consumidor,
+        data=emissao["data"],
+        hora=emissao["hora"],
+        itens=itens,
+        is_sat=True,
+        chave=chave,
+        endereco=endereco,
+    )
@@ -0,0 +1,394 @@
+import base64
+import contextlib
+import functools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.request
+
+# Fila de consultas entre o bot e os workers. No modo fila (telegram_bot.py --fila), as réplicas
+# do bot só recebem as mensagens e abrem um pedido; os workers (worker.py), donos do Chrome,
+# tiram os jobs da fila, consultam os portais e respondem direto ao chat.
+#   - pedidos: uma mensagem do usuário (chave digitada ou foto); respondido quando todos os seus
+#     jobs de chave terminam, numa única mensagem;
+#   - jobs: uma chave (ou uma foto, que o worker transforma em jobs de chave), com prioridade e
+#     lease: o worker renova o lease com heartbeats e, se ele cair, o job volta para a fila;
+#   - resultados: o recibo de cada chave consultada com sucesso; um job repetido (lease vencido,
+#     mesma chave enviada de novo) usa o resultado gravado em vez de consultar o portal outra vez;
+#   - captchas: CAPTCHAs enviados pelos workers; a resposta do usuário chega em qualquer réplica
+#     do bot e é entregue ao worker por esta tabela.
+# O arquivo SQLite (FILA_ARQUIVO) é compartilhado pelos processos da mesma máquina; em outras
+# máquinas, FILA_URL aponta para o broker_fila.py, que atende as mesmas operações por HTTP.
+ARQUIVO_FILA = os.getenv("FILA_ARQUIVO", "fila.db")
+URL_BROKER = os.getenv("FILA_URL", "").rstrip("/")
+SEGREDO_BROKER = os.getenv("FILA_SEGREDO", "")
+LEASE_SEGUNDOS = float(os.getenv("FILA_LEASE", "60"))
+MAXIMO_TENTATIVAS = int(os.getenv("FILA_TENTATIVAS", "3"))
+INTERVALO_CONSULTA = 0.5  # segundos entre verificações de jobs e respostas de CAPTCHA
+
+PENDENTE = "pendente"
+EXECUTANDO = "executando"
+CONCLUIDO = "concluido"
+FALHOU = "falhou"
+
+# Mesmos valores do limitador: consultas do bot passam na frente dos trabalhos em lote
+PRIORIDADE_INTERATIVA = 0
+PRIORIDADE_LOTE = 1
+
+# Falhas de acesso à fila (arquivo travado, broker fora do ar) que quem chama pode tentar de novo
+ERROS_FILA = (OSError, ValueError, sqlite3.Error)
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS pedidos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER,
+    tipo TEXT NOT NULL,
+    total INTEGER,
+    respondido INTEGER NOT NULL DEFAULT 0,
+    criado_em REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pedido_id INTEGER NOT NULL,
+    chat_id INTEGER,
+    tipo TEXT NOT NULL,
+    chave TEXT,
+    is_sat INTEGER NOT NULL DEFAULT 0,
+    conteudo BLOB,
+    prioridade INTEGER NOT NULL DEFAULT 0,
+    debug_level INTEGER NOT NULL DEFAULT 0,
+    estado TEXT NOT NULL DEFAULT 'pendente',
+    worker TEXT,
+    lease_ate REAL,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    criado_em REAL NOT NULL,
+    iniciado_em REAL,
+    concluido_em REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_estado ON jobs (estado, prioridade, id);
+CREATE INDEX IF NOT EXISTS jobs_pedido ON jobs (pedido_id);
+CREATE TABLE IF NOT EXISTS resultados (
+    chave TEXT PRIMARY KEY,
+    is_sat INTEGER NOT NULL,
+    linhas TEXT NOT NULL,
+    job_id INTEGER NOT NULL,
+    novo INTEGER NOT NULL,
+    concluido_em REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workers (
+    nome TEXT PRIMARY KEY,
+    maquina TEXT,
+    em_andamento INTEGER NOT NULL DEFAULT 0,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS captchas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    resposta TEXT,
+    criado_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS captchas_chat ON captchas (chat_id, id);
+"""
+
+_local = threading.local()
+_esquema_criado = False
+
+# nome -> função local, chamadas pelo broker_fila.py
+OPERACOES = {}
+
+def _conexao():
+    # Uma conexão por thread; o modo WAL deixa leitores e o escritor trabalharem ao mesmo tempo
+    global _esquema_criado
+    conexao = getattr(_local, "conexao", None)
+    if conexao is None:
+        conexao = sqlite3.connect(ARQUIVO_FILA, timeout=30, isolation_level=None)
+        conexao.row_factory = sqlite3.Row
+        conexao.execute("PRAGMA journal_mode=WAL")
+        conexao.execute("PRAGMA synchronous=NORMAL")
+        if not _esquema_criado:
+            conexao.executescript(_ESQUEMA)
+            _esquema_criado = True
+        _local.conexao = conexao
+    return conexao
+
+@contextlib.contextmanager
+def _transacao():
+    conexao = _conexao()
+    conexao.execute("BEGIN IMMEDIATE")
+    try:
+        yield conexao
+    except BaseException:
+        conexao.execute("ROLLBACK")
+        raise
+    conexao.execute("COMMIT")
+
+def codificar(valor):
+    """Prepara valores para JSON (bytes viram {"__bytes__": base64})."""
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        return {"__bytes__": base64.b64encode(bytes(valor)).decode("ascii")}
+    if isinstance(valor, dict):
+        return {chave: codificar(item) for chave, item in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [codificar(item) for item in valor]
+    return valor
+
+def decodificar(valor):
+    if isinstance(valor, dict):
+        if set(valor) == {"__bytes__"}:
+            return base64.b64decode(valor["__bytes__"])
+        return {chave: decodificar(item) for chave, item in valor.items()}
+    if isinstance(valor, list):
+        return [decodificar(item) for item in valor]
+    return valor
+
+def _chamar_broker(nome, args, kwargs):
+    corpo = json.dumps(codificar({"args": list(args), "kwargs": kwargs})).encode("utf-8")
+    cabecalhos = {"Content-Type": "application/json"}
+    if SEGREDO_BROKER:
+        cabecalhos["X-Fila-Segredo"] = SEGREDO_BROKER
+    requisicao = urllib.request.Request(f"{URL_BROKER}/{nome}", data=corpo, headers=cabecalhos, method="POST")
+    with urllib.request.urlopen(requisicao, timeout=60) as resposta:
+        return decodificar(json.loads(resposta.read()))["resultado"]
+
+def _operacao(funcao):
+    """Registra a operação para o broker; com FILA_URL definida, a chamada vai para o broker por HTTP."""
+    OPERACOES[funcao.__name__] = funcao
+
+    @functools.wraps(funcao)
+    def chamar(*args, **kwargs):
+        if URL_BROKER:
+            return _chamar_broker(funcao.__name__, args, kwargs)
+        return funcao(*args, **kwargs)
+    return chamar
+
+def usar_arquivo(caminho):
+    """Passa a usar outro arquivo de fila neste processo (ex.: o gerar_carga.py, uma fila por rodada)."""
+    global ARQUIVO_FILA, _esquema_criado
+    conexao = getattr(_local, "conexao", None)
+    if conexao is not None:
+        conexao.close()
+        _local.conexao = None
+    ARQUIVO_FILA = caminho
+    _esquema_criado = False
+
+def nome_worker():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+@_operacao
+def criar_pedido(chat_id, tipo, chaves=None, imagem=None, prioridade=PRIORIDADE_INTERATIVA, debug_level=0):
+    """Abre um pedido com um job por chave [(chave, is_sat), ...] ou um job com os bytes da foto."""
+    agora = time.time()
+    with _transacao() as conexao:
+        total = None if imagem is not None else len(chaves)
+        pedido_id = conexao.execute(
+            "INSERT INTO pedidos (chat_id, tipo, total, criado_em) VALUES (?, ?, ?, ?)",
+            (chat_id, tipo, total, agora)
+        ).lastrowid
+        if imagem is not None:
+            conexao.execute(
+                "INSERT INTO jobs (pedido_id, chat_id, tipo, conteudo, prioridade, debug_level, criado_em) VALUES (?, ?, 'imagem', ?, ?, ?, ?)",
+                (pedido_id, chat_id, imagem, prioridade, debug_level, agora)
+            )
+        else:
+            conexao.executemany(
+                "INSERT INTO jobs (pedido_id, chat_id, tipo, chave, is_sat, prioridade, debug_level, criado_em) VALUES (?, ?, 'chave', ?, ?, ?, ?, ?)",
+                [(pedido_id, chat_id, chave, int(is_sat), prioridade, debug_level, agora) for chave, is_sat in chaves]
+            )
+    logging.debug(f"Pedido {pedido_id} ({tipo}) aberto para o chat {chat_id}")
+    return pedido_id
+
+@_operacao
+def proximo_job(worker):
+    """Reserva para o worker o job de maior prioridade, incluindo os de lease vencido; None se não houver.
+
+    Uma chave que já está em consulta em outro job espera: quando ela terminar, o job usa o resultado
+    gravado. Um job que já venceu MAXIMO_TENTATIVAS leases volta com "desistir" = True, para o worker
+    encerrá-lo como falha em vez de consultar de novo.
+    """
+    agora = time.time()
+    with _transacao() as conexao:
+        job = conexao.execute(
+            """SELECT * FROM jobs
+               WHERE (estado = ? OR (estado = ? AND lease_ate < ?))
+                 AND (chave IS NULL OR chave NOT IN (
+                     SELECT chave FROM jobs WHERE estado = ? AND lease_ate >= ? AND chave IS NOT NULL))
+               ORDER BY prioridade, id LIMIT 1""",
+            (PENDENTE, EXECUTANDO, agora, EXECUTANDO, agora)
+        ).fetchone()
+        if job is None:
+            return None
+        conexao.execute(
+            "UPDATE jobs SET estado = ?, worker = ?, lease_ate = ?, tentativas = tentativas + 1, iniciado_em = ? WHERE id = ?",
+            (EXECUTANDO, worker, agora + LEASE_SEGUNDOS, agora, job["id"])
+        )
+    job = dict(job)
+    if job["estado"] == EXECUTANDO:
+        logging.warning(f"Job {job['id']} reatribuído a {worker}: o lease de {job['worker']} venceu")
+    job["tentativas"] += 1
+    job["desistir"] = job["tentativas"] > MAXIMO_TENTATIVAS
+    job["worker"] = worker
+    return job
+
+def _fechar_pedido(conexao, pedido_id):
+    # Na mesma transação que encerrou o job: só um worker recebe o pedido completo para responder
+    pedido = conexao.execute("SELECT * FROM pedidos WHERE id = ?", (pedido_id,)).fetchone()
+    if pedido is None or pedido["respondido"] or pedido["total"] is None:
+        return None
+    jobs = [dict(job) for job in conexao.execute(
+        "SELECT id, chave, is_sat, estado FROM jobs WHERE pedido_id = ? AND tipo = 'chave' ORDER BY id", (pedido_id,)
+    )]
+    if sum(1 for job in jobs if job["estado"] in (CONCLUIDO, FALHOU)) < pedido["total"]:
+        return None
+    conexao.execute("UPDATE pedidos SET respondido = 1 WHERE id = ?", (pedido_id,))
+    return {"id": pedido_id, "chat_id": pedido["chat_id"], "tipo": pedido["tipo"], "jobs": jobs}
+
+def _encerrar(conexao, job_id, worker, estado):
+    cursor = conexao.execute(
+        "UPDATE jobs SET estado = ?, concluido_em = ?, conteudo = NULL WHERE id = ? AND worker = ? AND estado = ?",
+        (estado, time.time(), job_id, worker, EXECUTANDO)
+    )
+    return cursor.rowcount == 1
+
+@_operacao
+def concluir_job(job_id, worker, sucesso=True):
+    """Encerra o job; devolve o pedido completo (para o worker responder) quando este era o último job dele.
+
+    Se o lease já passou para outro worker, nada muda: quem responde é o dono atual.
+    """
+    with _transacao() as conexao:
+        if not _encerrar(conexao, job_id, worker, CONCLUIDO if sucesso else FALHOU):
+            logging.warning(f"Job {job_id} não pertence mais a {worker}; conclusão ignorada")
+            return None
+        pedido_id = conexao.execute("SELECT pedido_id FROM jobs WHERE id = ?", (job_id,)).fetchone()["pedido_id"]
+        return _fechar_pedido(conexao, pedido_id)
+
+@_operacao
+def expandir_pedido(job_id, worker, chaves):
+    """Troca o job da foto por um job para cada chave [(chave, is_sat), ...] lida nos QR codes."""
+    with _transacao() as conexao:
+        job = conexao.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not _encerrar(conexao, job_id, worker, CONCLUIDO):
+            return None
+        conexao.executemany(
+            "INSERT INTO jobs (pedido_id, chat_id, tipo, chave, is_sat, prioridade, debug_level, criado_em) VALUES (?, ?, 'chave', ?, ?, ?, ?, ?)",
+            [(job["pedido_id"], job["chat_id"], chave, int(is_sat), job["prioridade"], job["debug_level"], time.time()) for chave, is_sat in chaves]
+        )
+        conexao.execute("UPDATE pedidos SET total = ? WHERE id = ?", (len(chaves), job["pedido_id"]))
+        # Foto sem chaves: o pedido já está completo
+        return _fechar_pedido(conexao, job["pedido_id"])
+
+@_operacao
+def gravar_resultado(chave, is_sat, linhas, job_id, novo):
+    """Grava o recibo da chave (linhas da aba DADOS); o primeiro resultado gravado vale."""
+    with _transacao() as conexao:
+        conexao.execute(
+            "INSERT OR IGNORE INTO resultados (chave, is_sat, linhas, job_id, novo, concluido_em) VALUES (?, ?, ?, ?, ?, ?)",
+            (chave, int(is_sat), json.dumps(linhas, ensure_ascii=False), job_id, int(novo), time.time())
+        )
+
+@_operacao
+def resultado(chave):
+    linha = _conexao().execute("SELECT * FROM resultados WHERE chave = ?", (chave,)).fetchone()
+    if linha is None:
+        return None
+    dados = dict(linha)
+    dados["linhas"] = json.loads(dados["linhas"])
+    return dados
+
+@_operacao
+def heartbeat(worker, job_ids):
+    """Renova o lease dos jobs do worker; devolve os que ainda são dele."""
+    agora = time.time()
+    with _transacao() as conexao:
+        conexao.execute(
+            "INSERT OR REPLACE INTO workers (nome, maquina, em_andamento, heartbeat) VALUES (?, ?, ?, ?)",
+            (worker, worker.rsplit("-", 1)[0], len(job_ids), agora)
+        )
+        mantidos = []
+        for job_id in job_ids:
+            cursor = conexao.execute(
+                "UPDATE jobs SET lease_ate = ? WHERE id = ? AND worker = ? AND estado = ?",
+                (agora + LEASE_SEGUNDOS, job_id, worker, EXECUTANDO)
+            )
+            if cursor.rowcount:
+                mantidos.append(job_id)
+    return mantidos
+
+@_operacao
+def registrar_captcha(job_id, chat_id):
+    """Registra um CAPTCHA enviado ao chat; a resposta chega por responder_captcha."""
+    with _transacao() as conexao:
+        cursor = conexao.execute(
+            "INSERT INTO captchas (job_id, chat_id, criado_em) VALUES (?, ?, ?)",
+            (job_id, chat_id, time.time())
+        )
+    return cursor.lastrowid
+
+@_operacao
+def resposta_captcha(captcha_id):
+    linha = _conexao().execute("SELECT resposta FROM captchas WHERE id = ?", (captcha_id,)).fetchone()
+    return linha["resposta"] if linha is not None else None
+
+@_operacao
+def descartar_captcha(captcha_id):
+    with _transacao() as conexao:
+        conexao.execute("DELETE FROM captchas WHERE id = ?", (captcha_id,))
+
+def aguardar_captcha(captcha_id, timeout):
+    """Espera a resposta do CAPTCHA por até timeout segundos (None se não vier)."""
+    limite = time.time() + timeout
+    try:
+        while True:
+            resposta = resposta_captcha(captcha_id)
+            if resposta is not None or time.time() >= limite:
+                return resposta
+            time.sleep(INTERVALO_CONSULTA)
+    finally:
+        descartar_captcha(captcha_id)
+
+@_operacao
+def responder_captcha(chat_id, texto):
+    """Entrega o texto ao CAPTCHA mais antigo sem resposta do chat; False se não houver nenhum."""
+    with _transacao() as conexao:
+        captcha = conexao.execute(
+            "SELECT id FROM captchas WHERE chat_id = ? AND resposta IS NULL ORDER BY id LIMIT 1",
+            (chat_id,)
+        ).fetchone()
+        if captcha is None:
+            return False
+        conexao.execute("UPDATE captchas SET resposta = ? WHERE id = ?", (texto, captcha["id"]))
+    return True
+
+@_operacao
+def contagem_jobs():
+    """Jobs por estado (pendente, executando, concluido, falhou)."""
+    return dict(_conexao().execute("SELECT estado, COUNT(*) FROM jobs GROUP BY estado").fetchall())
+
+@_operacao
+def medicao_jobs(depois_de=0):
+    """Para os jobs com id > depois_de: encerrados, reatribuídos (mais de um lease) e o intervalo
+    entre o primeiro início e o último fim; "ultimo_id" é o maior id da fila."""
+    conexao = _conexao()
+    linha = conexao.execute(
+        """SELECT COUNT(*) AS encerrados, SUM(tentativas > 1) AS reatribuidos,
+                  MIN(iniciado_em) AS inicio, MAX(concluido_em) AS fim
+           FROM jobs WHERE id > ? AND estado IN (?, ?)""",
+        (depois_de, CONCLUIDO, FALHOU)
+    ).fetchone()
+    medicao = dict(linha)
+    medicao["reatribuidos"] = medicao["reatribuidos"] or 0
+    medicao["ultimo_id"] = conexao.execute("SELECT COALESCE(MAX(id), 0) FROM jobs").fetchone()[0]
+    return medicao
+
+@_operacao
+def resumo_fila():
+    contagem = contagem_jobs()
+    ativos = _conexao().execute(
+        "SELECT COUNT(*) FROM workers WHERE heartbeat >= ?", (time.time() - 3 * LEASE_SEGUNDOS,)
+    ).fetchone()[0]
+    return f"{contagem.get(PENDENTE, 0)} na fila, {contagem.get(EXECUTANDO, 0)} em consulta, {ativos} worker(s) ativo(s)"
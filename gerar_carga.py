@@ -0,0 +1,113 @@
+import argparse
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+import fila_jobs
+
+# Gerador de carga da fila de consultas: mede jobs por minuto conforme o número de workers cresce.
+# Uso: python gerar_carga.py --workers 1,2,4,8 --jobs 200 --duracao 0.5
+#   Cada rodada usa uma fila nova (--arquivo, padrão carga.db), enfileira --jobs chaves fictícias
+#   e sobe N processos "worker.py --simulado DURACAO" (a consulta vira uma espera, sem Chrome).
+#   --derrubar mata um worker no meio de cada rodada: os jobs dele voltam à fila quando o lease vence.
+#   --externo N não sobe workers: enfileira e mede com os N workers já rodando (inclusive em outras
+#   máquinas, via broker_fila.py); aí a fila é a de FILA_URL/FILA_ARQUIVO, não a --arquivo.
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+
+def chaves_ficticias(quantidade):
+    """Chaves de 44 dígitos com modelo 65 (NFCe) nas posições 21-22, sem repetição."""
+    chaves = set()
+    while len(chaves) < quantidade:
+        digitos = "".join(random.choices("0123456789", k=42))
+        chaves.add(digitos[:20] + "65" + digitos[20:])
+    return sorted(chaves)
+
+def subir_workers(quantidade, duracao, ambiente):
+    return [
+        subprocess.Popen(
+            [sys.executable, os.path.join(PASTA, "worker.py"), "--simulado", str(duracao)],
+            env=ambiente, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        for _ in range(quantidade)
+    ]
+
+def rodada(workers, jobs, duracao, arquivo=None, derrubar=False, externo=False):
+    ambiente = None
+    if not externo:
+        for sufixo in ("", "-wal", "-shm"):
+            if os.path.exists(arquivo + sufixo):
+                os.remove(arquivo + sufixo)
+        fila_jobs.usar_arquivo(arquivo)
+        ambiente = dict(os.environ, FILA_ARQUIVO=arquivo, FILA_LEASE=str(fila_jobs.LEASE_SEGUNDOS))
+        ambiente.pop("FILA_URL", None)
+    ultimo_id = fila_jobs.medicao_jobs()["ultimo_id"]
+
+    # Cada chave é um pedido, como se viesse de um usuário; prioridade de lote para não passar
+    # na frente das consultas reais quando a fila é compartilhada
+    for chave in chaves_ficticias(jobs):
+        fila_jobs.criar_pedido(None, "chave", chaves=[(chave, False)], prioridade=fila_jobs.PRIORIDADE_LOTE)
+
+    processos = [] if externo else subir_workers(workers, duracao, ambiente)
+    limite = time.time() + 60 + 3 * jobs * duracao / workers + (2 * fila_jobs.LEASE_SEGUNDOS if derrubar else 0)
+    derrubado = False
+    try:
+        while True:
+            encerrados = fila_jobs.medicao_jobs(ultimo_id)["encerrados"]
+            if encerrados >= jobs:
+                break
+            if time.time() > limite:
+                logging.error(f"Rodada com {workers} worker(s) não terminou a tempo ({encerrados}/{jobs} jobs)")
+                break
+            if derrubar and not derrubado and processos and encerrados >= jobs // 2:
+                processos[0].kill()
+                derrubado = True
+                logging.info(f"Worker derrubado com {encerrados}/{jobs} jobs encerrados; aguardando o lease vencer")
+            time.sleep(0.2)
+    finally:
+        for processo in processos:
+            processo.terminate()
+        for processo in processos:
+            processo.wait()
+
+    medicao = fila_jobs.medicao_jobs(ultimo_id)
+    segundos = max((medicao["fim"] or 0) - (medicao["inicio"] or 0), 1e-9)
+    return {
+        "workers": workers,
+        "jobs": medicao["encerrados"],
+        "segundos": segundos,
+        "jobs_por_minuto": medicao["encerrados"] * 60 / segundos,
+        "reatribuidos": medicao["reatribuidos"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede a vazão da fila de consultas (jobs/min) com 1, 2, 4... workers")
+    parser.add_argument("--workers", default="1,2,4,8", help="Quantidades de workers, separadas por vírgula (padrão 1,2,4,8)")
+    parser.add_argument("--jobs", type=int, default=200, help="Jobs por rodada (padrão 200)")
+    parser.add_argument("--duracao", type=float, default=0.5, help="Segundos de cada consulta simulada (padrão 0.5)")
+    parser.add_argument("--arquivo", default="carga.db", help="Arquivo da fila usado nas rodadas (padrão carga.db)")
+    parser.add_argument("--derrubar", action="store_true", help="Mata um worker no meio de cada rodada")
+    parser.add_argument("--externo", type=int, metavar="N", help="Não sobe workers: mede com os N workers já ligados à fila")
+    args = parser.parse_args()
+
+    if args.externo:
+        rodadas = [rodada(args.externo, args.jobs, args.duracao, externo=True)]
+    else:
+        rodadas = [rodada(int(n), args.jobs, args.duracao, args.arquivo, args.derrubar) for n in args.workers.split(",")]
+
+    base = rodadas[0]["jobs_por_minuto"] / rodadas[0]["workers"]
+    print(f"{'workers':>7} {'jobs':>6} {'segundos':>9} {'jobs/min':>9} {'aceleração':>10} {'eficiência':>10} {'reatribuídos':>12}")
+    for r in rodadas:
+        aceleracao = r["jobs_por_minuto"] / rodadas[0]["jobs_por_minuto"]
+        eficiencia = r["jobs_por_minuto"] / (base * r["workers"])
+        print(f"{r['workers']:>7} {r['jobs']:>6} {r['segundos']:>9.1f} {r['jobs_por_minuto']:>9.0f} {aceleracao:>9.2f}x {eficiencia:>10.0%} {r['reatribuidos']:>12}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import argparse
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from extratores import log, tipo_de_pagina, extrair_dados_nfce, extrair_dados_sat, extrair_chave_acesso
+from modelo import CATEGORIAS, Recibo, centavos, data_da_compra, numero
+import planilha
+import limitador
+import estatisticas_precos
+import contas
+
+# Importação em massa de históricos para as abas DADOS e chaves44:
+#   - páginas salvas dos portais (debug_nfce.html, debug_sat.html, ...)
+#   - backups NFCes_backup_*.csv gerados a cada gravação
+#   - arquivos .txt com chaves de 44 dígitos (uma ou várias por linha)
+# Uso: python importador.py pasta_ou_arquivo [...] [--processos N] [--lote 5000] [--debug 1]
+
+COLUNAS_DADOS = 15
+# O backup não usa aspas. Dinheiro e quantidade copiados da planilha podem vir com vírgula decimal
+# ("4,99", "0,850"), e a empresa, o nome curto e a descrição podem ter vírgulas no texto.
+_PADRAO_NUMERO = re.compile(r"^-?(?:R\$\s*)?\d[\d.]*$")
+_PADRAO_CENTAVOS = re.compile(r"^\d{1,2}$")
+_PADRAO_DECIMAIS = re.compile(r"^\d{1,4}$")
+_PADRAO_HORA = re.compile(r"^\d{1,2}:\d{2}(?::\d{2})?$")
+_PADRAO_CNPJ = re.compile(r"^\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}$")
+_SEM_CNPJ = ("", "N/A", "Não encontrado")
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+def listar_arquivos(caminhos):
+    arquivos = {"html": [], "csv": [], "txt": []}
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            nomes = [os.path.join(raiz, nome) for raiz, _, nomes in os.walk(caminho) for nome in nomes]
+        else:
+            nomes = [caminho]
+        for nome in sorted(nomes):
+            extensao = os.path.splitext(nome)[1].lower()
+            if extensao in (".html", ".htm"):
+                arquivos["html"].append(nome)
+            elif extensao == ".csv":
+                arquivos["csv"].append(nome)
+            elif extensao == ".txt":
+                arquivos["txt"].append(nome)
+    return arquivos
+
+def analisar_html(caminho):
+    # Executada nos processos do pool: usa só os extratores, sem navegador nem planilha
+    with open(caminho, encoding="utf-8", errors="ignore") as f:
+        html = f.read()
+    tipo = tipo_de_pagina(html)
+    if tipo is None:
+        return caminho, None
+    extrair = extrair_dados_sat if tipo == "sat" else extrair_dados_nfce
+    return caminho, extrair(html, chave=extrair_chave_acesso(html))
+
+def _sem_digitos(texto):
+    # "N/A", "Não encontrado": valores de quando o portal não trouxe o campo
+    return not re.search(r"\d", texto)
+
+def _valor(campos, fim, partes, padrao_decimais):
+    """O número que termina em campos[fim - 1] ocupando `partes` campos (2 = vírgula decimal), ou None."""
+    if fim - partes < 0:
+        return None
+    pedaco = campos[fim - partes:fim]
+    if not _PADRAO_NUMERO.match(pedaco[0].strip()):
+        return None
+    if partes == 2:
+        # "1.234,56": com vírgula decimal, o ponto só pode separar milhares
+        if ("." in pedaco[0] and not re.search(r"\.\d{3}$", pedaco[0])) or not padrao_decimais.match(pedaco[1].strip()):
+            return None
+    return ",".join(pedaco)
+
+def _montar_linha(campos):
+    """Refaz as 15 colunas de uma linha do backup cortada em todas as vírgulas; None se não encaixar."""
+    if campos[-1].strip().lower() not in ("true", "false"):
+        return None
+    hora, data = campos[-2].strip(), campos[-3].strip()
+    if not (_PADRAO_HORA.match(hora) or _sem_digitos(hora)) or not (data_da_compra(data) or _sem_digitos(data)):
+        return None
+    encaixes = []
+    # Da direita para a esquerda: valor total, valor unitário, unidade e quantidade, com uma ou duas partes cada
+    for partes_total in (1, 2):
+        fim = len(campos) - 3
+        total = _valor(campos, fim, partes_total, _PADRAO_CENTAVOS)
+        if total is None:
+            continue
+        for partes_unitario in (1, 2):
+            unitario = _valor(campos, fim - partes_total, partes_unitario, _PADRAO_CENTAVOS)
+            posicao_unidade = fim - partes_total - partes_unitario - 1
+            if unitario is None or posicao_unidade < 8 or _PADRAO_NUMERO.match(campos[posicao_unidade].strip()):
+                continue
+            for partes_quantidade in (1, 2):
+                quantidade = _valor(campos, posicao_unidade, partes_quantidade, _PADRAO_DECIMAIS)
+                inicio = posicao_unidade - partes_quantidade
+                if quantidade is None or inicio < 8:
+                    continue
+                # Preço unitário vezes quantidade mais perto do total desempata as leituras possíveis
+                diferenca = abs(centavos(unitario) * numero(quantidade) - centavos(total))
+                encaixes.append((diferenca, campos[:inicio], [quantidade, campos[posicao_unidade], unitario, total]))
+    if not encaixes:
+        return None
+    _, esquerda, meio = min(encaixes, key=lambda encaixe: encaixe[0])
+    # À esquerda, o CNPJ separa a empresa (que pode ter vírgulas) do número do recibo. Sem CNPJ
+    # ("N/A" quando o portal não trouxe o emitente) não há âncora: a empresa fica só na primeira coluna
+    cnpj = next((i for i in range(1, len(esquerda)) if _PADRAO_CNPJ.match(esquerda[i].strip())), None)
+    if cnpj is None:
+        if esquerda[1].strip() not in _SEM_CNPJ:
+            return None
+        cnpj = 1
+    # A categoria (valores fixos) separa o nome curto da descrição, que também podem ter vírgulas
+    categoria = next((i for i in range(cnpj + 5, len(esquerda) - 1) if esquerda[i] in CATEGORIAS), None)
+    if categoria is None:
+        return None
+    return (
+        [",".join(esquerda[:cnpj])] + esquerda[cnpj:cnpj + 4]
+        + [",".join(esquerda[cnpj + 4:categoria]), esquerda[categoria], ",".join(esquerda[categoria + 1:])]
+        + meio + campos[-3:]
+    )
+
+def ler_backup_csv(caminho):
+    """Lê um NFCes_backup_*.csv e devolve as linhas no formato da aba DADOS; as que não encaixam são descartadas."""
+    linhas = []
+    descartadas = 0
+    with open(caminho, encoding="utf-8") as f:
+        for numero_linha, texto in enumerate(f):
+            row = texto.rstrip("\n").split(",")
+            if numero_linha == 0 and row and row[0].strip() == "Empresa":
+                continue
+            if len(row) < COLUNAS_DADOS:
+                descartadas += bool(texto.strip())
+                continue
+            row = _montar_linha(row)
+            if row is None:
+                descartadas += 1
+                logging.warning(f"{caminho}, linha {numero_linha + 1}: colunas não reconhecidas, linha ignorada")
+                continue
+            linhas.append(row)
+    if descartadas:
+        logging.warning(f"{caminho}: {descartadas} linha(s) ignoradas")
+    return linhas
+
+def ler_lista_chaves(caminho):
+    with open(caminho, encoding="utf-8") as f:
+        texto = f.read()
+    # Aceita chaves com espaços a cada 4 dígitos e o prefixo "s" de SAT
+    return [re.sub(r"\s+", "", m) for m in re.findall(r"(?<![\dA-Za-z])[sS]?(?:\d{4}\s?){10}\d{4}(?!\d)", texto)]
+
+def gravar_em_lotes(aba, linhas, tamanho_lote):
+    for inicio in range(0, len(linhas), tamanho_lote):
+        limitador.executar("sheets_escrita", aba.append_rows, linhas[inicio:inicio + tamanho_lote], value_input_option="RAW")
+    planilha.anotar_escrita(aba)
+
+def importar(caminhos, processos=None, tamanho_lote=5000, debug_level=0):
+    # Importação é trabalho em lote: não disputa o orçamento das consultas do bot
+    limitador.definir_prioridade_padrao(limitador.PRIORIDADE_LOTE)
+    arquivos = listar_arquivos(caminhos)
+    logging.info(f"Arquivos encontrados: {len(arquivos['html'])} HTML, {len(arquivos['csv'])} CSV, {len(arquivos['txt'])} listas de chaves")
+    inicio = time.perf_counter()
+
+    # 1. Extração em paralelo das páginas salvas
+    recibos_html = []
+    if arquivos["html"]:
+        with ProcessPoolExecutor(max_workers=processos) as executor:
+            for caminho, recibo in executor.map(analisar_html, arquivos["html"], chunksize=16):
+                if recibo is None:
+                    log(f"{caminho}: página não reconhecida como NFCe ou SAT, ignorada.", debug_level)
+                    continue
+                recibos_html.append(recibo)
+    tempo_extracao = time.perf_counter() - inicio
+    if recibos_html:
+        logging.info(f"{len(recibos_html)} recibos extraídos do HTML em {tempo_extracao:.2f}s ({len(recibos_html) / max(tempo_extracao, 1e-9):.1f} recibos/s)")
+
+    linhas_csv = [row for caminho in arquivos["csv"] for row in ler_backup_csv(caminho)]
+    chaves_txt = [chave for caminho in arquivos["txt"] for chave in ler_lista_chaves(caminho)]
+
+    # Só aqui a planilha é necessária (os processos do pool não precisam autenticar)
+    import nfce_automation
+
+    # 2. Deduplicação em uma única passada contra o que já está na planilha (todas as partições)
+    chaves_sheet = nfce_automation.chaves_sheet
+    chaves_existentes = {row[0].strip() for row in planilha.ler_colunas(chaves_sheet, (0,)) if row}
+    recibos_existentes = {
+        (row[2].strip(), row[1].strip())
+        for aba in nfce_automation.contas_chat.todas_as_abas()
+        for row in planilha.ler_colunas(aba, nfce_automation.COLUNAS_DUPLICATAS) if len(row) > 2
+    }
+
+    novas_linhas = []
+    novas_chaves = []
+    novos = []
+    # Linhas de backup são agrupadas por recibo (NumeroRecibo + CNPJ) e convertidas para o mesmo modelo
+    recibos_csv = {}
+    for row in linhas_csv:
+        recibos_csv.setdefault((row[2].strip(), row[1].strip()), []).append(row)
+    recibos = recibos_html + [Recibo.de_linhas(rows) for rows in recibos_csv.values()]
+
+    for recibo in recibos:
+        identificador = (recibo.numero, recibo.cnpj)
+        if recibo.chave in chaves_existentes or identificador in recibos_existentes or not recibo.itens:
+            continue
+        novas_linhas.extend(recibo.linhas_planilha())
+        recibos_existentes.add(identificador)
+        novos.append(recibo)
+        if recibo.chave:
+            novas_chaves.append([recibo.chave, recibo.numero])
+            chaves_existentes.add(recibo.chave)
+
+    # 3. Gravação em poucas requisições grandes
+    if novas_linhas:
+        nfce_automation.salvar_backup(novas_linhas)
+        for aba, linhas in nfce_automation.roteador.agrupar(novas_linhas):
+            gravar_em_lotes(aba, linhas, tamanho_lote)
+            nfce_automation.roteador.contar(aba, len(linhas))
+    if novas_chaves:
+        gravar_em_lotes(chaves_sheet, novas_chaves, tamanho_lote)
+    if novos:
+        # Histórico antigo: entra nas estatísticas de preço sem avisar os assinantes
+        estatisticas_precos.registrar_recibos(novos, notificar=False)
+        if contas.ATIVO:
+            contas.registrar(contas.COMPARTILHADA, novos)
+    recibos_novos = len(novos)
+    logging.info(f"✅ {recibos_novos} recibos novos ({len(novas_linhas)} linhas) gravados na aba DADOS e {len(novas_chaves)} chaves na aba chaves44")
+
+    # 4. Chaves soltas precisam de consulta nos portais (com CAPTCHA)
+    chaves_pendentes = list(dict.fromkeys(c for c in chaves_txt if c[-44:] not in chaves_existentes))
+    if chaves_pendentes:
+        logging.info(f"{len(chaves_pendentes)} chaves da lista ainda não processadas, consultando nos portais...")
+        tamanho_consulta = nfce_automation.TAMANHO_POOL_NAVEGADORES
+        for i in range(0, len(chaves_pendentes), tamanho_consulta):
+            resultados = nfce_automation.processar_recibos(codigos=chaves_pendentes[i:i + tamanho_consulta], debug_level=debug_level)
+            recibos_novos += sum(1 for _, recibo in resultados if recibo)
+
+    duracao = time.perf_counter() - inicio
+    logging.info(f"Importação concluída em {duracao:.2f}s: {recibos_novos} recibos novos ({recibos_novos / max(duracao, 1e-9):.1f} recibos/s)")
+    return recibos_novos
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa históricos (HTML salvos, backups CSV e listas de chaves) para a planilha")
+    parser.add_argument("caminhos", nargs="+", help="Arquivos ou pastas a importar")
+    parser.add_argument("--processos", type=int, default=None, help="Processos para extrair o HTML (padrão: número de CPUs)")
+    parser.add_argument("--lote", type=int, default=5000, help="Linhas por requisição de gravação (padrão 5000)")
+    parser.add_argument("--debug", type=int, default=0, choices=[0, 1], help="Nível de debug: 0 (mínimo), 1 (completo)")
+    args = parser.parse_args()
+    importar(args.caminhos, processos=args.processos, tamanho_lote=args.lote, debug_level=args.debug)
+
+if __name__ == "__main__":
+    main()
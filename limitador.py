@@ -0,0 +1,225 @@
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# Limitador central de requisições (token bucket) para o Google Sheets e os portais da Fazenda.
+# O estado dos baldes fica em LIMITADOR_ARQUIVO, protegido por um arquivo de trava, então o bot,
+# o importador e o processamento da pasta recibos/ dividem o mesmo orçamento.
+#   - Cada recurso tem um orçamento "requisições/segundos" (ex.: LIMITE_SHEETS_LEITURA=60/60).
+#   - Consultas interativas (bot) têm prioridade: trabalhos em lote (importador, pasta recibos/)
+#     só usam o balde acima de RESERVA_INTERATIVA e cedem a vez a quem está esperando no processo.
+#   - Um 429 (ou Retry-After) bloqueia o recurso para todos os processos, com espera exponencial.
+ARQUIVO_ESTADO = os.getenv("LIMITADOR_ARQUIVO", "limitador.json")
+ARQUIVO_TRAVA = ARQUIVO_ESTADO + ".lock"
+PASTA_METRICAS = os.getenv("LIMITADOR_METRICAS", "")
+RESERVA_INTERATIVA = float(os.getenv("LIMITADOR_RESERVA", "0.25"))
+TENTATIVAS = int(os.getenv("LIMITADOR_TENTATIVAS", "5"))
+ESPERA_MAXIMA_429 = 64
+
+PRIORIDADE_INTERATIVA = 0
+PRIORIDADE_LOTE = 1
+
+def _orcamento(nome, padrao):
+    quantidade, segundos = os.getenv(f"LIMITE_{nome.upper()}", padrao).split("/")
+    return float(quantidade), float(segundos)
+
+# recurso -> (capacidade do balde, período em segundos para encher)
+ORCAMENTOS = {
+    "sheets_leitura": _orcamento("sheets_leitura", "60/60"),  # cota padrão do Sheets por usuário
+    "sheets_escrita": _orcamento("sheets_escrita", "60/60"),
+    "portal_nfce": _orcamento("portal_nfce", "6/60"),
+    "portal_sat": _orcamento("portal_sat", "6/60"),
+}
+
+_lock = threading.Lock()
+_local = threading.local()
+_prioridade_padrao = PRIORIDADE_INTERATIVA
+# recurso -> número de threads interativas esperando neste processo
+_interativos_esperando = {}
+contadores = {recurso: {"requisicoes": 0, "esperas": 0, "segundos_espera": 0.0, "erros_429": 0} for recurso in ORCAMENTOS}
+_metricas_gravadas_em = 0
+
+@contextlib.contextmanager
+def trava_arquivo(caminho=ARQUIVO_TRAVA):
+    """Trava exclusiva entre processos, num arquivo .lock ao lado do estado."""
+    with open(caminho, "a+b") as trava:
+        if os.name == "nt":
+            import msvcrt
+            trava.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(trava.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK desiste depois de ~10s; continua tentando
+                    continue
+            try:
+                yield
+            finally:
+                trava.seek(0)
+                msvcrt.locking(trava.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(trava.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(trava.fileno(), fcntl.LOCK_UN)
+
+def _ler_estado():
+    try:
+        with open(ARQUIVO_ESTADO, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _gravar_estado(estado):
+    with open(ARQUIVO_ESTADO, "w", encoding="utf-8") as f:
+        json.dump(estado, f)
+
+def _balde(estado, recurso, agora):
+    capacidade, periodo = ORCAMENTOS[recurso]
+    balde = estado.setdefault(recurso, {"fichas": capacidade, "atualizado": agora, "bloqueado_ate": 0, "falhas": 0, "ultimo_429": 0})
+    balde["fichas"] = min(capacidade, balde["fichas"] + (agora - balde["atualizado"]) * capacidade / periodo)
+    balde["atualizado"] = agora
+    return balde
+
+def definir_prioridade_padrao(prioridade):
+    """Prioridade do processo (o importador e a pasta recibos/ usam PRIORIDADE_LOTE)."""
+    global _prioridade_padrao
+    _prioridade_padrao = prioridade
+
+@contextlib.contextmanager
+def prioridade(valor):
+    """Muda a prioridade só na thread atual, dentro do bloco with."""
+    anterior = getattr(_local, "prioridade", None)
+    _local.prioridade = valor
+    try:
+        yield
+    finally:
+        _local.prioridade = anterior
+
+def prioridade_atual():
+    valor = getattr(_local, "prioridade", None)
+    return _prioridade_padrao if valor is None else valor
+
+def _tentar(recurso, prioridade_pedido):
+    """Tenta tirar uma ficha do balde; devolve 0 se conseguiu ou quantos segundos esperar."""
+    capacidade, periodo = ORCAMENTOS[recurso]
+    minimo = 1 + (capacidade * RESERVA_INTERATIVA if prioridade_pedido != PRIORIDADE_INTERATIVA else 0)
+    with trava_arquivo():
+        agora = time.time()
+        estado = _ler_estado()
+        balde = _balde(estado, recurso, agora)
+        if balde["bloqueado_ate"] > agora:
+            espera = balde["bloqueado_ate"] - agora
+        # Folga para o arredondamento do reabastecimento: sem ela, 0.9999999 ficha vira espera de 1e-15s em laço
+        elif balde["fichas"] + 1e-6 >= min(minimo, capacidade):
+            balde["fichas"] = max(0.0, balde["fichas"] - 1)
+            espera = 0
+        else:
+            espera = (min(minimo, capacidade) - balde["fichas"]) * periodo / capacidade
+        _gravar_estado(estado)
+    return espera
+
+def aguardar(recurso):
+    """Bloqueia a thread até haver orçamento para uma requisição ao recurso."""
+    prioridade_pedido = prioridade_atual()
+    interativo = prioridade_pedido == PRIORIDADE_INTERATIVA
+    if interativo:
+        with _lock:
+            _interativos_esperando[recurso] = _interativos_esperando.get(recurso, 0) + 1
+    inicio = time.perf_counter()
+    try:
+        while True:
+            with _lock:
+                ceder = not interativo and _interativos_esperando.get(recurso, 0) > 0
+            espera = 0.05 if ceder else _tentar(recurso, prioridade_pedido)
+            if not espera:
+                break
+            time.sleep(min(espera, 1.0))
+    finally:
+        if interativo:
+            with _lock:
+                _interativos_esperando[recurso] -= 1
+    esperou = time.perf_counter() - inicio
+    with _lock:
+        contador = contadores[recurso]
+        contador["requisicoes"] += 1
+        if esperou > 0.01:
+            contador["esperas"] += 1
+            contador["segundos_espera"] += esperou
+    if esperou > 1:
+        logging.info(f"Limitador: {recurso} aguardou {esperou:.1f}s ({'interativo' if interativo else 'lote'})")
+    _exportar_metricas()
+
+def registrar_429(recurso, retry_after=None):
+    """Bloqueia o recurso para todos os processos: Retry-After quando informado, senão espera exponencial."""
+    with trava_arquivo():
+        agora = time.time()
+        estado = _ler_estado()
+        balde = _balde(estado, recurso, agora)
+        balde["falhas"] = balde["falhas"] + 1 if agora - balde["ultimo_429"] < 60 else 1
+        balde["ultimo_429"] = agora
+        espera = float(retry_after) if retry_after else min(ESPERA_MAXIMA_429, 2 ** (balde["falhas"] - 1))
+        balde["bloqueado_ate"] = max(balde["bloqueado_ate"], agora + espera)
+        balde["fichas"] = 0
+        _gravar_estado(estado)
+    with _lock:
+        contadores[recurso]["erros_429"] += 1
+    logging.warning(f"Limitador: {recurso} respondeu 429, pausado por {espera:.0f}s")
+
+def _status_http(erro):
+    resposta = getattr(erro, "response", None)
+    status = getattr(resposta, "status_code", None)
+    retry_after = None
+    if resposta is not None and getattr(resposta, "headers", None):
+        valor = resposta.headers.get("Retry-After")
+        if valor and valor.strip().isdigit():
+            retry_after = int(valor)
+    return status, retry_after
+
+def executar(recurso, funcao, *args, **kwargs):
+    """Executa funcao(*args, **kwargs) dentro do orçamento do recurso, repetindo após 429."""
+    for tentativa in range(TENTATIVAS):
+        aguardar(recurso)
+        try:
+            return funcao(*args, **kwargs)
+        except Exception as e:
+            status, retry_after = _status_http(e)
+            if status != 429 or tentativa == TENTATIVAS - 1:
+                raise
+            registrar_429(recurso, retry_after)
+
+def metricas():
+    """Contadores no formato texto do Prometheus."""
+    linhas = []
+    with _lock:
+        for nome, tipo in (("requisicoes", "counter"), ("esperas", "counter"), ("segundos_espera", "counter"), ("erros_429", "counter")):
+            linhas.append(f"# TYPE limitador_{nome} {tipo}")
+            for recurso, contador in contadores.items():
+                linhas.append(f'limitador_{nome}{{recurso="{recurso}",processo="{_nome_processo()}"}} {contador[nome]}')
+    return "\n".join(linhas) + "\n"
+
+def _nome_processo():
+    return os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+
+def _exportar_metricas():
+    # Com LIMITADOR_METRICAS=pasta, cada processo grava limitador_<script>.prom (ex.: textfile do node_exporter)
+    global _metricas_gravadas_em
+    if not PASTA_METRICAS or time.time() - _metricas_gravadas_em < 15:
+        return
+    _metricas_gravadas_em = time.time()
+    try:
+        os.makedirs(PASTA_METRICAS, exist_ok=True)
+        destino = os.path.join(PASTA_METRICAS, f"limitador_{_nome_processo()}.prom")
+        temporario = f"{destino}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            f.write(metricas())
+        os.replace(temporario, destino)
+    except OSError as e:
+        logging.error(f"Erro ao exportar métricas do limitador: {e}")
@@ -0,0 +1,137 @@
+import collections
+import json
+import os
+import threading
+import time
+from modelo import Recibo
+
+# Manifesto da execução em lote (python nfce_automation.py): a etapa de cada chave das imagens de
+# recibos/, gravada de forma atômica a cada avanço. Se a execução morrer no meio (Chrome, cota do
+# Sheets...), a próxima retoma cada imagem da última etapa concluída: não lê o QR code de novo,
+# não volta ao portal (nem pede outro CAPTCHA) e não grava duas vezes na aba DADOS.
+# Só as imagens ainda não concluídas ficam no arquivo; sem nenhuma, ele é apagado.
+ARQUIVO_MANIFESTO = os.getenv("MANIFESTO_ARQUIVO", "manifesto_lote.json")
+
+# Etapas de cada chave, em ordem. A consulta e a extração do recibo acontecem juntas
+# (consultar_chave devolve o Recibo pronto), então são uma etapa só.
+DECODIFICADA = "decodificada"
+CONSULTADA = "consultada"
+GRAVADA_DADOS = "gravada_dados"
+GRAVADA_CHAVES44 = "gravada_chaves44"
+ETAPAS = (DECODIFICADA, CONSULTADA, GRAVADA_DADOS, GRAVADA_CHAVES44)
+
+_lock = threading.Lock()
+_manifesto = None  # None fora da execução em lote (bot, worker, vigia...)
+_economia = collections.Counter()
+
+def _gravar():
+    temporario = f"{ARQUIVO_MANIFESTO}.tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(_manifesto, f, ensure_ascii=False)
+    os.replace(temporario, ARQUIVO_MANIFESTO)
+
+def iniciar():
+    """Abre o manifesto da execução, retomando o anterior; devolve quantas imagens ficaram pela metade."""
+    global _manifesto
+    with _lock:
+        try:
+            with open(ARQUIVO_MANIFESTO, encoding="utf-8") as f:
+                _manifesto = json.load(f)
+        except (OSError, ValueError):
+            _manifesto = {"execucao": 0, "imagens": {}, "chaves": {}}
+        # Imagens apagadas (ou renomeadas à mão) desde a última execução não são retomadas
+        for caminho in [caminho for caminho in _manifesto["imagens"] if not os.path.exists(caminho)]:
+            _remover_imagem(caminho)
+        _manifesto["execucao"] += 1
+        _manifesto["iniciada_em"] = time.time()
+        _economia.clear()
+        _gravar()
+        return len(_manifesto["imagens"])
+
+def _remover_imagem(caminho):
+    _manifesto["imagens"].pop(caminho, None)
+    em_uso = {chave for imagem in _manifesto["imagens"].values() for chave in imagem["chaves"]}
+    for chave in [chave for chave in _manifesto["chaves"] if chave not in em_uso]:
+        del _manifesto["chaves"][chave]
+
+def chaves_da_imagem(caminho):
+    """Chaves (chave -> is_sat) lidas da imagem numa execução anterior, ou None."""
+    with _lock:
+        if _manifesto is None or caminho not in _manifesto["imagens"]:
+            return None
+        _economia["decodificacoes"] += 1
+        return dict(_manifesto["imagens"][caminho]["chaves"])
+
+def registrar_chaves(caminho, chaves):
+    with _lock:
+        if _manifesto is None or not chaves:
+            return
+        _manifesto["imagens"][caminho] = {"chaves": chaves}
+        for chave, is_sat in chaves.items():
+            _manifesto["chaves"].setdefault(chave, {"etapa": DECODIFICADA, "is_sat": is_sat})
+        _gravar()
+
+def recibo_consultado(chave):
+    """Recibo extraído numa execução anterior, ainda sem gravação confirmada na aba chaves44; ou None."""
+    with _lock:
+        if _manifesto is None:
+            return None
+        registro = _manifesto["chaves"].get(chave)
+        if not registro or registro["etapa"] not in (CONSULTADA, GRAVADA_DADOS):
+            return None
+        _economia["consultas"] += 1
+        recibo = Recibo.de_linhas(registro["linhas"], is_sat=registro["is_sat"], chave=chave)
+        recibo.is_duplicate = False
+        return recibo
+
+def registrar_etapa(recibos, etapa):
+    """Avança as chaves dos recibos para a etapa (as que não estão no manifesto são ignoradas)."""
+    with _lock:
+        if _manifesto is None:
+            return
+        alterado = False
+        for recibo in recibos:
+            registro = _manifesto["chaves"].get(recibo.chave)
+            if registro is None or ETAPAS.index(registro["etapa"]) >= ETAPAS.index(etapa):
+                continue
+            registro["etapa"] = etapa
+            if etapa == CONSULTADA:
+                registro["linhas"] = recibo.linhas_planilha()
+            alterado = True
+        if alterado:
+            _gravar()
+
+def economizou(tipo, quantidade=1):
+    with _lock:
+        if _manifesto is not None:
+            _economia[tipo] += quantidade
+
+def concluir_imagem(caminho):
+    with _lock:
+        if _manifesto is None or caminho not in _manifesto["imagens"]:
+            return
+        _remover_imagem(caminho)
+        _gravar()
+
+def finalizar():
+    """Fecha o manifesto da execução e devolve o resumo do trabalho poupado pela retomada."""
+    global _manifesto
+    with _lock:
+        if _manifesto is None:
+            return "sem execução em lote ativa"
+        pendentes = len(_manifesto["imagens"])
+        if pendentes:
+            _gravar()
+        elif os.path.exists(ARQUIVO_MANIFESTO):
+            os.remove(ARQUIVO_MANIFESTO)
+        execucao = _manifesto["execucao"]
+        _manifesto = None
+        resumo = f"execução {execucao}"
+        if any(_economia.values()):
+            resumo += (
+                f", retomada sem refazer {_economia['decodificacoes']} leitura(s) de QR code, "
+                f"{_economia['consultas']} consulta(s) aos portais e {_economia['gravacoes_dados']} gravação(ões) na aba DADOS"
+            )
+        if pendentes:
+            resumo += f"; {pendentes} imagem(ns) pela metade ficam no manifesto para a próxima execução"
+        return resumo
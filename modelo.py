@@ -0,0 +1,216 @@
+import re
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Modelo único de recibo e item, usado pela consulta NFCe, pela consulta SAT, pela
+# remontagem de duplicatas a partir da planilha e pelo bot. Valores em dinheiro são
+# inteiros em centavos, convertidos uma única vez na extração.
+
+def gerar_nome_curto(descricao):
+    palavras = descricao.strip().split()
+    ignorar = ["DE", "DA", "DO", "E", "COM", "BARRA", "MINI", "PV"]
+    palavras_filtradas = [p for p in palavras if p.upper() not in ignorar]
+    return (palavras_filtradas[0] + " " + palavras_filtradas[1]).upper() if len(palavras_filtradas) > 1 else palavras_filtradas[0].upper()
+
+def gerar_categoria(descricao):
+    descricao = descricao.lower()
+    if re.search(r'pao|torrada|pizza|torta|panetone', descricao):
+        return "Padaria"
+    if re.search(r'chocolate|choc|biscoito|bombom|doce|gelatina|sorvete|torta|panetone|bis', descricao):
+        return "Doces e Sobremesas"
+    if re.search(r'batata|cenoura|tomate|alface|cebola|abobora|couve|brocolis|pepino', descricao):
+        return "Legumes e Verduras"
+    if re.search(r'acai|achocolatado|cha|cafe|suco|cerveja|coca|refrigerante', descricao):
+        return "Bebidas"
+    if re.search(r'frango|acem|alcatra|carne|bife|peixe|linguica|patinho|paleta', descricao):
+        return "Carnes"
+    if re.search(r'abacate|banana|laranja|limao|mamao|manga|morango|uva|abacaxi|melancia', descricao):
+        return "Frutas"
+    if re.search(r'arroz|feijao|macarrao|farinha|milho|aveia|sal|tempero|oleo|azeite|maionese', descricao):
+        return "Graos e Cereais"
+    if re.search(r'sabao|detergente|amaciante|desinfetante|alcool|toalha|sabonete|veja|esponja', descricao):
+        return "Higiene e Limpeza"
+    if re.search(r'leite|queijo|requeijao|ovo|manteiga|creme de leite|iogurte|yakult', descricao):
+        return "Laticinios"
+    return "Outros"
+
+CATEGORIAS = (
+    "Padaria", "Doces e Sobremesas", "Legumes e Verduras", "Bebidas", "Carnes", "Frutas",
+    "Graos e Cereais", "Higiene e Limpeza", "Laticinios", "Outros",
+)
+
+def _normalizar_numero(valor):
+    texto = str(valor).replace('\xa0', '').replace('R$', '').replace('$', '').replace(' ', '').strip()
+    # O separador decimal é o último entre ponto e vírgula ("1.234,56" e "1,234.56" valem o mesmo)
+    if ',' in texto and '.' in texto:
+        if texto.rfind(',') > texto.rfind('.'):
+            texto = texto.replace('.', '').replace(',', '.')
+        else:
+            texto = texto.replace(',', '')
+    else:
+        texto = texto.replace(',', '.')
+    return re.sub(r'[^\d.-]', '', texto)
+
+def centavos(valor):
+    """Converte um valor em reais ("4,99", "R$ 1.234,56", "9.98", 4.99) para inteiro em centavos."""
+    if valor is None or valor == "":
+        return 0
+    if isinstance(valor, (int, float)):
+        return int(round(valor * 100))
+    try:
+        return int((Decimal(_normalizar_numero(valor)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        return 0
+
+def numero(valor, padrao=0.0):
+    """Converte uma quantidade ("0,850", "2", 1.5) para float."""
+    if valor is None or valor == "":
+        return padrao
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    try:
+        return float(_normalizar_numero(valor))
+    except ValueError:
+        return padrao
+
+# Data da compra como gravada na planilha: AAAA-MM-DD nas NFCe (extrair_emissao) e dd/mm/aaaa nos SAT
+_PADRAO_DATA_ISO = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+_PADRAO_DATA_BR = re.compile(r"(\d{1,2})/(\d{1,2})/(\d{4})")
+
+def data_da_compra(texto):
+    """'2025-04-25' ou '25/04/2025' (com ou sem hora) -> date(2025, 4, 25); None se não for uma data."""
+    texto = str(texto or "")
+    encontrada = _PADRAO_DATA_ISO.search(texto)
+    if encontrada:
+        ano, mes, dia = encontrada.groups()
+    else:
+        encontrada = _PADRAO_DATA_BR.search(texto)
+        if not encontrada:
+            return None
+        dia, mes, ano = encontrada.groups()
+    try:
+        return date(int(ano), int(mes), int(dia))
+    except ValueError:
+        return None
+
+def reais(valor_centavos):
+    return valor_centavos / 100
+
+def formatar_reais(valor_centavos):
+    sinal = "-" if valor_centavos < 0 else ""
+    valor_centavos = abs(valor_centavos)
+    return f"R${sinal}{valor_centavos // 100}.{valor_centavos % 100:02d}"
+
+@dataclass
+class Item:
+    __slots__ = ("codigo", "descricao", "quantidade", "unidade", "vl_unitario", "vl_total", "nome_curto", "categoria")
+    codigo: str
+    descricao: str
+    quantidade: float
+    unidade: str
+    vl_unitario: int  # centavos
+    vl_total: int  # centavos
+    nome_curto: str
+    categoria: str
+
+    @classmethod
+    def criar(cls, codigo, descricao, quantidade, unidade, vl_unitario, vl_total):
+        # nome curto e categoria são derivados uma vez, na criação do item
+        return cls(
+            codigo=codigo,
+            descricao=descricao,
+            quantidade=numero(quantidade, 1.0),
+            unidade=(unidade or "UN").upper(),
+            vl_unitario=centavos(vl_unitario),
+            vl_total=centavos(vl_total),
+            nome_curto=gerar_nome_curto(descricao),
+            categoria=gerar_categoria(descricao),
+        )
+
+@dataclass
+class Recibo:
+    __slots__ = ("chave", "empresa", "cnpj", "numero", "consumidor", "data", "hora", "is_sat", "itens", "endereco", "is_duplicate")
+    chave: object  # str ou None quando a chave não é conhecida (ex.: backups CSV)
+    empresa: str
+    cnpj: str
+    numero: str
+    consumidor: str
+    data: str
+    hora: str
+    is_sat: bool
+    itens: list
+    endereco: str
+    is_duplicate: bool
+
+    @classmethod
+    def criar(cls, empresa, cnpj, numero, consumidor, data, hora, itens, is_sat=False, chave=None, endereco="", is_duplicate=False):
+        return cls(
+            chave=chave, empresa=empresa, cnpj=cnpj, numero=numero, consumidor=consumidor,
+            data=data, hora=hora, is_sat=is_sat, itens=itens, endereco=endereco, is_duplicate=is_duplicate,
+        )
+
+    @property
+    def total(self):
+        """Total do recibo em centavos (soma dos itens)."""
+        return sum(item.vl_total for item in self.itens)
+
+    @classmethod
+    def de_linhas(cls, rows, is_sat=None, chave=None):
+        """Remonta um recibo a partir das linhas da aba DADOS (todas do mesmo recibo)."""
+        primeira = rows[0]
+
+        def coluna(row, indice, padrao="N/A"):
+            return row[indice] if len(row) > indice else padrao
+
+        if is_sat is None:
+            # A coluna 15 (índice 14) guarda "True"/"False"
+            is_sat = str(coluna(primeira, 14, "False")).strip().lower() == "true"
+        itens = [
+            Item(
+                codigo=coluna(row, 4),
+                descricao=coluna(row, 7),
+                quantidade=numero(coluna(row, 8, "")),
+                unidade=coluna(row, 9, "UN"),
+                vl_unitario=centavos(coluna(row, 10, "")),
+                vl_total=centavos(coluna(row, 11, "")),
+                nome_curto=coluna(row, 5),
+                categoria=coluna(row, 6),
+            )
+            for row in rows
+        ]
+        return cls.criar(
+            empresa=coluna(primeira, 0),
+            cnpj=coluna(primeira, 1),
+            numero=coluna(primeira, 2).strip(),
+            consumidor=coluna(primeira, 3),
+            data=coluna(primeira, 12),
+            hora=coluna(primeira, 13),
+            itens=itens,
+            is_sat=is_sat,
+            chave=chave,
+            is_duplicate=True,
+        )
+
+    def linhas_planilha(self):
+        """Linhas no formato da aba DADOS (valores gravados como números em reais)."""
+        return [
+            [
+                self.empresa,
+                self.cnpj,
+                self.numero,
+                self.consumidor,
+                item.codigo,
+                item.nome_curto,
+                item.categoria,
+                item.descricao,
+                item.quantidade,
+                item.unidade,
+                reais(item.vl_unitario),
+                reais(item.vl_total),
+                self.data,
+                self.hora,
+                str(self.is_sat)  # Adiciona se é SAT ou não na última coluna (supondo que seja a coluna 15)
+            ]
+            for item in self.itens
+        ]
@@ -0,0 +1,394 @@
+import argparse
+import calendar
+import collections
+import json
+import logging
+import os
+import re
+import threading
+import time
+import limitador
+import planilha
+from modelo import data_da_compra
+
+# Partições mensais da aba DADOS: as linhas de cada recibo vão para a aba DADOS_AAAA_MM do mês da
+# compra (DADOS_SEM_DATA quando a data não é reconhecida). O roteador decide quais abas cada
+# consulta precisa ler:
+#   - verificação de duplicatas: só o mês do recibo (pela data ou pelos dígitos AAMM da chave);
+#   - insights: só os últimos PARTICOES_MESES_INSIGHTS meses (padrão 12).
+# Enquanto não existe nenhuma partição (antes de rodar a migração), tudo continua na aba DADOS.
+# O manifesto (PARTICOES_ARQUIVO, padrão particoes.json) guarda o intervalo de datas e as linhas de
+# cada partição; ele é só um cache da lista de abas da planilha e é refeito a partir dela quando falta.
+# Ele também anota os meses que a migração já copiou da aba DADOS: até lá, a verificação de
+# duplicatas do mês continua olhando a aba DADOS (e sem o manifesto, olha sempre).
+# Migração da aba DADOS existente: python particoes.py migrar [--esvaziar]
+# Linhas com data que ficaram em DADOS_SEM_DATA voltam para o mês delas: python particoes.py redistribuir
+# O mesmo roteador serve as abas de cada chat (contas.py), com outro prefixo e outro manifesto.
+ARQUIVO_PARTICOES = os.getenv("PARTICOES_ARQUIVO", "particoes.json")
+MESES_INSIGHTS = int(os.getenv("PARTICOES_MESES_INSIGHTS", "12"))
+PREFIXO = "DADOS_"
+COLUNA_DATA = 12  # Data na aba DADOS: AAAA-MM-DD nas NFCe, dd/mm/aaaa nos SAT
+REVISAO_MINIMA = 60  # segundos entre releituras da lista de abas por causa de um mês desconhecido
+
+_PADRAO_MES = re.compile(r"(\d{4})_(\d{2})$")
+
+def mes_da_data(data):
+    """'2025-04-25' ou '25/04/2025' -> '2025_04'; None se a data não for reconhecida."""
+    data = data_da_compra(data)
+    return f"{data.year:04d}_{data.month:02d}" if data else None
+
+def mes_da_linha(linha):
+    return mes_da_data(linha[COLUNA_DATA] if len(linha) > COLUNA_DATA else None)
+
+def mes_da_chave(chave):
+    """Mês de emissão gravado na chave de acesso (posições 3-6, AAMM)."""
+    if not chave or len(chave) != 44 or not chave.isdigit():
+        return None
+    ano, mes = int(chave[2:4]), int(chave[4:6])
+    return f"{2000 + ano:04d}_{mes:02d}" if 1 <= mes <= 12 else None
+
+def _intervalo(nome):
+    encontrado = _PADRAO_MES.search(nome)
+    if not encontrado:
+        return None, None
+    ano, mes = int(encontrado.group(1)), int(encontrado.group(2))
+    return f"{ano:04d}-{mes:02d}-01", f"{ano:04d}-{mes:02d}-{calendar.monthrange(ano, mes)[1]:02d}"
+
+class Roteador:
+    """Escolhe as abas de DADOS que cada leitura ou gravação precisa tocar."""
+
+    def __init__(self, spreadsheet, aba_unica, cabecalho=None, prefixo=PREFIXO, arquivo=ARQUIVO_PARTICOES):
+        self.spreadsheet = spreadsheet
+        self.aba_unica = aba_unica
+        self.cabecalho = cabecalho
+        self.prefixo = prefixo
+        self.arquivo = arquivo
+        self.aba_sem_data = f"{prefixo}SEM_DATA"
+        self._padrao = re.compile(rf"^{re.escape(prefixo)}(\d{{4}})_(\d{{2}})$")
+        self._abas = {}  # nome -> Worksheet
+        self._manifesto = None
+        self._versao = None  # (mtime, tamanho) do arquivo lido; a migração roda em outro processo
+        self._revisado_em = 0
+        self._lock = threading.Lock()
+
+    def _versao_arquivo(self):
+        try:
+            info = os.stat(self.arquivo)
+        except OSError:
+            return None
+        return (info.st_mtime_ns, info.st_size)
+
+    def _carregar(self):
+        # Chamado com self._lock
+        versao = self._versao_arquivo()
+        if self._manifesto is None or (versao is not None and versao != self._versao):
+            try:
+                with open(self.arquivo, encoding="utf-8") as f:
+                    self._manifesto = json.load(f)
+                self._versao = versao
+            except (OSError, ValueError):
+                self._revisar()
+        return self._manifesto
+
+    def _gravar(self):
+        temporario = f"{self.arquivo}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(self._manifesto, f, ensure_ascii=False, indent=1)
+        os.replace(temporario, self.arquivo)
+        self._versao = self._versao_arquivo()
+
+    def _revisar(self):
+        """Refaz o manifesto a partir da lista de abas (outro processo pode ter criado partições)."""
+        manifesto = self._manifesto or {}
+        anterior = manifesto.get("particoes", {})
+        particoes = {}
+        for aba in limitador.executar("sheets_leitura", self.spreadsheet.worksheets):
+            if aba.title == self.aba_sem_data or self._padrao.match(aba.title):
+                self._abas[aba.title] = aba
+                de, ate = _intervalo(aba.title)
+                particoes[aba.title] = {"de": de, "ate": ate, "linhas": anterior.get(aba.title, {}).get("linhas")}
+                if anterior.get(aba.title, {}).get("migrada"):
+                    particoes[aba.title]["migrada"] = True
+        self._manifesto = {"particoes": particoes}
+        if manifesto.get("migracao_concluida"):
+            self._manifesto["migracao_concluida"] = True
+        self._revisado_em = time.time()
+        self._gravar()
+
+    def _aba(self, nome):
+        aba = self._abas.get(nome)
+        if aba is None:
+            aba = self._abas[nome] = limitador.executar("sheets_leitura", self.spreadsheet.worksheet, nome)
+        return aba
+
+    def nome_aba(self, mes):
+        return f"{self.prefixo}{mes}" if mes else self.aba_sem_data
+
+    def revisar(self):
+        """Relê a lista de abas e devolve {partição: {"de", "ate", "linhas"}}."""
+        with self._lock:
+            self._revisar()
+            return {nome: dict(registro) for nome, registro in self._manifesto["particoes"].items()}
+
+    def ativo(self):
+        with self._lock:
+            return bool(self._carregar()["particoes"])
+
+    def particoes(self):
+        """Nomes das partições existentes, em ordem cronológica (DADOS_SEM_DATA por último)."""
+        with self._lock:
+            return sorted(self._carregar()["particoes"], key=lambda nome: (nome == self.aba_sem_data, nome))
+
+    def _existentes(self, nomes):
+        # Chamado com self._lock: um mês ainda desconhecido pode ter sido criado por outro processo
+        particoes = self._carregar()["particoes"]
+        if any(nome not in particoes for nome in nomes) and time.time() - self._revisado_em > REVISAO_MINIMA:
+            self._revisar()
+            particoes = self._manifesto["particoes"]
+        return [self._aba(nome) for nome in nomes if nome in particoes]
+
+    def abas_do_recibo(self, data=None, chave=None):
+        """Abas onde um recibo (pela data da compra ou pela chave) pode já estar gravado."""
+        with self._lock:
+            if not self._carregar()["particoes"]:
+                return [self.aba_unica]
+            mes = mes_da_data(data) or mes_da_chave(chave)
+            if mes is None:
+                # Sem mês conhecido não há como rotear: procura em todas
+                abas = self._existentes(sorted(self._manifesto["particoes"]))
+                migrada = self._manifesto.get("migracao_concluida")
+            else:
+                abas = self._existentes([self.nome_aba(mes), self.aba_sem_data])
+                migrada = self._manifesto.get("migracao_concluida") or self._manifesto["particoes"].get(self.nome_aba(mes), {}).get("migrada")
+            # Com a migração pela metade, o recibo pode ainda estar só na aba DADOS
+            return abas if migrada else abas + [self.aba_unica]
+
+    def abas_recentes(self, meses=MESES_INSIGHTS):
+        """Partições dos últimos `meses` meses e DADOS_SEM_DATA (a aba DADOS inteira, se não particionada)."""
+        with self._lock:
+            particoes = self._carregar()["particoes"]
+            if not particoes:
+                return [self.aba_unica]
+            nomes = sorted(nome for nome in particoes if nome != self.aba_sem_data)[-meses:]
+            # As linhas sem data não têm mês: ficam em todas as consultas em vez de sumirem dos insights
+            if self.aba_sem_data in particoes:
+                nomes.append(self.aba_sem_data)
+            return self._existentes(nomes)
+
+    def todas(self):
+        with self._lock:
+            nomes = sorted(self._carregar()["particoes"])
+            return self._existentes(nomes) if nomes else [self.aba_unica]
+
+    def _criar(self, nome):
+        # Chamado com self._lock
+        if self.cabecalho is None:
+            self.cabecalho = limitador.executar("sheets_leitura", self.aba_unica.row_values, 1)
+        try:
+            aba = limitador.executar("sheets_escrita", self.spreadsheet.add_worksheet, title=nome, rows=1, cols=planilha.LARGURA_DADOS)
+            logging.info(f"Partição {nome} criada")
+        except Exception as e:
+            # Outro processo pode ter criado a mesma aba ao mesmo tempo
+            logging.info(f"Partição {nome} não criada ({e}), usando a existente")
+            aba = limitador.executar("sheets_leitura", self.spreadsheet.worksheet, nome)
+        # O cabeçalho é a linha 1, como na aba DADOS: as leituras começam na linha 2
+        if not limitador.executar("sheets_leitura", aba.row_values, 1):
+            limitador.executar("sheets_escrita", aba.append_rows, [self.cabecalho], value_input_option="RAW")
+        self._abas[nome] = aba
+        de, ate = _intervalo(nome)
+        self._manifesto["particoes"][nome] = {"de": de, "ate": ate, "linhas": 0}
+        self._gravar()
+        return aba
+
+    def _particao(self, nome):
+        # Chamado com self._lock
+        return (self._existentes([nome]) or [self._criar(nome)])[0]
+
+    def particao(self, nome):
+        """A aba da partição, criada se ainda não existe."""
+        with self._lock:
+            self._carregar()
+            return self._particao(nome)
+
+    def agrupar(self, linhas):
+        """Separa as linhas da aba DADOS por partição: [(aba, linhas)], criando as abas que faltam."""
+        with self._lock:
+            if not self._carregar()["particoes"]:
+                return [(self.aba_unica, linhas)] if linhas else []
+            grupos = {}
+            for linha in linhas:
+                grupos.setdefault(self.nome_aba(mes_da_linha(linha)), []).append(linha)
+            return [(self._particao(nome), grupo) for nome, grupo in sorted(grupos.items())]
+
+    def contar(self, aba, linhas):
+        with self._lock:
+            registro = self._carregar()["particoes"].get(aba.title)
+            if registro is not None:
+                registro["linhas"] = (registro["linhas"] or 0) + linhas
+                self._gravar()
+
+    def definir_linhas(self, aba, linhas, migrada=False):
+        """Grava no manifesto o total de linhas da partição (depois de uma migração).
+
+        migrada=True anota que as linhas do mês na aba DADOS já estão todas na partição.
+        """
+        with self._lock:
+            registro = self._carregar()["particoes"].get(aba.title)
+            if registro is not None:
+                registro["linhas"] = linhas
+                if migrada:
+                    registro["migrada"] = True
+                self._gravar()
+
+    def gravar(self, linhas):
+        """Acrescenta as linhas, uma escrita por partição tocada."""
+        for aba, grupo in self.agrupar(linhas):
+            limitador.executar("sheets_escrita", aba.append_rows, grupo, value_input_option="RAW")
+            planilha.anotar_escrita(aba)
+            self.contar(aba, len(grupo))
+
+    def concluir_migracao(self):
+        """Anota que a aba DADOS inteira já foi migrada: ela deixa de ser lida na verificação de duplicatas."""
+        with self._lock:
+            self._carregar()["migracao_concluida"] = True
+            self._gravar()
+
+    def resumo(self):
+        with self._lock:
+            particoes = self._carregar()["particoes"]
+            if not particoes:
+                return f"aba {self.aba_unica.title} sem partições"
+            linhas = sum(registro["linhas"] or 0 for registro in particoes.values())
+            nomes = sorted(nome for nome in particoes if nome != self.aba_sem_data)
+            intervalo = f" de {particoes[nomes[0]]['de']} a {particoes[nomes[-1]]['ate']}" if nomes else ""
+            return f"{len(particoes)} partições{intervalo}, ~{linhas} linhas"
+
+def _chave_linha(linha):
+    return tuple(str(valor) for valor in (list(linha) + [""] * planilha.LARGURA_DADOS)[:planilha.LARGURA_DADOS])
+
+def _faltando(aba, linhas):
+    """As linhas que ainda não estão na aba, contando repetições (o mesmo item pode vir duas vezes no recibo)."""
+    presentes = collections.Counter(_chave_linha(linha) for linha in planilha.ler_a_partir(aba, 0))
+    faltam = []
+    for linha in linhas:
+        chave = _chave_linha(linha)
+        if presentes[chave]:
+            presentes[chave] -= 1
+        else:
+            faltam.append(linha)
+    return faltam
+
+def _acrescentar(aba, linhas, tamanho_lote):
+    for i in range(0, len(linhas), tamanho_lote):
+        limitador.executar("sheets_escrita", aba.append_rows, linhas[i:i + tamanho_lote], value_input_option="RAW")
+    planilha.anotar_escrita(aba)
+
+def migrar(roteador, aba_origem, tamanho_lote=5000, esvaziar=False):
+    """Divide a aba DADOS em partições mensais; pode ser repetida se for interrompida no meio.
+
+    Em cada partição só entram as linhas que ainda não estão lá.
+    """
+    inicio = time.perf_counter()
+    valores = limitador.executar("sheets_leitura", aba_origem.get_all_values)
+    if len(valores) <= 1:
+        logging.info(f"Aba {aba_origem.title} vazia, nada a migrar")
+        if roteador.ativo():
+            roteador.concluir_migracao()
+        return 0
+    roteador.cabecalho = valores[0]
+    grupos = {}
+    for linha in valores[1:]:
+        if not any(str(valor).strip() for valor in linha):
+            continue
+        grupos.setdefault(roteador.nome_aba(mes_da_linha(linha)), []).append(linha)
+
+    gravadas = 0
+    for nome, linhas in sorted(grupos.items()):
+        # A primeira partição ativa o roteador: a partir daqui as gravações novas já vão para as partições
+        aba = roteador.particao(nome)
+        faltam = _faltando(aba, linhas)
+        _acrescentar(aba, faltam, tamanho_lote)
+        gravadas += len(faltam)
+        planilha.invalidar(aba)
+        roteador.definir_linhas(aba, len(linhas), migrada=True)
+        logging.info(f"{nome}: {len(linhas)} linhas ({len(faltam)} gravadas agora)")
+    roteador.concluir_migracao()
+
+    if esvaziar:
+        # Só o cabeçalho fica: as células da aba antiga deixam de contar no limite da planilha
+        limitador.executar("sheets_escrita", aba_origem.resize, rows=1)
+        planilha.invalidar(aba_origem)
+        logging.info(f"Aba {aba_origem.title} esvaziada (mantido só o cabeçalho)")
+    logging.info(f"Migração concluída em {time.perf_counter() - inicio:.1f}s: {len(valores) - 1} linhas em {len(grupos)} partições, {gravadas} gravadas agora")
+    return gravadas
+
+def redistribuir(roteador, tamanho_lote=5000):
+    """Move para a partição do mês as linhas de DADOS_SEM_DATA cuja data agora é reconhecida.
+
+    Pode ser repetida se for interrompida: as linhas que já estão no mês não são gravadas de novo.
+    Rode com o bot e o lote parados, porque a aba DADOS_SEM_DATA é reescrita no fim.
+    """
+    if roteador.aba_sem_data not in roteador.particoes():
+        logging.info(f"Sem a aba {roteador.aba_sem_data}, nada a redistribuir")
+        return 0
+    aba_sem_data = roteador.particao(roteador.aba_sem_data)
+    valores = limitador.executar("sheets_leitura", aba_sem_data.get_all_values)[1:]
+    grupos, ficam = {}, []
+    for linha in valores:
+        mes = mes_da_linha(linha)
+        if mes:
+            grupos.setdefault(roteador.nome_aba(mes), []).append(linha)
+        elif any(str(valor).strip() for valor in linha):
+            ficam.append(linha)
+    if not grupos:
+        logging.info(f"{roteador.aba_sem_data}: {len(ficam)} linhas, todas sem data reconhecível")
+        return 0
+
+    movidas = 0
+    for nome, linhas in sorted(grupos.items()):
+        aba = roteador.particao(nome)
+        faltam = _faltando(aba, linhas)
+        _acrescentar(aba, faltam, tamanho_lote)
+        planilha.invalidar(aba)
+        roteador.contar(aba, len(faltam))
+        movidas += len(linhas)
+        logging.info(f"{nome}: {len(linhas)} linhas vindas de {roteador.aba_sem_data} ({len(faltam)} gravadas agora)")
+
+    # Reescreve por cima e só depois corta o fim: uma interrupção aqui deixa linhas repetidas, nunca perdidas
+    if ficam:
+        limitador.executar("sheets_escrita", aba_sem_data.update, range_name="A2", values=ficam, value_input_option="RAW")
+    limitador.executar("sheets_escrita", aba_sem_data.resize, rows=len(ficam) + 1)
+    planilha.invalidar(aba_sem_data)
+    roteador.definir_linhas(aba_sem_data, len(ficam))
+    logging.info(f"{roteador.aba_sem_data}: {movidas} linhas movidas para as partições do mês, {len(ficam)} continuam sem data")
+    return movidas
+
+def main():
+    parser = argparse.ArgumentParser(description="Partições mensais da aba DADOS")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    migracao = subcomandos.add_parser("migrar", help="Divide a aba DADOS existente em abas DADOS_AAAA_MM")
+    migracao.add_argument("--lote", type=int, default=5000, help="Linhas por requisição de gravação (padrão 5000)")
+    migracao.add_argument("--esvaziar", action="store_true", help="Depois de migrar, deixa na aba DADOS só o cabeçalho")
+    redistribuicao = subcomandos.add_parser("redistribuir", help="Move as linhas com data de DADOS_SEM_DATA para o mês delas")
+    redistribuicao.add_argument("--lote", type=int, default=5000, help="Linhas por requisição de gravação (padrão 5000)")
+    listagem = subcomandos.add_parser("listar", help="Mostra as partições e o intervalo de datas de cada uma")
+    for subcomando in (migracao, redistribuicao, listagem):
+        subcomando.add_argument("--conta", help="Chat cujas abas CONTA_<chat> são usadas (padrão: a aba DADOS)")
+    args = parser.parse_args()
+
+    # Só aqui a planilha é necessária
+    import nfce_automation
+    roteador = nfce_automation.contas_chat.roteador(args.conta) if args.conta else nfce_automation.roteador
+    if args.comando == "migrar":
+        migrar(roteador, roteador.aba_unica, args.lote, args.esvaziar)
+    elif args.comando == "redistribuir":
+        redistribuir(roteador, args.lote)
+    else:
+        registros = roteador.revisar()
+        for nome in roteador.particoes():
+            registro = registros[nome]
+            print(f"{nome}: {registro['de'] or '-'} a {registro['ate'] or '-'}, {registro['linhas'] if registro['linhas'] is not None else '?'} linhas")
+    logging.info(f"Partições: {roteador.resumo()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import threading
+import time
+import limitador
+
+# Camada de leitura das abas do Google Sheets. Em vez de get_all_values() a cada consulta:
+#   - só as colunas pedidas são lidas (um batch_get com um intervalo por bloco de colunas);
+#   - só as linhas acrescentadas desde a última leitura são buscadas;
+#   - o resultado fica em memória para as próximas chamadas do mesmo processo, que por
+#     PLANILHA_CACHE_FRESCO segundos (padrão 5) o recebem sem requisição nenhuma.
+# Linhas acrescentadas por outro processo aparecem depois de PLANILHA_CACHE_FRESCO; as deste processo,
+# na hora, se quem grava chamar anotar_escrita(). Linhas editadas ou apagadas direto na planilha só
+# aparecem na próxima releitura completa, feita a cada PLANILHA_CACHE_SEGUNDOS (padrão 300) ou ao chamar invalidar().
+CACHE_SEGUNDOS = float(os.getenv("PLANILHA_CACHE_SEGUNDOS", "300"))
+FRESCO_SEGUNDOS = float(os.getenv("PLANILHA_CACHE_FRESCO", "5"))
+LARGURA_DADOS = 15  # colunas da aba DADOS
+
+# aba -> {colunas: {"linhas": [...], "lido_em": timestamp, "conferido_em": timestamp}}
+_cache = {}
+_lock = threading.Lock()
+estatisticas = {"chamadas": 0, "do_cache": 0, "requisicoes": 0, "celulas": 0, "bytes": 0, "segundos": 0.0}
+
+def _letra(indice):
+    letras = ""
+    indice += 1
+    while indice:
+        indice, resto = divmod(indice - 1, 26)
+        letras = chr(ord("A") + resto) + letras
+    return letras
+
+def _blocos(indices):
+    """Agrupa índices em blocos contíguos: [0, 1, 2, 4, 7] -> [(0, 2), (4, 4), (7, 7)]."""
+    blocos = []
+    for indice in sorted(indices):
+        if blocos and indice == blocos[-1][1] + 1:
+            blocos[-1][1] = indice
+        else:
+            blocos.append([indice, indice])
+    return [tuple(bloco) for bloco in blocos]
+
+def _batch_get(aba, intervalos):
+    medicao = {}
+
+    def chamar():
+        # A latência medida é só a da API, sem a espera no limitador
+        inicio = time.perf_counter()
+        valores = aba.batch_get(intervalos)
+        medicao["duracao"] = time.perf_counter() - inicio
+        return valores
+
+    resultado = limitador.executar("sheets_leitura", chamar)
+    duracao = medicao["duracao"]
+    # Tamanho aproximado do payload (os valores em JSON, como vêm da API)
+    tamanho = len(json.dumps(resultado, ensure_ascii=False))
+    celulas = sum(len(linha) for intervalo in resultado for linha in intervalo)
+    with _lock:
+        estatisticas["requisicoes"] += 1
+        estatisticas["celulas"] += celulas
+        estatisticas["bytes"] += tamanho
+        estatisticas["segundos"] += duracao
+    return resultado, celulas, tamanho, duracao
+
+def ler_colunas(aba, colunas):
+    """Linhas da aba (sem o cabeçalho) com só as colunas pedidas preenchidas; as demais ficam vazias.
+
+    As linhas mantêm a largura até a maior coluna pedida, então row[11] continua sendo a coluna 12.
+    A lista devolvida é a do cache: quem chama não deve alterá-la.
+    """
+    colunas = tuple(sorted(set(colunas)))
+    agora = time.time()
+    with _lock:
+        estatisticas["chamadas"] += 1
+        estado = _cache.setdefault(aba.title, {}).get(colunas)
+        if estado is None or agora - estado["lido_em"] > CACHE_SEGUNDOS:
+            # Primeira leitura ou releitura completa periódica, para pegar edições e linhas apagadas
+            estado = _cache[aba.title][colunas] = {"linhas": [], "lido_em": agora, "conferido_em": 0}
+        elif agora - estado["conferido_em"] < FRESCO_SEGUNDOS:
+            estatisticas["do_cache"] += 1
+            return estado["linhas"]
+        ja_lidas = len(estado["linhas"])
+
+    blocos = _blocos(colunas)
+    intervalos = [f"{_letra(primeira)}{ja_lidas + 2}:{_letra(ultima)}" for primeira, ultima in blocos]
+    resultado, celulas, tamanho, duracao = _batch_get(aba, intervalos)
+
+    # Cada intervalo vem sem as linhas vazias do final; as linhas novas vão até o mais longo
+    novas = max((len(valores) for valores in resultado), default=0)
+    largura = colunas[-1] + 1
+    linhas_novas = [[""] * largura for _ in range(novas)]
+    for (primeira, ultima), valores in zip(blocos, resultado):
+        for linha, valores_linha in zip(linhas_novas, valores):
+            linha[primeira:primeira + len(valores_linha)] = valores_linha[:ultima - primeira + 1]
+    with _lock:
+        # Se outra thread já trouxe essas linhas, as dela valem
+        if len(estado["linhas"]) == ja_lidas:
+            estado["linhas"].extend(linhas_novas)
+            estado["conferido_em"] = agora
+        linhas = estado["linhas"]
+
+    logging.info(
+        f"Planilha {aba.title}: colunas {','.join(_letra(c) for c in colunas)}, {novas} linhas novas, {celulas} células "
+        f"(~{tamanho / 1024:.1f} KB) em {duracao * 1000:.0f} ms; leitura completa seria ~{len(linhas) * LARGURA_DADOS} células"
+    )
+    return linhas
+
+def ler_linhas(aba, indices, largura=LARGURA_DADOS):
+    """Linhas completas, na ordem da aba (índice 0 = linha 2, logo após o cabeçalho), numa única requisição."""
+    if not indices:
+        return []
+    blocos = _blocos(indices)
+    intervalos = [f"A{primeira + 2}:{_letra(largura - 1)}{ultima + 2}" for primeira, ultima in blocos]
+    resultado, celulas, tamanho, duracao = _batch_get(aba, intervalos)
+    logging.info(f"Planilha {aba.title}: {len(indices)} linhas completas (~{tamanho / 1024:.1f} KB) em {duracao * 1000:.0f} ms")
+    linhas = []
+    for (primeira, ultima), valores in zip(blocos, resultado):
+        valores = list(valores) + [[] for _ in range(ultima - primeira + 1 - len(valores))]
+        linhas.extend(list(linha) + [""] * (largura - len(linha)) for linha in valores)
+    return linhas
+
+def ler_a_partir(aba, inicio, largura=LARGURA_DADOS):
+    """Linhas completas a partir do índice `inicio` até o fim da aba, numa única requisição (sem cache)."""
+    resultado, celulas, tamanho, duracao = _batch_get(aba, [f"A{inicio + 2}:{_letra(largura - 1)}"])
+    logging.info(f"Planilha {aba.title}: {len(resultado[0])} linhas a partir da {inicio + 2} (~{tamanho / 1024:.1f} KB) em {duracao * 1000:.0f} ms")
+    return [list(linha) + [""] * (largura - len(linha)) for linha in resultado[0]]
+
+def anotar_escrita(aba):
+    """Avisa que este processo acrescentou linhas na aba: a próxima leitura busca as novas na API."""
+    with _lock:
+        for estado in _cache.get(aba.title, {}).values():
+            estado["conferido_em"] = 0
+
+def invalidar(aba=None):
+    """Descarta o cache de uma aba (ou de todas), forçando a próxima leitura completa."""
+    with _lock:
+        if aba is None:
+            _cache.clear()
+        else:
+            _cache.pop(aba.title, None)
+
+def resumo_leituras():
+    with _lock:
+        e = dict(estatisticas)
+    return (
+        f"{e['chamadas']} leituras ({e['do_cache']} do cache), {e['requisicoes']} requisições, {e['celulas']} células, "
+        f"~{e['bytes'] / 1024:.1f} KB, {e['segundos'] * 1000:.0f} ms no total"
+    )
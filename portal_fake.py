@@ -0,0 +1,178 @@
+import argparse
+import html
+import logging
+import random
+import string
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Portal local que imita as páginas de consulta NFCe e SAT, com um CAPTCHA falso.
+# Uso: python portal_fake.py --porta 8765
+# e depois rode o bot com NFCE_URL=http://localhost:8765/nfce e SAT_URL=http://localhost:8765/sat
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+# token do formulário -> texto esperado do CAPTCHA
+captchas = {}
+lock_captchas = threading.Lock()
+
+ITENS_FAKE = [
+    ("7891000100103", "LEITE INTEGRAL 1L", "2", "UN", "4,99", "9,98"),
+    ("7896004000015", "ARROZ TIPO 1 5KG", "1", "UN", "27,90", "27,90"),
+    ("2000100", "BANANA NANICA KG", "0,850", "KG", "6,99", "5,94"),
+]
+
+def novo_captcha():
+    texto = "".join(random.choices(string.ascii_uppercase + string.digits, k=5))
+    token = "".join(random.choices(string.ascii_lowercase + string.digits, k=16))
+    with lock_captchas:
+        captchas[token] = texto
+    logging.info(f"CAPTCHA gerado (token {token}): {texto}")
+    return token
+
+def captcha_svg(token):
+    with lock_captchas:
+        texto = captchas.get(token, "?????")
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="160" height="50">'
+        '<rect width="160" height="50" fill="#eee"/>'
+        '<line x1="0" y1="10" x2="160" y2="40" stroke="#999"/>'
+        f'<text x="20" y="35" font-size="28" font-family="monospace" fill="#333">{html.escape(texto)}</text>'
+        '</svg>'
+    )
+
+def captcha_valido(token, resposta):
+    with lock_captchas:
+        esperado = captchas.pop(token, None)
+    return esperado is not None and resposta.strip().upper() == esperado
+
+def pagina_formulario_nfce(token):
+    return f"""<html><body>
+<form method="post" action="/nfce">
+  <input type="hidden" name="token" value="{token}">
+  <input id="Conteudo_txtChaveAcesso" name="chave" type="text">
+  <img id="Conteudo_imgCaptcha" src="/captcha.svg?token={token}" width="160" height="50">
+  <input id="Conteudo_txtCaptcha" name="captcha" type="text">
+  <input id="Conteudo_btnConsultaResumida" type="submit" value="Consultar">
+</form>
+</body></html>"""
+
+def pagina_resultado_nfce(chave):
+    linhas = ""
+    for i, (codigo, descricao, qtd, un, vl_unit, vl_total) in enumerate(ITENS_FAKE, start=1):
+        linhas += f"""<tr id="Item + {i}">
+<td><span class="txtTit">{descricao}</span><span class="RCod">(Código: {codigo})</span>
+<span class="Rqtd"><strong>Qtde.:</strong>{qtd}</span><span class="RUN"><strong>UN: </strong>{un}</span>
+<span class="RvlUnit"><strong>Vl. Unit.:</strong>{vl_unit}</span></td>
+<td><span class="valor">{vl_total}</span></td></tr>"""
+    return f"""<html><body>
+<div id="u20" class="txtTopo">SUPERMERCADO FAKE LTDA</div>
+<div class="text">CNPJ: 00.000.000/0001-91</div>
+<table id="tabResult">{linhas}</table>
+<li><strong>Número: </strong>{chave[25:34]}<strong> Série: </strong>1<strong> Emissão: </strong>17/04/2025 12:54:43</li>
+<div data-role="collapsible"><h4>Consumidor</h4><strong>CONSUMIDOR FAKE</strong></div>
+<strong>Chave de acesso:</strong><br><span class="chave">{" ".join(chave[i:i + 4] for i in range(0, 44, 4))}</span>
+</body></html>"""
+
+def pagina_erro_nfce(mensagem):
+    return f'<html><body><span class="msgErro">{html.escape(mensagem)}</span></body></html>'
+
+def pagina_formulario_sat(token):
+    return f"""<html><body>
+<form method="post" action="/sat">
+  <input type="hidden" name="token" value="{token}">
+  <input id="conteudo_txtChaveAcesso" name="chave" type="text">
+  <img id="conteudo_imgCaptcha" src="/captcha.svg?token={token}" width="160" height="50">
+  <input id="conteudo_txtCaptcha" name="captcha" type="text">
+  <input id="conteudo_btnConsultar" type="submit" value="Consultar">
+</form>
+</body></html>"""
+
+def pagina_resultado_sat(chave):
+    linhas = '<tr><th>#</th><th>Código</th><th>Descrição</th><th>Qtd</th><th>UN</th><th>Vl Unit</th><th>Trib</th><th>Vl Total</th></tr>'
+    for i, (codigo, descricao, qtd, un, vl_unit, vl_total) in enumerate(ITENS_FAKE, start=1):
+        linhas += f"<tr><td>{i}</td><td>{codigo}</td><td>{descricao}</td><td>{qtd}</td><td>{un}</td><td>{vl_unit}</td><td>0,00</td><td>{vl_total}</td></tr>"
+    return f"""<html><body><div id="divTelaImpressao">
+<span id="conteudo_lblNomeEmitente">MERCADO SAT FAKE</span>
+<span id="conteudo_lblCnpjEmitente">11.111.111/0001-11</span>
+<span id="conteudo_lblEnderecoEmintente">RUA FAKE, 1</span>
+<span id="conteudo_lblBairroEmitente">CENTRO</span>
+<span id="conteudo_lblMunicipioEmitente">SAO PAULO</span>
+<span id="conteudo_lblCepEmitente">01000-000</span>
+<span id="conteudo_lblNumeroCfe">{chave[31:37]}</span>
+<span id="conteudo_lblDataEmissao">17/04/2025 - 12:54:43</span>
+<span id="conteudo_lblSatNumeroSerie">900000000</span>
+<span id="conteudo_lblTotal">43,82</span>
+<span id="conteudo_lblRazaoSocial">CONSUMIDOR FAKE</span>
+<span id="conteudo_lblChaveAcesso">{" ".join(chave[i:i + 4] for i in range(0, 44, 4))}</span>
+<table id="tableItens">{linhas}</table>
+</div></body></html>"""
+
+class PortalFakeHandler(BaseHTTPRequestHandler):
+    def responder(self, corpo, tipo="text/html; charset=utf-8", status=200):
+        dados = corpo.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/nfce":
+            self.responder(pagina_formulario_nfce(novo_captcha()))
+        elif url.path == "/sat":
+            self.responder(pagina_formulario_sat(novo_captcha()))
+        elif url.path == "/captcha.svg":
+            token = parse_qs(url.query).get("token", [""])[0]
+            self.responder(captcha_svg(token), tipo="image/svg+xml")
+        else:
+            self.responder("Não encontrado", status=404)
+
+    def do_POST(self):
+        tamanho = int(self.headers.get("Content-Length", 0))
+        campos = parse_qs(self.rfile.read(tamanho).decode("utf-8"))
+        chave = campos.get("chave", [""])[0].strip()
+        token = campos.get("token", [""])[0]
+        resposta = campos.get("captcha", [""])[0]
+        ok = captcha_valido(token, resposta)
+        logging.info(f"Consulta {self.path} chave={chave} captcha={'ok' if ok else 'inválido'}")
+
+        if self.path == "/nfce":
+            if not ok:
+                self.responder(pagina_erro_nfce("Código da imagem inválido. Tente novamente."))
+            elif len(chave) != 44 or chave[20:22] != "65":
+                self.responder(pagina_erro_nfce("Chave de Acesso Inválida"))
+            else:
+                self.responder(pagina_resultado_nfce(chave))
+        elif self.path == "/sat":
+            if not ok or len(chave) != 44:
+                self.responder(pagina_formulario_sat(novo_captcha()))
+            else:
+                self.responder(pagina_resultado_sat(chave))
+        else:
+            self.responder("Não encontrado", status=404)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Portal local que imita as consultas NFCe/SAT com CAPTCHA falso")
+    parser.add_argument("--porta", type=int, default=8765, help="Porta HTTP (padrão 8765)")
+    args = parser.parse_args()
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", args.porta), PortalFakeHandler)
+    logging.info(f"Portal fake em http://127.0.0.1:{args.porta}/nfce e http://127.0.0.1:{args.porta}/sat")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+import contextlib
+import json
+import logging
+import os
+import re
+import string
+import threading
+import zlib
+import limitador
+from extratores import TABELA_ACENTOS
+
+# Identidade de produtos entre lojas: cada descrição de item é normalizada (sem acentos,
+# maiúsculas, abreviações expandidas, medidas padronizadas) e associada a um ID canônico.
+# O código do item identifica o produto direto quando é um GTIN/EAN (vale em qualquer loja)
+# ou, para códigos internos, junto com o CNPJ da loja. Nomes parecidos são encontrados por
+# MinHash com bandas (LSH), sem varrer todos os produtos.
+# O bot, o worker, o importador e o lote dividem o mesmo produtos.json: IDs novos só são criados
+# dentro de IndiceProdutos.alocando(), com a trava do arquivo, depois de reler o que os outros
+# processos gravaram, e o arquivo é gravado antes de a trava ser solta.
+ARQUIVO_PRODUTOS = os.getenv("ARQUIVO_PRODUTOS", "produtos.json")
+LIMIAR_SIMILARIDADE = float(os.getenv("PRODUTOS_LIMIAR", "0.7"))
+
+NUMERO_HASHES = 18
+LINHAS_POR_BANDA = 3
+BANDAS = NUMERO_HASHES // LINHAS_POR_BANDA
+MAXIMO_CANDIDATOS = 10
+# Baldes maiores que isso vêm de trechos muito comuns ("LEITE", "1L") e não ajudam a achar o produto
+MAXIMO_POR_BALDE = 64
+_PRIMO = (1 << 61) - 1
+# Coeficientes fixos para que o índice seja reconstruído igual a partir do arquivo
+_COEFICIENTES = [((i * 0x9E3779B97F4A7C15 + 0x632BE59BD9B4E019) % _PRIMO | 1, (i * 0xBF58476D1CE4E5B9 + 0x94D049BB133111EB) % _PRIMO) for i in range(1, NUMERO_HASHES + 1)]
+
+# Uma única tabela de tradução: tira acentos, passa para maiúsculas e troca pontuação por espaço
+# (ponto e vírgula ficam para a regra de medidas, que precisa de "1,5L")
+_TABELA_NORMALIZACAO = {ord(c): ord(c.upper()) for c in string.ascii_lowercase}
+_TABELA_NORMALIZACAO.update({origem: ord(chr(destino).upper()) for origem, destino in TABELA_ACENTOS.items()})
+_TABELA_NORMALIZACAO.update({ord(c): " " for c in "/\\-_()[]{}*+\"'!?#&%;:|=<>@$\xa0\t\n"})
+
+ABREVIACOES = {
+    "LTE": "LEITE", "INT": "INTEGRAL", "INTEG": "INTEGRAL", "DESN": "DESNATADO", "SEMID": "SEMIDESNATADO",
+    "REFRIG": "REFRIGERANTE", "REFRI": "REFRIGERANTE", "REF": "REFRIGERANTE",
+    "BISC": "BISCOITO", "BISCT": "BISCOITO", "CHOC": "CHOCOLATE", "ACHOC": "ACHOCOLATADO",
+    "QJO": "QUEIJO", "QJ": "QUEIJO", "MUSS": "MUSSARELA", "MUCAR": "MUSSARELA", "PRES": "PRESUNTO",
+    "REQ": "REQUEIJAO", "REQUEIJ": "REQUEIJAO", "IOG": "IOGURTE", "MARG": "MARGARINA", "MANT": "MANTEIGA",
+    "FGO": "FRANGO", "FRANG": "FRANGO", "CARN": "CARNE", "LING": "LINGUICA", "SALS": "SALSICHA",
+    "ARR": "ARROZ", "FEIJ": "FEIJAO", "MAC": "MACARRAO", "MACAR": "MACARRAO", "FAR": "FARINHA",
+    "CERV": "CERVEJA", "AGUA": "AGUA", "MIN": "MINERAL", "SUC": "SUCO",
+    "DET": "DETERGENTE", "AMAC": "AMACIANTE", "DESINF": "DESINFETANTE", "SABON": "SABONETE",
+    "PAP": "PAPEL", "HIG": "HIGIENICO", "TRAD": "TRADICIONAL", "ORIG": "ORIGINAL",
+    "PCT": "PACOTE", "PC": "PACOTE", "CX": "CAIXA", "GF": "GARRAFA", "GARR": "GARRAFA", "LT": "LATA",
+    "SC": "SACO", "BDJ": "BANDEJA", "FR": "FRASCO",
+}
+PALAVRAS_IGNORADAS = {"DE", "DA", "DO", "DAS", "DOS", "E", "COM", "C", "P", "EM"}
+UNIDADES = {"KG": "KG", "K": "KG", "G": "G", "GR": "G", "GRS": "G", "ML": "ML", "L": "L", "LT": "L", "LTS": "L", "LITRO": "L", "LITROS": "L"}
+
+_RE_MEDIDA = re.compile(r"(?<![\w.,])(\d+(?:[.,]\d+)?)\s*(KG|K|GRS|GR|G|ML|LITROS|LITRO|LTS|LT|L)\b")
+_RE_PONTUACAO = re.compile(r"(?<!\d)[.,]|[.,](?!\d)")
+_RE_TOKEN_MEDIDA = re.compile(r"^\d+(?:\.\d+)?(?:KG|G|ML|L)$")
+
+def _padronizar_medida(m):
+    valor = float(m.group(1).replace(",", "."))
+    unidade = UNIDADES[m.group(2)]
+    # 1000ML e 1L (ou 1000G e 1KG) são a mesma embalagem
+    if unidade == "ML" and valor >= 1000:
+        valor, unidade = valor / 1000, "L"
+    elif unidade == "G" and valor >= 1000:
+        valor, unidade = valor / 1000, "KG"
+    return f" {valor:g}{unidade} "
+
+def normalizar_descricao(descricao):
+    """Descrição padronizada para comparação: "Lte. Int. 1000ml" -> "LEITE INTEGRAL 1L"."""
+    texto = (descricao or "").translate(_TABELA_NORMALIZACAO)
+    texto = _RE_MEDIDA.sub(_padronizar_medida, texto)
+    texto = _RE_PONTUACAO.sub(" ", texto)
+    palavras = (ABREVIACOES.get(p, p) for p in texto.split())
+    return " ".join(p for p in palavras if p not in PALAVRAS_IGNORADAS)
+
+def gtin_valido(codigo):
+    if not codigo.isdigit() or len(codigo) not in (8, 12, 13, 14) or not codigo.strip("0"):
+        return False
+    # Códigos de balança/uso interno (prefixo 2) variam de loja para loja
+    if codigo.lstrip("0").startswith("2") and len(codigo.lstrip("0")) == 13:
+        return False
+    digitos = [int(d) for d in codigo.zfill(14)]
+    soma = sum(d * (3 if i % 2 == 0 else 1) for i, d in enumerate(digitos[:-1]))
+    return (10 - soma % 10) % 10 == digitos[-1]
+
+def chave_codigo(cnpj, codigo):
+    codigo = (codigo or "").strip()
+    if not codigo or codigo == "N/A":
+        return None
+    if gtin_valido(codigo):
+        return "GTIN:" + codigo.zfill(14)
+    cnpj = re.sub(r"\D", "", cnpj or "")
+    return f"{cnpj}|{codigo}" if cnpj else None
+
+def _trigramas(nome):
+    trigramas = set()
+    for palavra in nome.split():
+        palavra = f" {palavra} "
+        trigramas.update(palavra[i:i + 3] for i in range(len(palavra) - 2))
+    return trigramas
+
+# trigrama -> seus NUMERO_HASHES valores; o alfabeto normalizado é pequeno, então o cache é limitado
+_hashes_trigramas = {}
+
+def _hashes_trigrama(trigrama):
+    hashes = _hashes_trigramas.get(trigrama)
+    if hashes is None:
+        h = zlib.crc32(trigrama.encode())
+        hashes = _hashes_trigramas[trigrama] = tuple((a * h + b) % _PRIMO for a, b in _COEFICIENTES)
+    return hashes
+
+def _assinatura(trigramas):
+    # Mínimo coluna a coluna, feito em C por map/zip
+    return list(map(min, zip(*map(_hashes_trigrama, trigramas))))
+
+def _chaves_bandas(assinatura):
+    return [hash(tuple(assinatura[i * LINHAS_POR_BANDA:(i + 1) * LINHAS_POR_BANDA])) for i in range(BANDAS)]
+
+def _medidas(nome):
+    return {p for p in nome.split() if _RE_TOKEN_MEDIDA.match(p)}
+
+class IndiceProdutos:
+    def __init__(self, caminho=ARQUIVO_PRODUTOS):
+        self.caminho = caminho
+        self.nomes = []  # ID do produto -> nome normalizado canônico
+        self.por_nome = {}  # palavras do nome em ordem alfabética -> ID
+        self.por_codigo = {}  # "GTIN:..." ou "cnpj|codigo" -> ID
+        self.bandas = [{} for _ in range(BANDAS)]  # chave da banda -> ID ou lista de IDs
+        self.ids_linhas = {}  # aba -> ID do produto de cada linha já indexada (DADOS ou partição mensal)
+        self.alterado = False
+        self.lock = threading.RLock()
+        self._versao = None  # (mtime, tamanho) do arquivo na última leitura ou gravação
+        self._sessoes = 0  # alocando() aninhados na thread que tem self.lock
+
+    def _registrar_nome(self, id_produto, nome):
+        self.por_nome.setdefault(" ".join(sorted(nome.split())), id_produto)
+        for banda, chave in zip(self.bandas, _chaves_bandas(_assinatura(_trigramas(nome)))):
+            atual = banda.get(chave)
+            if atual is None:
+                banda[chave] = id_produto
+            elif isinstance(atual, list):
+                atual.append(id_produto)
+            else:
+                banda[chave] = [atual, id_produto]
+
+    def _buscar_nome(self, nome):
+        id_produto = self.por_nome.get(" ".join(sorted(nome.split())))
+        if id_produto is not None:
+            return id_produto
+        trigramas = _trigramas(nome)
+        # Candidatos: produtos que caem no mesmo balde em pelo menos uma banda
+        votos = {}
+        for banda, chave in zip(self.bandas, _chaves_bandas(_assinatura(trigramas))):
+            atual = banda.get(chave)
+            if atual is None:
+                continue
+            if not isinstance(atual, list):
+                atual = (atual,)
+            elif len(atual) > MAXIMO_POR_BALDE:
+                continue
+            for candidato in atual:
+                votos[candidato] = votos.get(candidato, 0) + 1
+        medidas = _medidas(nome)
+        melhor, melhor_similaridade = None, LIMIAR_SIMILARIDADE
+        for candidato in sorted(votos, key=votos.get, reverse=True)[:MAXIMO_CANDIDATOS]:
+            nome_candidato = self.nomes[candidato]
+            # Embalagens diferentes (1L x 2L) nunca são o mesmo produto
+            medidas_candidato = _medidas(nome_candidato)
+            if medidas and medidas_candidato and medidas != medidas_candidato:
+                continue
+            outros = _trigramas(nome_candidato)
+            similaridade = len(trigramas & outros) / len(trigramas | outros)
+            if similaridade >= melhor_similaridade:
+                melhor, melhor_similaridade = candidato, similaridade
+        return melhor
+
+    def _procurar(self, nome, chave):
+        id_produto = self.por_codigo.get(chave) if chave else None
+        if id_produto is None and nome:
+            id_produto = self._buscar_nome(nome)
+        return id_produto
+
+    def identificar(self, descricao, cnpj=None, codigo=None, criar=True):
+        """ID canônico do produto; com criar=False devolve None para produtos desconhecidos."""
+        nome = normalizar_descricao(descricao)
+        chave = chave_codigo(cnpj, codigo)
+        with self.lock:
+            id_produto = self._procurar(nome, chave)
+            if not criar or (id_produto is not None and (not chave or chave in self.por_codigo)) or not (nome or chave):
+                return id_produto
+            with self.alocando():
+                # Outro processo pode ter criado o produto (ou associado o código) desde a última leitura
+                id_produto = self._procurar(nome, chave)
+                if id_produto is None:
+                    id_produto = len(self.nomes)
+                    self.nomes.append(nome)
+                    if nome:
+                        self._registrar_nome(id_produto, nome)
+                    self.alterado = True
+                if chave and chave not in self.por_codigo:
+                    self.por_codigo[chave] = id_produto
+                    self.alterado = True
+                return id_produto
+
+    def indexar_linhas(self, rows, aba="DADOS"):
+        """Indexa só as linhas da aba (sem cabeçalho) ainda não vistas; devolve o ID de cada linha."""
+        with self.lock:
+            ids = self.ids_linhas.get(aba, [])
+            if len(rows) == len(ids):
+                return list(ids)
+            # Uma única sessão (e uma gravação do arquivo) para todas as linhas novas
+            with self.alocando():
+                ids = self.ids_linhas.setdefault(aba, [])
+                if len(rows) < len(ids):
+                    # A aba foi reescrita: os produtos continuam, as linhas são reindexadas
+                    del ids[:]
+                for row in rows[len(ids):]:
+                    ids.append(self.identificar(row[7], row[1], row[4]) if len(row) > 7 else None)
+                    self.alterado = True
+                return ids[:len(rows)]
+
+    @contextlib.contextmanager
+    def alocando(self):
+        """Sessão com a trava de produtos.json: relê o que outros processos gravaram e grava ao sair.
+
+        Pode ser aninhada; só a sessão de fora trava, relê e grava o arquivo.
+        """
+        with self.lock:
+            if self._sessoes:
+                self._sessoes += 1
+                try:
+                    yield self
+                finally:
+                    self._sessoes -= 1
+                return
+            with limitador.trava_arquivo(f"{self.caminho}.lock"):
+                self._sessoes = 1
+                try:
+                    self._sincronizar()
+                    yield self
+                finally:
+                    self._sessoes = 0
+                    self._gravar()
+
+    def _versao_arquivo(self):
+        try:
+            info = os.stat(self.caminho)
+        except OSError:
+            return None
+        return (info.st_mtime_ns, info.st_size)
+
+    def _sincronizar(self):
+        # Chamado com a trava do arquivo: junta ao índice em memória o que os outros processos criaram
+        versao = self._versao_arquivo()
+        if versao is None or versao == self._versao:
+            return
+        dados = _ler_arquivo(self.caminho)
+        nomes = dados.get("nomes", [])
+        for id_produto in range(len(self.nomes), len(nomes)):
+            self.nomes.append(nomes[id_produto])
+            if nomes[id_produto]:
+                self._registrar_nome(id_produto, nomes[id_produto])
+        for chave, id_produto in dados.get("codigos", {}).items():
+            self.por_codigo.setdefault(chave, id_produto)
+        for aba, ids in dados.get("linhas", {}).items():
+            if len(ids) > len(self.ids_linhas.get(aba, [])):
+                self.ids_linhas[aba] = ids
+        self._versao = versao
+
+    def _gravar(self):
+        # Chamado com a trava do arquivo
+        if not self.alterado:
+            return
+        temporario = f"{self.caminho}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump({"nomes": self.nomes, "codigos": self.por_codigo, "linhas": self.ids_linhas}, f, ensure_ascii=False)
+        os.replace(temporario, self.caminho)
+        self.alterado = False
+        self._versao = self._versao_arquivo()
+
+    def salvar(self):
+        """Grava as linhas indexadas e os produtos criados, juntando o que os outros processos gravaram."""
+        with self.alocando():
+            pass
+
+    @classmethod
+    def carregar(cls, caminho=ARQUIVO_PRODUTOS):
+        indice = cls(caminho)
+        if not os.path.exists(caminho):
+            return indice
+        indice._versao = indice._versao_arquivo()
+        dados = _ler_arquivo(caminho)
+        # Só nomes, códigos e linhas são gravados; as bandas do MinHash são recalculadas
+        indice.nomes = dados.get("nomes", [])
+        indice.por_codigo = dados.get("codigos", {})
+        indice.ids_linhas = dados.get("linhas", {})
+        for id_produto, nome in enumerate(indice.nomes):
+            if nome:
+                indice._registrar_nome(id_produto, nome)
+        return indice
+
+def _ler_arquivo(caminho):
+    try:
+        with open(caminho, encoding="utf-8") as f:
+            dados = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f"Erro ao carregar o índice de produtos ({caminho}), começando do zero: {e}")
+        return {}
+    if isinstance(dados.get("linhas"), list):
+        # Formato anterior às partições: só a aba DADOS
+        dados["linhas"] = {"DADOS": dados["linhas"]}
+    return dados
+
+_indice = None
+_lock_indice = threading.Lock()
+
+def obter_indice():
+    global _indice
+    with _lock_indice:
+        if _indice is None:
+            _indice = IndiceProdutos.carregar()
+        return _indice
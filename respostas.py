@@ -0,0 +1,173 @@
+import logging
+from modelo import centavos, formatar_reais
+from produtos import obter_indice
+import saude_portais
+import planilha
+import estatisticas_precos
+import contas
+
+# Textos das respostas do bot, usados tanto pelo bot (modo local) quanto pelo worker.py
+
+# Colunas da aba DADOS usadas nos insights: Empresa, CNPJ, Codigo, Descricao, VlTotal e Data
+COLUNAS_INSIGHTS = (0, 1, 4, 7, 11, 12)
+
+# O Telegram limita cada mensagem a 4096 caracteres
+LIMITE_MENSAGEM = 4096
+
+FALHA_CHAVE = "Não consegui processar a chave. Verifique e tente novamente! 😕"
+FALHA_IMAGEM = "Não consegui extrair o QR code. Tente outra imagem ou envie a chave de 44 dígitos! 😕"
+
+def ler_historico(chat_id=None):
+    """Linhas de DADOS usadas nos insights e o produto canônico de cada uma: (rows, ids_linhas).
+
+    Com a aba particionada, só os últimos PARTICOES_MESES_INSIGHTS meses são lidos; com
+    HISTORICO_INSIGHTS=1, os meses já exportados e fechados vêm dos arquivos do exportar_historico.py.
+    Com contas por chat, só as abas da conta do chat.
+    """
+    # Importada só quando há insights a calcular: o bot no modo fila não abre a planilha nem o Chrome
+    from nfce_automation import contas_chat
+    import exportar_historico
+    roteador = contas_chat.do_chat(chat_id)
+    indice = obter_indice()
+    rows = []
+    ids_linhas = []
+    for aba in roteador.abas_recentes():
+        linhas = exportar_historico.linhas_insights(aba.title)
+        origem = f"{aba.title}@arquivos"
+        if linhas is None:
+            linhas = planilha.ler_colunas(aba, COLUNAS_INSIGHTS)
+            origem = aba.title
+        rows.extend(linhas)
+        ids_linhas.extend(indice.indexar_linhas(linhas, origem))
+    return rows, ids_linhas
+
+def calcular_insights(recibo, historico=None):
+    # historico permite reaproveitar uma única leitura da planilha para vários recibos
+    rows, ids_linhas = historico if historico is not None else ler_historico()
+    # Todos os valores são inteiros em centavos
+    empresa = recibo.empresa
+    gastos_empresa = [centavos(row[11]) for row in rows if row[0] == empresa]
+    media = sum(gastos_empresa) // len(gastos_empresa) if gastos_empresa else recibo.total
+
+    # Itens são comparados pelo produto canônico (mesmo com descrições e códigos diferentes entre lojas)
+    indice = obter_indice()
+    # Sem criar: um item que não está no histórico não tem com o que ser comparado, e a consulta não
+    # precisa da trava de produtos.json por item
+    ids_itens = [indice.identificar(item.descricao, recibo.cnpj, item.codigo, criar=False) for item in recibo.itens]
+    historico = {id_produto: [] for id_produto in ids_itens if id_produto is not None}
+    for row, id_produto in zip(rows, ids_linhas):
+        if id_produto in historico:
+            historico[id_produto].append(row)
+
+    # Com contas por chat, o histórico lido é só o da conta; as outras lojas vêm dos resumos de todas
+    resumos_outras_lojas = contas.precos_em_outras_lojas(ids_itens, empresa) if contas.ATIVO else None
+
+    comparacao = []
+    outros_precos = []
+    for item, id_produto in zip(recibo.itens, ids_itens):
+        compras = historico.get(id_produto, [])
+        anteriores = [r for r in compras if r[0] == empresa and r[12] != recibo.data]
+        if anteriores:
+            compra = anteriores[-1]
+            comparacao.append({
+                "descricao": item.descricao,
+                "hoje": item.vl_total,
+                "anterior": centavos(compra[11]),
+                "data_anterior": compra[12]
+            })
+        if resumos_outras_lojas is not None:
+            soma, quantidade = resumos_outras_lojas.get(id_produto, (0, 0))
+        else:
+            precos = [centavos(r[11]) for r in compras if r[0] != empresa]
+            soma, quantidade = sum(precos), len(precos)
+        if quantidade:
+            outros_precos.append({
+                "descricao": item.descricao,
+                "pago": item.vl_total,
+                "media_outros": soma // quantidade
+            })
+
+    categorias = {}
+    for item in recibo.itens:
+        categorias[item.categoria] = categorias.get(item.categoria, 0) + item.vl_total
+
+    return {
+        "media": media,
+        "comparacao": comparacao,
+        "outros_precos": outros_precos,
+        "categorias": categorias
+    }
+
+def montar_resposta(recibo, historico):
+    insights = calcular_insights(recibo, historico)
+    empresa = recibo.empresa or "Desconhecida"
+
+    # Verificar se é uma duplicata com base na flag retornada
+    resposta = "✅ Compra processada!\n" if not recibo.is_duplicate else f"⚠️ Esta compra (número {recibo.numero}) já foi processada anteriormente!\n"
+    resposta += f"Empresa: {empresa}\n"
+    resposta += f"Data: {recibo.data}\n"
+    resposta += f"Total: {formatar_reais(recibo.total)}\n"
+    resposta += f"Itens: {len(recibo.itens)}\n"
+    resposta += f"\n📊 Insights:\n"
+    resposta += f"- Valor médio em {empresa}: {formatar_reais(insights['media'])}\n"
+    if insights["comparacao"]:
+        resposta += "- Comparação com compras anteriores:\n"
+        for comp in insights["comparacao"]:
+            resposta += f"  • {comp['descricao']}: {formatar_reais(comp['hoje'])} (anterior: {formatar_reais(comp['anterior'])} em {comp['data_anterior']})\n"
+    else:
+        resposta += "- Sem compras anteriores para comparar.\n"
+    alertas = estatisticas_precos.alertas_do_recibo(recibo)
+    if alertas:
+        resposta += "- 🔺 Preços acima do normal nesta loja:\n"
+        for alerta in alertas:
+            resposta += f"  • {alerta['descricao']}: {formatar_reais(alerta['pago'])} (média: {formatar_reais(alerta['media'])}, {alerta['desvios']:.1f} desvios acima)\n"
+    if insights["outros_precos"]:
+        resposta += "- Preços em outros estabelecimentos:\n"
+        for outro in insights["outros_precos"]:
+            resposta += f"  • {outro['descricao']}: {formatar_reais(outro['pago'])} (média em outros: {formatar_reais(outro['media_outros'])})\n"
+    else:
+        resposta += "- Sem dados de outros estabelecimentos.\n"
+    if insights["categorias"]:
+        resposta += "- Gastos por categoria:\n"
+        for cat, valor in insights["categorias"].items():
+            resposta += f"  • {cat}: {formatar_reais(valor)}\n"
+    return resposta
+
+def mensagem_falha(chave):
+    if saude_portais.na_fila(chave):
+        return f"⏳ Portal da Fazenda indisponível agora: a chave {chave} ficou na fila e será consultada de novo mais tarde."
+    return f"❌ Não consegui processar a chave {chave}."
+
+def montar_resposta_recibos(resultados, chat_id=None):
+    """Monta uma única resposta para todos os recibos (chave, Recibo) de uma mensagem."""
+    if not any(recibo for _, recibo in resultados):
+        na_fila = [mensagem_falha(chave) for chave, _ in resultados if saude_portais.na_fila(chave)]
+        return "\n".join(na_fila) or None
+    # Uma leitura da planilha serve para os insights de todos os recibos
+    historico = ler_historico(chat_id)
+    if len(resultados) == 1:
+        resposta = montar_resposta(resultados[0][1], historico)
+    else:
+        partes = [f"🧾 {len(resultados)} recibos encontrados na imagem."]
+        for i, (chave, recibo) in enumerate(resultados, start=1):
+            if recibo:
+                partes.append(f"— Recibo {i}/{len(resultados)} —\n" + montar_resposta(recibo, historico))
+            else:
+                partes.append(f"— Recibo {i}/{len(resultados)} —\n{mensagem_falha(chave)}")
+        resposta = "\n\n".join(partes)
+    try:
+        obter_indice().salvar()
+    except OSError as e:
+        logging.error(f"Erro ao salvar o índice de produtos: {e}")
+    return resposta
+
+def dividir_resposta(resposta, limite=LIMITE_MENSAGEM):
+    """Divide respostas longas (vários recibos) por linha, em blocos que cabem numa mensagem."""
+    bloco = ""
+    for linha in resposta.splitlines(keepends=True):
+        if bloco and len(bloco) + len(linha) > limite:
+            yield bloco
+            bloco = ""
+        bloco += linha
+    if bloco:
+        yield bloco
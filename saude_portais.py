@@ -0,0 +1,217 @@
+import collections
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import limitador
+
+# Saúde dos portais NFCe e SAT: taxa de sucesso e latência das últimas consultas, um disjuntor
+# (circuit breaker) por portal e a fila de chaves que falharam por indisponibilidade do portal.
+#   - fechado: consultas normais;
+#   - aberto: o portal é pulado na hora, sem esperar os timeouts de 30 a 120 s;
+#   - meio aberto: passado o tempo de espera, uma única consulta de teste decide se fecha ou reabre.
+JANELA = int(os.getenv("SAUDE_JANELA", "20"))
+MINIMO_AMOSTRAS = int(os.getenv("SAUDE_MINIMO_AMOSTRAS", "5"))
+TAXA_MINIMA_SUCESSO = float(os.getenv("SAUDE_TAXA_MINIMA", "0.5"))
+FALHAS_SEGUIDAS = int(os.getenv("SAUDE_FALHAS_SEGUIDAS", "3"))
+ESPERA_ABERTO = float(os.getenv("SAUDE_ESPERA_ABERTO", "60"))
+ESPERA_ABERTO_MAXIMA = 600
+
+ARQUIVO_RETENTATIVAS = os.getenv("RETENTATIVAS_ARQUIVO", "retentativas.json")
+MAXIMO_TENTATIVAS = int(os.getenv("RETENTATIVAS_MAXIMO", "8"))
+
+# Código do modelo do documento na chave de acesso (posições 21-22)
+MODELO_NFCE = "65"
+MODELO_SAT = "59"
+
+FECHADO, ABERTO, MEIO_ABERTO = "fechado", "aberto", "meio aberto"
+
+_lock = threading.Lock()
+_portais = {
+    portal: {
+        "amostras": collections.deque(maxlen=JANELA),  # (sucesso, latência em segundos)
+        "estado": FECHADO,
+        "falhas_seguidas": 0,
+        "aberto_ate": 0,
+        "espera": ESPERA_ABERTO,
+        "teste_em_andamento": False,
+    }
+    for portal in ("nfce", "sat")
+}
+_retentativas = {"versao": None, "fila": {}}  # cópia do arquivo, relida quando ele muda
+
+def rota(chave, is_sat=False):
+    """Portais a consultar, em ordem, pelo modelo da chave (65 = NFCe, 59 = CF-e SAT)."""
+    if is_sat:
+        return ["sat"]
+    modelo = chave[20:22]
+    if modelo == MODELO_SAT:
+        return ["sat"]
+    if modelo == MODELO_NFCE:
+        return ["nfce"]
+    # Modelo desconhecido: mantém a tentativa na NFCe seguida do SAT
+    return ["nfce", "sat"]
+
+def liberado(portal):
+    """Diz se o portal pode ser consultado agora (no estado meio aberto, só uma consulta de teste por vez)."""
+    with _lock:
+        saude = _portais[portal]
+        if saude["estado"] == FECHADO:
+            return True
+        if saude["estado"] == ABERTO and time.time() >= saude["aberto_ate"]:
+            saude["estado"] = MEIO_ABERTO
+            logging.info(f"Portal {portal}: circuito meio aberto, enviando consulta de teste.")
+        if saude["estado"] == MEIO_ABERTO and not saude["teste_em_andamento"]:
+            saude["teste_em_andamento"] = True
+            return True
+        return False
+
+def _abrir(portal, saude, motivo):
+    saude["estado"] = ABERTO
+    saude["aberto_ate"] = time.time() + saude["espera"]
+    logging.warning(f"Portal {portal}: circuito aberto por {saude['espera']:.0f}s ({motivo}).")
+
+def registrar(portal, sucesso, latencia=None):
+    """Registra o resultado de uma consulta; sucesso=None (ex.: CAPTCHA sem resposta) não conta."""
+    with _lock:
+        saude = _portais[portal]
+        if saude["estado"] == ABERTO:
+            # Consultas que começaram antes de abrir: não reabrem nem reiniciam a espera
+            return
+        teste = saude["teste_em_andamento"]
+        saude["teste_em_andamento"] = False
+        if sucesso is None:
+            return
+        saude["amostras"].append((sucesso, latencia or 0.0))
+        if sucesso:
+            saude["falhas_seguidas"] = 0
+            if saude["estado"] != FECHADO:
+                logging.info(f"Portal {portal}: consulta de teste bem-sucedida, circuito fechado.")
+                # As falhas de antes da recuperação não contam mais para reabrir o circuito
+                saude["amostras"].clear()
+                saude["amostras"].append((sucesso, latencia or 0.0))
+            saude["estado"] = FECHADO
+            saude["espera"] = ESPERA_ABERTO
+            return
+        saude["falhas_seguidas"] += 1
+        if teste or saude["estado"] == MEIO_ABERTO:
+            # O teste falhou: reabre esperando o dobro
+            saude["espera"] = min(ESPERA_ABERTO_MAXIMA, saude["espera"] * 2)
+            _abrir(portal, saude, "consulta de teste falhou")
+            return
+        amostras = saude["amostras"]
+        taxa = sum(1 for ok, _ in amostras if ok) / len(amostras)
+        if saude["falhas_seguidas"] >= FALHAS_SEGUIDAS:
+            _abrir(portal, saude, f"{saude['falhas_seguidas']} falhas seguidas")
+        elif len(amostras) >= MINIMO_AMOSTRAS and taxa < TAXA_MINIMA_SUCESSO:
+            _abrir(portal, saude, f"taxa de sucesso {taxa:.0%} nas últimas {len(amostras)} consultas")
+
+def resumo_saude():
+    linhas = []
+    with _lock:
+        for portal, saude in _portais.items():
+            amostras = list(saude["amostras"])
+            if amostras:
+                taxa = sum(1 for ok, _ in amostras if ok) / len(amostras)
+                latencias = sorted(latencia for _, latencia in amostras)
+                p95 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))]
+                detalhes = f"{taxa:.0%} de sucesso, latência média {sum(latencias) / len(latencias):.1f}s (p95 {p95:.1f}s) em {len(amostras)} consultas"
+            else:
+                detalhes = "sem consultas recentes"
+            if saude["estado"] == ABERTO:
+                detalhes += f", nova tentativa em {max(0, saude['aberto_ate'] - time.time()):.0f}s"
+            linhas.append(f"{portal.upper()}: {saude['estado']}, {detalhes}")
+    return "\n".join(linhas)
+
+# A fila é dividida pelo bot, pelo worker e pela execução em lote: cada alteração relê o arquivo
+# com a trava entre processos e grava por cima de forma atômica; as consultas só releem se ele mudou.
+
+def _versao_retentativas():
+    try:
+        info = os.stat(ARQUIVO_RETENTATIVAS)
+    except OSError:
+        return None
+    return (info.st_mtime_ns, info.st_size)
+
+def _carregar_retentativas(reler=False):
+    # Chamado com _lock
+    versao = _versao_retentativas()
+    if reler or versao != _retentativas["versao"]:
+        try:
+            with open(ARQUIVO_RETENTATIVAS, encoding="utf-8") as f:
+                fila = json.load(f)
+        except (OSError, ValueError):
+            fila = {}
+        _retentativas.update(versao=versao, fila=fila)
+    return _retentativas["fila"]
+
+def _gravar_retentativas(fila):
+    temporario = f"{ARQUIVO_RETENTATIVAS}.tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(fila, f, ensure_ascii=False, indent=1)
+    os.replace(temporario, ARQUIVO_RETENTATIVAS)
+    _retentativas.update(versao=_versao_retentativas(), fila=fila)
+
+@contextlib.contextmanager
+def _alterando_retentativas():
+    """A fila relida do arquivo com a trava entre processos; gravada no fim, se mudou."""
+    with _lock, limitador.trava_arquivo(f"{ARQUIVO_RETENTATIVAS}.lock"):
+        fila = _carregar_retentativas(reler=True)
+        antes = json.dumps(fila, sort_keys=True)
+        yield fila
+        if json.dumps(fila, sort_keys=True) != antes:
+            _gravar_retentativas(fila)
+
+def _chats(item):
+    # Entradas anteriores aos chats na fila eram todas da conta compartilhada
+    return item.setdefault("chats", [None])
+
+def agendar_retentativa(chave, is_sat=False, motivo="", chat_id=None):
+    """Coloca (ou mantém) a chave na fila de novas tentativas, com espera crescente.
+
+    O chat fica anotado: a nova tentativa grava o recibo nas abas da conta dele.
+    """
+    with _alterando_retentativas() as fila:
+        item = fila.setdefault(chave, {"is_sat": is_sat, "tentativas": 0, "chats": []})
+        if chat_id not in _chats(item):
+            item["chats"].append(chat_id)
+        item["tentativas"] += 1
+        item["motivo"] = motivo
+        item["proxima_em"] = time.time() + min(3600, 60 * 2 ** (item["tentativas"] - 1))
+    if item["tentativas"] >= MAXIMO_TENTATIVAS:
+        logging.error(f"Chave {chave} falhou {item['tentativas']} vezes ({motivo}); fica na fila sem novas tentativas automáticas.")
+    else:
+        logging.info(f"Chave {chave} na fila de novas tentativas ({motivo}), tentativa {item['tentativas']}.")
+
+def concluir_retentativa(chave, chat_id=None):
+    """Tira o chat da entrada da chave; a chave sai da fila quando não sobra nenhum chat."""
+    with _lock:
+        # Caso comum (chave que nunca falhou): sem trava nem releitura forçada
+        if chave not in _carregar_retentativas():
+            return
+    with _alterando_retentativas() as fila:
+        item = fila.get(chave)
+        if item is None:
+            return
+        chats = _chats(item)
+        if chat_id in chats:
+            chats.remove(chat_id)
+        if not chats:
+            del fila[chave]
+
+def na_fila(chave):
+    with _lock:
+        return chave in _carregar_retentativas()
+
+def retentativas_pendentes():
+    """Códigos (com o prefixo "s" para SAT) das chaves cuja próxima tentativa já venceu, por chat: {chat_id: [códigos]}."""
+    agora = time.time()
+    pendentes = {}
+    with _lock:
+        for chave, item in _carregar_retentativas().items():
+            if item["tentativas"] < MAXIMO_TENTATIVAS and item["proxima_em"] <= agora:
+                for chat_id in item.get("chats", [None]):
+                    pendentes.setdefault(chat_id, []).append(("s" if item["is_sat"] else "") + chave)
+    return pendentes
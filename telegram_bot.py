@@ -4,13 +4,19 @@ import telegram
 import argparse  # Adiciona suporte a argumentos de linha de comando
 from telegram.ext import Application, MessageHandler, filters, CommandHandler
 from dotenv import load_dotenv
-from nfce_automation import processar_imagem, limpar_valor, driver, IDLE_PAGE
+import saude_portais
+import fila_jobs
+import estatisticas_precos
+from respostas import montar_resposta_recibos, dividir_resposta, FALHA_CHAVE, FALHA_IMAGEM
 import time
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import asyncio
+import functools
+import threading
 import traceback
 import logging
 import re
+from urllib.parse import urlparse
+from arquivo_recibos import arquivar_imagem
 
 # Carrega as variáveis de ambiente do arquivo .env
 load_dotenv()
@@ -37,86 +43,152 @@ def setup_logging(debug_level):
     # Reduz o nível de logs da biblioteca httpx para evitar ruído
     logging.getLogger("httpx").setLevel(logging.WARNING)
 
-# Configura Google Sheets
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name("credentials.json", scope)
-client = gspread.authorize(creds)
-sheet = client.open("NFCes").worksheet("DADOS")
-
-# Configura Telegram
-bot = telegram.Bot(token=TOKEN)
-
-# URL para "Aguardando Documento"
-# IDLE_PAGE já é importado do nfce_automation
-
-def calcular_insights(empresa, total, itens, is_sat):
-    rows = sheet.get_all_values()[1:]
-    gastos_empresa = [
-        float(limpar_valor(row[11])) if row[11] else 0.0
-        for row in rows
-        if row[0] == empresa
-    ]
-    media = sum(gastos_empresa) / len(gastos_empresa) if gastos_empresa else total
-
-    data_atual = itens[0].get("data") if itens and len(itens) > 0 else None
-    ultimas_compras = [
-        r for r in rows
-        if r[0] == empresa and (data_atual is None or r[12] != data_atual)
-    ][-2:]
-    comparacao = []
-    for item in itens:
-        for compra in ultimas_compras:
-            if item["descricao"] == compra[7]:
-                comparacao.append({
-                    "descricao": item["descricao"],
-                    "hoje": float(item["vlTotal"]),
-                    "anterior": float(limpar_valor(compra[11])),
-                    "data_anterior": compra[12]
-                })
-
-    outros_precos = []
-    for item in itens:
-        codigo = item.get("codigo", "")
-        if codigo:
-            precos = [
-                float(limpar_valor(r[11]))
-                for r in rows
-                if r[4] == codigo and r[0] != empresa
-            ]
-            if precos:
-                media_outros = sum(precos) / len(precos)
-                outros_precos.append({
-                    "descricao": item["descricao"],
-                    "pago": float(item["vlTotal"]),
-                    "media_outros": media_outros
-                })
-
-    categorias = {}
-    for item in itens:
-        cat = item.get("categoria", "Outros")
-        categorias[cat] = categorias.get(cat, 0) + float(item["vlTotal"])
-
-    return {
-        "media": media,
-        "comparacao": comparacao,
-        "outros_precos": outros_precos,
-        "categorias": categorias
-    }
+# Endereços da Bot API; apontando para o telegram_fake.py (ex.: http://127.0.0.1:8081/bot) o bot
+# roda de ponta a ponta sem o Telegram
+API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+ARQUIVOS_URL = os.getenv("TELEGRAM_ARQUIVOS_URL", "https://api.telegram.org/file/bot")
+
+# No modo webhook, o Telegram envia este segredo no cabeçalho X-Telegram-Bot-Api-Secret-Token
+SEGREDO_WEBHOOK = os.getenv("TELEGRAM_SEGREDO") or None
+
+# Tempo máximo (em segundos) que cada consulta espera o usuário responder o CAPTCHA
+CAPTCHA_TIMEOUT = int(os.getenv("CAPTCHA_TIMEOUT", "180"))
+
+# Com ARQUIVAR_RECIBOS=1 as fotos recebidas são guardadas (sem duplicatas) em recibos/arquivo/
+ARQUIVAR_RECIBOS = os.getenv("ARQUIVAR_RECIBOS", "0") == "1"
+
+# Respostas de CAPTCHA são curtas e sem espaços; qualquer outro texto segue o caminho normal
+_PADRAO_RESPOSTA_CAPTCHA = re.compile(r"^\S{1,12}$")
+_PADRAO_CHAVE = re.compile(r"^(\d{44}|[sS]\d{44})$")
+
+def criar_resolvedor_captcha(context, chat_id, loop):
+    # Chamado na thread da consulta: envia a imagem do CAPTCHA ao chat e espera a resposta em handle_text
+    def resolver(imagem, chave, portal):
+        pendente = {"evento": threading.Event(), "resposta": None}
+        pendentes = context.bot_data.setdefault("captchas_pendentes", {})
+        pendentes.setdefault(chat_id, []).append(pendente)
+        try:
+            envio = asyncio.run_coroutine_threadsafe(
+                context.bot.send_photo(
+                    chat_id=chat_id,
+                    photo=imagem,
+                    caption=f"🔐 Responda com o texto do CAPTCHA ({portal.upper()}) da chave {chave}. Você tem {CAPTCHA_TIMEOUT}s."
+                ),
+                loop
+            )
+            envio.result(timeout=30)
+            if not pendente["evento"].wait(CAPTCHA_TIMEOUT):
+                logging.info(f"CAPTCHA da chave {chave} não respondido pelo chat {chat_id}")
+                return None
+            return pendente["resposta"]
+        finally:
+            fila = pendentes.get(chat_id, [])
+            if pendente in fila:
+                fila.remove(pendente)
+            if not fila:
+                pendentes.pop(chat_id, None)
+    return resolver
+
+async def executar_consulta(update, context, **kwargs):
+    # Roda processar_recibos fora do event loop; cada chave usa um navegador do pool,
+    # então várias consultas (de vários usuários ou da mesma foto) andam em paralelo
+    loop = asyncio.get_running_loop()
+    resolver_captcha = criar_resolvedor_captcha(context, update.effective_chat.id, loop)
+
+    # Só o modo local consulta os portais neste processo (Chrome e planilha)
+    from nfce_automation import processar_recibos
+
+    chat_id = update.effective_chat.id
+
+    def tarefa():
+        resultados = processar_recibos(resolver_captcha=resolver_captcha, from_bot=True, chat_id=chat_id, **kwargs)
+        return montar_resposta_recibos(resultados, chat_id) if resultados else None
+
+    return await loop.run_in_executor(None, tarefa)
+
+async def enviar_resposta(update, resposta):
+    for bloco in dividir_resposta(resposta):
+        await update.message.reply_text(bloco)
+
+async def enfileirar(update, context, **kwargs):
+    # Modo fila: a consulta fica para os workers (worker.py), que respondem direto ao chat
+    debug_level = context.bot_data.get("debug_level", 0)
+    await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(fila_jobs.criar_pedido, update.effective_chat.id, debug_level=debug_level, **kwargs)
+    )
 
 async def start(update, context):
     await update.message.reply_text("Olá! Eu sou o bot NFCe. Envie uma foto de um recibo com QR code ou digite a chave de 44 dígitos para começar!")
 
+async def saude(update, context):
+    if context.bot_data.get("fila"):
+        # As consultas acontecem nos workers; aqui só a situação da fila
+        resumo = await asyncio.get_running_loop().run_in_executor(None, fila_jobs.resumo_fila)
+        await update.message.reply_text(f"📬 Fila de consultas: {resumo}")
+        return
+    await update.message.reply_text(f"🩺 Portais da Fazenda:\n{saude_portais.resumo_saude()}")
+
+async def alertas(update, context):
+    # /alertas lista as assinaturas; /alertas DESCRICAO assina; /alertas remover DESCRICAO cancela
+    chat_id = update.effective_chat.id
+    argumentos = list(context.args or [])
+    loop = asyncio.get_running_loop()
+    if argumentos and argumentos[0].lower() == "remover":
+        descricao = " ".join(argumentos[1:])
+        nome = await loop.run_in_executor(None, estatisticas_precos.cancelar, chat_id, descricao)
+        await update.message.reply_text(f"🔕 Alertas de {nome} cancelados." if nome else f"Nenhum alerta assinado para \"{descricao}\".")
+        return
+    if argumentos:
+        descricao = " ".join(argumentos)
+        nome = await loop.run_in_executor(None, estatisticas_precos.assinar, chat_id, descricao)
+        if not nome:
+            await update.message.reply_text(f"Não encontrei \"{descricao}\" nas compras registradas. Use a descrição como aparece no recibo. 😕")
+            return
+        await update.message.reply_text(f"🔔 Você será avisado quando {nome} aparecer com preço acima do normal.")
+        return
+
+    def listar():
+        partes = []
+        for id_produto, nome in estatisticas_precos.assinaturas(chat_id):
+            partes.append("\n".join([f"🔔 {nome}"] + (estatisticas_precos.resumo_produto(id_produto) or ["  sem compras registradas"])))
+        return "\n".join(partes)
+
+    texto = await loop.run_in_executor(None, listar)
+    if not texto:
+        texto = "Nenhum alerta assinado. Use /alertas DESCRIÇÃO DO PRODUTO para ser avisado de preços acima do normal."
+    for bloco in dividir_resposta(texto):
+        await update.message.reply_text(bloco)
+
 async def handle_text(update, context):
     debug_level = context.bot_data.get("debug_level", 0)  # Obtém o debug_level do contexto
     texto = update.message.text.strip()
     logging.debug(f"Texto recebido: {texto}")
-    
+
     # Remover todos os espaços do texto
     texto_sem_espacos = texto.replace(" ", "")
-    
+
     # Verifica se o texto sem espaços tem exatamente 44 dígitos numéricos OU
     # se tem 45 dígitos sendo o primeiro um 's' ou 'S' e o restante 44 dígitos numéricos
-    if not re.match(r'^(\d{44}|[sS]\d{44})$', texto_sem_espacos):
+    chave = _PADRAO_CHAVE.match(texto_sem_espacos)
+
+    # Se há um CAPTCHA aguardando resposta neste chat, o texto é a resposta; uma chave nova
+    # enviada enquanto isso vai para a consulta, e o CAPTCHA continua esperando
+    if not chave and _PADRAO_RESPOSTA_CAPTCHA.match(texto):
+        pendentes = context.bot_data.get("captchas_pendentes", {}).get(update.effective_chat.id)
+        if pendentes:
+            pendente = pendentes[0]
+            pendente["resposta"] = texto
+            pendente["evento"].set()
+            await update.message.reply_text("Resposta do CAPTCHA recebida, consultando... ⏳")
+            return
+        if context.bot_data.get("fila"):
+            # O CAPTCHA pode ter sido enviado por qualquer worker; a resposta segue pela fila
+            respondido = await asyncio.get_running_loop().run_in_executor(None, fila_jobs.responder_captcha, update.effective_chat.id, texto)
+            if respondido:
+                await update.message.reply_text("Resposta do CAPTCHA recebida, consultando... ⏳")
+                return
+
+    if not chave:
         await update.message.reply_text(
             "⚠️ Por favor, envie uma chave com exatamente 44 dígitos numéricos! "
             "Você pode digitar um 's' na frente se perceber que é um SAT e também "
@@ -127,45 +199,16 @@ async def handle_text(update, context):
 
     await update.message.reply_text("Processando sua chave... 🔍")
     try:
-        dados = processar_imagem(chave_manual=texto_sem_espacos, debug_level=debug_level, from_bot=True)
-        if not dados:
+        if context.bot_data.get("fila"):
+            await enfileirar(update, context, tipo="chave", chaves=[(texto_sem_espacos[-44:], len(texto_sem_espacos) == 45)])
+            return
+        resposta = await executar_consulta(update, context, chave_manual=texto_sem_espacos, debug_level=debug_level)
+        if not resposta:
             logging.debug(f"Falha ao processar chave manual: {texto_sem_espacos}")
-            await update.message.reply_text("Não consegui processar a chave. Verifique e tente novamente! 😕")
+            await update.message.reply_text(FALHA_CHAVE)
             return
 
-        empresa = dados.get("emitente", dados.get("empresa", "Desconhecida"))
-        total = float(dados.get("vlTotal", sum(float(i["vlTotal"]) for i in dados["itens"])))
-        insights = calcular_insights(empresa, total, dados["itens"], dados.get("is_sat", False))
-
-        # Verificar se é uma duplicata com base na flag retornada
-        is_duplicate = dados.get("is_duplicate", False)
-        numero_recibo = dados.get("numeroRecibo", "N/A")
-
-        resposta = "✅ Compra processada!\n" if not is_duplicate else f"⚠️ Esta compra (número {numero_recibo}) já foi processada anteriormente!\n"
-        resposta += f"Empresa: {empresa}\n"
-        resposta += f"Data: {dados.get('data', 'N/A')}\n"
-        resposta += f"Total: R${total:.2f}\n"
-        resposta += f"Itens: {len(dados['itens'])}\n"
-        resposta += f"\n📊 Insights:\n"
-        resposta += f"- Valor médio em {empresa}: R${insights['media']:.2f}\n"
-        if insights["comparacao"]:
-            resposta += "- Comparação com compras anteriores:\n"
-            for comp in insights["comparacao"]:
-                resposta += f"  • {comp['descricao']}: R${comp['hoje']:.2f} (anterior: R${comp['anterior']:.2f} em {comp['data_anterior']})\n"
-        else:
-            resposta += "- Sem compras anteriores para comparar.\n"
-        if insights["outros_precos"]:
-            resposta += "- Preços em outros estabelecimentos:\n"
-            for outro in insights["outros_precos"]:
-                resposta += f"  • {outro['descricao']}: R${outro['pago']:.2f} (média em outros: R${outro['media_outros']:.2f})\n"
-        else:
-            resposta += "- Sem dados de outros estabelecimentos.\n"
-        if insights["categorias"]:
-            resposta += "- Gastos por categoria:\n"
-            for cat, valor in insights["categorias"].items():
-                resposta += f"  • {cat}: R${valor:.2f}\n"
-
-        await update.message.reply_text(resposta)
+        await enviar_resposta(update, resposta)
 
     except Exception as e:
         error_msg = f"Erro ao processar: {str(e)}"
@@ -173,74 +216,31 @@ async def handle_text(update, context):
         if logging.getLogger().isEnabledFor(logging.DEBUG):
             logging.debug(f"Traceback: {traceback.format_exc()}")
         await update.message.reply_text(f"Erro ao processar: {str(e)} 😓")
-    finally:
-        try:
-            if driver:
-                logging.debug(f"Driver state before redirect: {driver}")
-                driver.get(IDLE_PAGE)
-                logging.debug("Browser redirecionado para 'Aguardando Documento'")
-        except Exception as e:
-            logging.error(f"Erro ao redirecionar browser: {str(e)}")
 
 async def handle_photo(update, context):
     debug_level = context.bot_data.get("debug_level", 0)  # Obtém o debug_level do contexto
     user = update.message.from_user
     photo_file = await update.message.photo[-1].get_file()
-    photo_path = f"recibos/{user.id}_{int(time.time())}.jpg"
-    os.makedirs("recibos", exist_ok=True)
-    await photo_file.download_to_drive(photo_path)
+    # A foto fica só em memória; o QR code é lido direto dos bytes
+    imagem_bytes = bytes(await photo_file.download_as_bytearray())
+    photo_name = f"{user.id}_{int(time.time())}.jpg"
 
     await update.message.reply_text("Processando sua imagem... 📸")
 
     try:
-        test_data = sheet.col_values(3)
-        logging.debug(f"Google Sheets column 3 data: {test_data}")
-    except Exception as e:
-        logging.error(f"Google Sheets error: {e}")
-        await update.message.reply_text("Erro ao acessar Google Sheets. Contate o administrador.")
-        return
-
-    try:
-        logging.debug(f"Processing image: {photo_path}")
-        dados = processar_imagem(caminho_imagem=photo_path, debug_level=debug_level, from_bot=True)
-        if not dados:
-            logging.debug(f"Failed to process {photo_path}")
-            await update.message.reply_text("Não consegui extrair o QR code. Tente outra imagem ou envie a chave de 44 dígitos! 😕")
+        logging.debug(f"Processing image: {photo_name} ({len(imagem_bytes)} bytes)")
+        if ARQUIVAR_RECIBOS:
+            arquivar_imagem(imagem_bytes)
+        if context.bot_data.get("fila"):
+            await enfileirar(update, context, tipo="imagem", imagem=imagem_bytes)
+            return
+        resposta = await executar_consulta(update, context, imagem_bytes=imagem_bytes, debug_level=debug_level)
+        if not resposta:
+            logging.debug(f"Failed to process {photo_name}")
+            await update.message.reply_text(FALHA_IMAGEM)
             return
 
-        empresa = dados.get("emitente", dados.get("empresa", "Desconhecida"))
-        total = float(dados.get("vlTotal", sum(float(i["vlTotal"]) for i in dados["itens"])))
-        insights = calcular_insights(empresa, total, dados["itens"], dados.get("is_sat", False))
-
-        # Verificar se é uma duplicata com base na flag retornada
-        is_duplicate = dados.get("is_duplicate", False)
-        numero_recibo = dados.get("numeroRecibo", "N/A")
-
-        resposta = "✅ Compra processada!\n" if not is_duplicate else f"⚠️ Esta compra (número {numero_recibo}) já foi processada anteriormente!\n"
-        resposta += f"Empresa: {empresa}\n"
-        resposta += f"Data: {dados.get('data', 'N/A')}\n"
-        resposta += f"Total: R${total:.2f}\n"
-        resposta += f"Itens: {len(dados['itens'])}\n"
-        resposta += f"\n📊 Insights:\n"
-        resposta += f"- Valor médio em {empresa}: R${insights['media']:.2f}\n"
-        if insights["comparacao"]:
-            resposta += "- Comparação com compras anteriores:\n"
-            for comp in insights["comparacao"]:
-                resposta += f"  • {comp['descricao']}: R${comp['hoje']:.2f} (anterior: R${comp['anterior']:.2f} em {comp['data_anterior']})\n"
-        else:
-            resposta += "- Sem compras anteriores para comparar.\n"
-        if insights["outros_precos"]:
-            resposta += "- Preços em outros estabelecimentos:\n"
-            for outro in insights["outros_precos"]:
-                resposta += f"  • {outro['descricao']}: R${outro['pago']:.2f} (média em outros: R${outro['media_outros']:.2f})\n"
-        else:
-            resposta += "- Sem dados de outros estabelecimentos.\n"
-        if insights["categorias"]:
-            resposta += "- Gastos por categoria:\n"
-            for cat, valor in insights["categorias"].items():
-                resposta += f"  • {cat}: R${valor:.2f}\n"
-
-        await update.message.reply_text(resposta)
+        await enviar_resposta(update, resposta)
 
     except Exception as e:
         error_msg = f"Erro ao processar: {str(e)}"
@@ -248,14 +248,6 @@ async def handle_photo(update, context):
         if logging.getLogger().isEnabledFor(logging.DEBUG):
             logging.debug(f"Traceback: {traceback.format_exc()}")
         await update.message.reply_text(f"Erro ao processar: {str(e)} 😓")
-    finally:
-        try:
-            if driver:
-                logging.debug(f"Driver state before redirect: {driver}")
-                driver.get(IDLE_PAGE)
-                logging.debug("Browser redirecionado para 'Aguardando Documento'")
-        except Exception as e:
-            logging.error(f"Erro ao redirecionar browser: {str(e)}")
 
 def main():
     # Configura o parser de argumentos
@@ -267,31 +259,54 @@ def main():
         default=0,
         help="Nível de debug: 0 para INFO (padrão), 1 para DEBUG"
     )
+    parser.add_argument("--webhook", help="URL pública do webhook (ex.: https://bot.exemplo.com/telegram); sem ela o bot usa polling")
+    parser.add_argument("--escutar", default="127.0.0.1", help="Endereço do servidor HTTP do webhook (padrão 127.0.0.1)")
+    parser.add_argument("--porta", type=int, default=8443, help="Porta do servidor HTTP do webhook (padrão 8443)")
+    parser.add_argument("--fila", action="store_true", help="Só recebe as mensagens e enfileira as consultas para o worker.py")
     args = parser.parse_args()
 
     # Configura o logging com base no argumento --debug
     debug_level = args.debug
     setup_logging(debug_level)
 
-    try:
-        if driver:
-            logging.debug(f"Driver state at startup: {driver}")
-            driver.get(IDLE_PAGE)
+    if not args.fila:
+        try:
+            # Abre o primeiro navegador do pool já na tela de "Aguardando Documento"
+            from nfce_automation import obter_navegador, devolver_navegador
+            devolver_navegador(obter_navegador())
             logging.info("Browser inicializado em 'Aguardando Documento'")
-    except Exception as e:
-        logging.error(f"Erro ao inicializar browser: {str(e)}")
+        except Exception as e:
+            logging.error(f"Erro ao inicializar browser: {str(e)}")
 
-    application = Application.builder().token(TOKEN).build()
+    application = (
+        Application.builder().token(TOKEN).base_url(API_URL).base_file_url(ARQUIVOS_URL)
+        .concurrent_updates(True).build()
+    )
 
     # Armazena o debug_level no contexto do bot para uso nas funções handle_text e handle_photo
     application.bot_data["debug_level"] = debug_level
+    application.bot_data["fila"] = args.fila
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("saude", saude))
+    application.add_handler(CommandHandler("alertas", alertas))
     application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
     
-    logging.info("Bot está rodando...")
-    application.run_polling()
+    if args.webhook:
+        # Várias réplicas com --fila podem rodar atrás do mesmo proxy, cada uma na sua porta
+        caminho = urlparse(args.webhook).path.strip("/")
+        logging.info(f"Bot está rodando com webhook em http://{args.escutar}:{args.porta}/{caminho}...")
+        application.run_webhook(
+            listen=args.escutar,
+            port=args.porta,
+            url_path=caminho,
+            webhook_url=args.webhook,
+            secret_token=SEGREDO_WEBHOOK
+        )
+    else:
+        logging.info("Bot está rodando...")
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
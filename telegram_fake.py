@@ -0,0 +1,307 @@
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Bot API local que imita o Telegram, para testar o bot (polling ou webhook) e os workers de ponta a ponta.
+# Uso:
+#   python telegram_fake.py --porta 8081
+#   export TELEGRAM_API_URL=http://127.0.0.1:8081/bot TELEGRAM_ARQUIVOS_URL=http://127.0.0.1:8081/file/bot
+#   python telegram_bot.py --fila --webhook http://127.0.0.1:8443/telegram --porta 8443
+#   python worker.py
+#   python telegram_fake.py --enviar "3525 0447 ..."    (ou --foto recibo.jpg)
+# O último comando faz o papel do usuário: manda a mensagem, mostra as respostas do bot e, quando
+# chega um CAPTCHA, grava a imagem e pergunta o texto no terminal.
+# Rotas extras (só do fake):
+#   POST /fake/mensagem {"chat_id": 1, "texto": "..."}   mensagem de texto do usuário
+#   POST /fake/foto?chat_id=1  (corpo = bytes da imagem)  foto enviada pelo usuário
+#   GET  /fake/respostas?chat_id=1&depois=0               mensagens enviadas pelo bot ao chat
+#   GET  /fake/arquivo/<file_id>                          arquivo enviado pelo bot (ex.: CAPTCHA)
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+_lock = threading.Condition()
+webhook = {"url": None, "segredo": None}
+atualizacoes = []  # updates à espera de getUpdates (quando não há webhook)
+mensagens = []  # mensagens enviadas pelo bot
+arquivos = {}  # file_id -> bytes
+_ids_update = itertools.count(1)
+_ids_mensagem = itertools.count(1)
+_ids_arquivo = itertools.count(1)
+
+class ErroApi(Exception):
+    def __init__(self, codigo, descricao):
+        super().__init__(descricao)
+        self.codigo = codigo
+        self.descricao = descricao
+
+USUARIO_BOT = {"id": 1, "is_bot": True, "first_name": "NFCe Fake", "username": "nfce_fake_bot"}
+
+def _mensagem(chat_id, remetente, **campos):
+    return {
+        "message_id": next(_ids_mensagem),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": remetente,
+        **campos,
+    }
+
+def _guardar_arquivo(conteudo):
+    file_id = f"arquivo{next(_ids_arquivo)}"
+    with _lock:
+        arquivos[file_id] = conteudo
+    return {"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 480, "file_size": len(conteudo)}
+
+def _entregar(update):
+    # Com webhook, o update é enviado por POST (como o Telegram faz); sem webhook, fica para getUpdates
+    with _lock:
+        url, segredo = webhook["url"], webhook["segredo"]
+        if not url:
+            atualizacoes.append(update)
+            _lock.notify_all()
+            return
+    cabecalhos = {"Content-Type": "application/json"}
+    if segredo:
+        cabecalhos["X-Telegram-Bot-Api-Secret-Token"] = segredo
+    requisicao = urllib.request.Request(url, data=json.dumps(update).encode("utf-8"), headers=cabecalhos, method="POST")
+    try:
+        with urllib.request.urlopen(requisicao, timeout=10) as resposta:
+            logging.info(f"Update {update['update_id']} entregue ao webhook ({resposta.status})")
+    except OSError as e:
+        logging.error(f"Erro ao entregar o update {update['update_id']} ao webhook {url}: {e}")
+
+def mensagem_do_usuario(chat_id, texto=None, foto=None):
+    usuario = {"id": chat_id, "is_bot": False, "first_name": "Usuário Fake"}
+    if foto is not None:
+        mensagem = _mensagem(chat_id, usuario, photo=[_guardar_arquivo(foto)])
+    else:
+        mensagem = _mensagem(chat_id, usuario, text=texto)
+    update = {"update_id": next(_ids_update), "message": mensagem}
+    # Em outra thread: o webhook do bot pode demorar a responder
+    threading.Thread(target=_entregar, args=(update,), daemon=True).start()
+    return update
+
+def _registrar_envio(chat_id, **campos):
+    mensagem = _mensagem(int(chat_id), USUARIO_BOT, **campos)
+    with _lock:
+        mensagens.append(mensagem)
+    logging.info(f"Bot -> chat {chat_id}: {campos.get('text') or campos.get('caption') or '(foto)'}")
+    return mensagem
+
+def api_get_updates(parametros):
+    offset = int(parametros.get("offset") or 0)
+    timeout = float(parametros.get("timeout") or 0)
+    limite = time.time() + timeout
+    with _lock:
+        if webhook["url"]:
+            raise ErroApi(409, "Conflict: can't use getUpdates method while webhook is active; use deleteWebhook to delete the webhook first")
+        while True:
+            atualizacoes[:] = [u for u in atualizacoes if u["update_id"] >= offset]
+            if atualizacoes or time.time() >= limite:
+                return list(atualizacoes)
+            _lock.wait(max(0.0, limite - time.time()))
+
+def api_set_webhook(parametros):
+    with _lock:
+        webhook["url"] = parametros.get("url") or None
+        webhook["segredo"] = parametros.get("secret_token") or None
+    logging.info(f"Webhook definido: {webhook['url']}")
+    return True
+
+def api_delete_webhook(parametros):
+    with _lock:
+        webhook["url"] = webhook["segredo"] = None
+        if parametros.get("drop_pending_updates") in ("true", True):
+            atualizacoes.clear()
+    return True
+
+def api_get_webhook_info(parametros):
+    with _lock:
+        return {"url": webhook["url"] or "", "has_custom_certificate": False, "pending_update_count": len(atualizacoes)}
+
+def api_send_message(parametros):
+    return _registrar_envio(parametros["chat_id"], text=parametros.get("text", ""))
+
+def api_send_photo(parametros):
+    foto = parametros.get("photo")
+    if isinstance(foto, bytes):
+        tamanhos = [_guardar_arquivo(foto)]
+    else:
+        tamanhos = [{"file_id": foto, "file_unique_id": foto, "width": 640, "height": 480}]
+    campos = {"photo": tamanhos}
+    if parametros.get("caption"):
+        campos["caption"] = parametros["caption"]
+    return _registrar_envio(parametros["chat_id"], **campos)
+
+def api_get_file(parametros):
+    file_id = parametros["file_id"]
+    with _lock:
+        if file_id not in arquivos:
+            raise ErroApi(400, "Bad Request: invalid file_id")
+        tamanho = len(arquivos[file_id])
+    return {"file_id": file_id, "file_unique_id": file_id, "file_size": tamanho, "file_path": f"arquivos/{file_id}"}
+
+METODOS = {
+    "getme": lambda parametros: USUARIO_BOT,
+    "getupdates": api_get_updates,
+    "setwebhook": api_set_webhook,
+    "deletewebhook": api_delete_webhook,
+    "getwebhookinfo": api_get_webhook_info,
+    "sendmessage": api_send_message,
+    "sendphoto": api_send_photo,
+    "getfile": api_get_file,
+}
+
+def _ler_parametros(handler, url):
+    # A Bot API aceita query string, JSON, formulário e multipart (usado no envio de fotos)
+    parametros = {chave: valores[0] for chave, valores in parse_qs(url.query).items()}
+    tamanho = int(handler.headers.get("Content-Length", 0))
+    corpo = handler.rfile.read(tamanho) if tamanho else b""
+    tipo = handler.headers.get("Content-Type", "")
+    if not corpo:
+        return parametros
+    if tipo.startswith("application/json"):
+        parametros.update(json.loads(corpo))
+    elif tipo.startswith("multipart/form-data"):
+        mensagem = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {tipo}\r\n\r\n".encode("latin-1") + corpo
+        )
+        for parte in mensagem.iter_parts():
+            nome = parte.get_param("name", header="content-disposition")
+            conteudo = parte.get_payload(decode=True)
+            parametros[nome] = conteudo if parte.get_filename() else conteudo.decode("utf-8")
+    else:
+        parametros.update({chave: valores[0] for chave, valores in parse_qs(corpo.decode("utf-8")).items()})
+    return parametros
+
+class TelegramFakeHandler(BaseHTTPRequestHandler):
+    def responder(self, corpo, tipo="application/json", status=200):
+        dados = corpo if isinstance(corpo, bytes) else json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        partes = url.path.strip("/").split("/")
+        if url.path == "/fake/respostas":
+            consulta = parse_qs(url.query)
+            chat_id = int(consulta.get("chat_id", ["0"])[0])
+            depois = int(consulta.get("depois", ["0"])[0])
+            with _lock:
+                lista = [m for m in mensagens if m["chat"]["id"] == chat_id and m["message_id"] > depois]
+            self.responder(lista)
+        elif (len(partes) == 3 and partes[:2] == ["fake", "arquivo"]) or (len(partes) == 4 and partes[0] == "file"):
+            with _lock:
+                conteudo = arquivos.get(partes[-1])
+            if conteudo is None:
+                self.responder({"ok": False, "description": "Not Found"}, status=404)
+            else:
+                self.responder(conteudo, tipo="application/octet-stream")
+        else:
+            self.chamar_api(url)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/fake/mensagem":
+            parametros = _ler_parametros(self, url)
+            self.responder(mensagem_do_usuario(int(parametros.get("chat_id", 1)), texto=parametros["texto"]))
+        elif url.path == "/fake/foto":
+            chat_id = int(parse_qs(url.query).get("chat_id", ["1"])[0])
+            tamanho = int(self.headers.get("Content-Length", 0))
+            self.responder(mensagem_do_usuario(chat_id, foto=self.rfile.read(tamanho)))
+        else:
+            self.chamar_api(url)
+
+    def chamar_api(self, url):
+        # /bot<token>/<metodo>
+        partes = url.path.strip("/").split("/")
+        if len(partes) != 2 or not partes[0].startswith("bot"):
+            self.responder({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+            return
+        metodo = partes[1].lower()
+        try:
+            parametros = _ler_parametros(self, url)
+            if metodo not in METODOS:
+                logging.warning(f"Método {partes[1]} não implementado no fake; respondendo True")
+                resultado = True
+            else:
+                resultado = METODOS[metodo](parametros)
+            self.responder({"ok": True, "result": resultado})
+        except ErroApi as e:
+            self.responder({"ok": False, "error_code": e.codigo, "description": e.descricao}, status=e.codigo)
+        except (KeyError, ValueError) as e:
+            self.responder({"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}, status=400)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def _requisitar(servidor, caminho, dados=None, tipo="application/json"):
+    requisicao = urllib.request.Request(f"{servidor}{caminho}", data=dados, headers={"Content-Type": tipo})
+    with urllib.request.urlopen(requisicao, timeout=30) as resposta:
+        return resposta.read()
+
+def conversar(servidor, chat_id, texto=None, foto=None, espera=60):
+    """Faz o papel do usuário: envia a mensagem e mostra as respostas até o bot ficar espera segundos calado."""
+    if foto:
+        with open(foto, "rb") as f:
+            _requisitar(servidor, f"/fake/foto?chat_id={chat_id}", f.read(), "application/octet-stream")
+    else:
+        _requisitar(servidor, "/fake/mensagem", json.dumps({"chat_id": chat_id, "texto": texto}).encode("utf-8"))
+    ultima = max((m["message_id"] for m in json.loads(_requisitar(servidor, f"/fake/respostas?chat_id={chat_id}"))), default=0)
+    ultima_atividade = time.time()
+    while time.time() - ultima_atividade < espera:
+        novas = json.loads(_requisitar(servidor, f"/fake/respostas?chat_id={chat_id}&depois={ultima}"))
+        for mensagem in novas:
+            ultima = mensagem["message_id"]
+            ultima_atividade = time.time()
+            if "photo" in mensagem:
+                file_id = mensagem["photo"][-1]["file_id"]
+                destino = f"captcha_{file_id}.png"
+                with open(destino, "wb") as f:
+                    f.write(_requisitar(servidor, f"/fake/arquivo/{file_id}"))
+                print(f"[bot] {mensagem.get('caption', '')}\n      imagem gravada em {os.path.abspath(destino)}")
+                resposta = input("Texto do CAPTCHA: ").strip()
+                _requisitar(servidor, "/fake/mensagem", json.dumps({"chat_id": chat_id, "texto": resposta}).encode("utf-8"))
+                ultima_atividade = time.time()
+            else:
+                print(f"[bot] {mensagem.get('text', '')}")
+        time.sleep(0.5)
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot API local que imita o Telegram para testes de ponta a ponta")
+    parser.add_argument("--porta", type=int, default=8081, help="Porta HTTP (padrão 8081)")
+    parser.add_argument("--enviar", help="Em vez de subir o servidor, envia este texto como usuário e mostra as respostas")
+    parser.add_argument("--foto", help="Em vez de subir o servidor, envia esta imagem como usuário e mostra as respostas")
+    parser.add_argument("--chat", type=int, default=1, help="chat_id do usuário fake (padrão 1)")
+    parser.add_argument("--espera", type=float, default=60, help="Segundos sem resposta do bot para encerrar a conversa (padrão 60)")
+    args = parser.parse_args()
+
+    if args.enviar or args.foto:
+        conversar(f"http://127.0.0.1:{args.porta}", args.chat, texto=args.enviar, foto=args.foto, espera=args.espera)
+        return
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", args.porta), TelegramFakeHandler)
+    logging.info(f"Telegram fake em http://127.0.0.1:{args.porta}/bot<token>/<método>")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+if __name__ == "__main__":
+    main()
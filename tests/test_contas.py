@@ -0,0 +1,20 @@
+import contas
+
+CHAVE = "35250411111111000111650010000012341000012345"
+
+def test_conta_da_aba():
+    assert contas.conta_da_aba("DADOS") == contas.COMPARTILHADA
+    assert contas.conta_da_aba("DADOS_2025_04") == contas.COMPARTILHADA
+    assert contas.conta_da_aba("CONTA_-100123") == "-100123"
+    assert contas.conta_da_aba("CONTA_42_2025_04") == "42"
+
+def test_recibo_de_dois_chats_soma_so_na_primeira_conta():
+    donos = contas.donos_dos_recibos([[CHAVE, "1234", "42"], [CHAVE, "1234", "7"], [CHAVE, "1234", ""]])
+    assert donos == {("11111111000111", "1234"): "42"}
+    linha = ["LOJA", "11.111.111/0001-11", " 1234 "]
+    assert contas.conta_soma_a_linha(linha, "42", donos)
+    assert not contas.conta_soma_a_linha(linha, "7", donos)
+    assert not contas.conta_soma_a_linha(linha, contas.COMPARTILHADA, donos)
+    # Recibo sem chave na chaves44 (importado de um backup) e sem contas por chat: sempre soma
+    assert contas.conta_soma_a_linha(["LOJA", "22.222.222/0001-22", "9"], "7", donos)
+    assert contas.conta_soma_a_linha(linha, "7", None)
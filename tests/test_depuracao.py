@@ -0,0 +1,46 @@
+import gzip
+import os
+import pytest
+import depuracao
+
+@pytest.fixture
+def pasta(tmp_path, monkeypatch):
+    monkeypatch.setattr(depuracao, "PASTA_DEBUG", str(tmp_path / "debug"))
+    monkeypatch.setattr(depuracao, "_arquivos", None)
+    monkeypatch.setattr(depuracao, "_por_chave", {})
+    monkeypatch.setattr(depuracao, "_total_bytes", 0)
+    return tmp_path / "debug"
+
+def _capturas(pasta):
+    return sorted(
+        (os.path.basename(raiz), nome)
+        for raiz, _, nomes in os.walk(pasta) for nome in nomes
+    )
+
+def test_maximo_por_chave(pasta, monkeypatch):
+    monkeypatch.setattr(depuracao, "MAXIMO_POR_CHAVE", 2)
+    for i in range(4):
+        depuracao._gravar("1" * 44, f"nfce{i}", "<html></html>", falha=True)
+    depuracao._gravar("2" * 44, "sat", "<html></html>", falha=True)
+    capturas = _capturas(pasta)
+    assert [nome.split("_", 3)[3] for chave, nome in capturas if chave == "1" * 44] == ["nfce2_falha.html.gz", "nfce3_falha.html.gz"]
+    assert len(capturas) == 3
+    assert depuracao._total_bytes == sum(os.path.getsize(os.path.join(pasta, chave, nome)) for chave, nome in capturas)
+
+def test_limite_de_bytes_remove_as_mais_antigas(pasta, monkeypatch):
+    monkeypatch.setattr(depuracao, "MAXIMO_POR_CHAVE", 2)
+    # Conteúdo aleatório, para as capturas ficarem com quase o mesmo tamanho depois do gzip; cabem três
+    html = [os.urandom(1000).hex() for _ in range(6)]
+    monkeypatch.setattr(depuracao, "LIMITE_BYTES", int(len(gzip.compress(html[0].encode())) * 3.5))
+    for i, chave in enumerate(["1", "2", "3", "1", "3", "1"]):
+        depuracao._gravar(chave * 44, f"p{i}", html[i], falha=True)
+    capturas = _capturas(pasta)
+    # O limite da chave 1 tirou p0; o de bytes, as mais antigas que sobraram (p1 e p2)
+    assert sorted(nome.split("_", 3)[3] for _, nome in capturas) == ["p3_falha.html.gz", "p4_falha.html.gz", "p5_falha.html.gz"]
+    assert depuracao._total_bytes == sum(os.path.getsize(os.path.join(pasta, chave, nome)) for chave, nome in capturas)
+    assert set(depuracao._por_chave) == {os.path.join(str(pasta), "1" * 44), os.path.join(str(pasta), "3" * 44)}
+
+    # Outro processo (ou um reinício) começa a contar pelo que está no disco
+    monkeypatch.setattr(depuracao, "_arquivos", None)
+    depuracao._gravar("3" * 44, "p6", "<html></html>", falha=True)
+    assert [nome.split("_", 3)[3] for chave, nome in _capturas(pasta) if chave == "3" * 44] == ["p4_falha.html.gz", "p6_falha.html.gz"]
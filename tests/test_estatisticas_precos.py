@@ -0,0 +1,65 @@
+import statistics
+import threading
+import estatisticas_precos as ep
+from modelo import Item, Recibo
+
+def test_registro_tem_60_bytes_e_volta_igual():
+    valores = [7, 11111111000111, 3, 512.5, 1250.25, 498.7, 525, 2.75, 1760000000]
+    assert ep.REGISTRO.size == 60
+    assert list(ep.REGISTRO.unpack(ep.REGISTRO.pack(*valores))) == valores
+
+def test_welford_e_ewma_batem_com_o_calculo_direto():
+    precos = [499, 519, 489, 505, 899]
+    valores = [1, 0, 0, 0.0, 0.0, 0.0, 0, 0.0, 0]
+    for preco in precos:
+        ep._atualizar_valores(valores, preco, 0)
+    assert valores[ep.COMPRAS] == len(precos)
+    assert abs(valores[ep.MEDIA] - statistics.mean(precos)) < 1e-9
+    assert abs(ep.desvio_padrao(valores) - statistics.stdev(precos)) < 1e-9
+    ewma = float(precos[0])
+    for preco in precos[1:]:
+        ewma = ep.ALFA_EWMA * preco + (1 - ep.ALFA_EWMA) * ewma
+    assert abs(valores[ep.EWMA] - ewma) < 1e-9
+    assert valores[ep.ULTIMO] == 899
+    # O último preço foi comparado com as quatro compras anteriores
+    anteriores = precos[:-1]
+    referencia = max(statistics.stdev(anteriores), statistics.mean(anteriores) * ep.DESVIO_MINIMO, 1.0)
+    assert abs(valores[ep.DESVIOS] - (899 - statistics.mean(anteriores)) / referencia) < 1e-9
+    assert ep.acima_do_normal(valores)
+
+def test_atualizar_e_consultar_pelo_arquivo(tmp_path, monkeypatch):
+    monkeypatch.setattr(ep, "ARQUIVO_PRECOS", str(tmp_path / "precos.bin"))
+    monkeypatch.setattr(ep, "ARQUIVO_TRAVA", str(tmp_path / "precos.bin.lock"))
+    monkeypatch.setattr(ep, "_posicoes", {})
+    monkeypatch.setattr(ep, "_arquivo_lido", {"inode": None, "tamanho": ep.CABECALHO.size})
+    ep.atualizar([(1, "11.111.111/0001-11", 500), (2, None, 300), (1, "11.111.111/0001-11", 520)])
+    loja, sem_cnpj, ausente = ep.consultar([(1, "11111111000111"), (2, ""), (3, None)])
+    assert (loja[ep.COMPRAS], loja[ep.MEDIA], loja[ep.ULTIMO]) == (2, 510.0, 520)
+    assert (sem_cnpj[ep.CNPJ], sem_cnpj[ep.COMPRAS]) == (0, 1)
+    assert ausente is None
+    assert (tmp_path / "precos.bin").stat().st_size == ep.CABECALHO.size + 2 * ep.REGISTRO.size
+
+def test_data_ordenavel_nfce_e_sat():
+    datas = ["26/04/2025", "2025-04-25", "N/A", "2025-05-01"]
+    assert sorted(datas, key=ep._data_ordenavel) == ["N/A", "2025-04-25", "26/04/2025", "2025-05-01"]
+
+def test_alertas_saem_em_segundo_plano(monkeypatch):
+    monkeypatch.setattr(ep, "_ler_assinaturas", lambda: {"7": [111, 222]})
+    liberar = threading.Event()
+    enviadas = []
+
+    def enviar(chat_id, texto):
+        # Telegram lento: a gravação dos recibos não pode esperar por ele
+        liberar.wait(5)
+        enviadas.append((chat_id, texto))
+
+    monkeypatch.setattr(ep, "_enviar_mensagem", enviar)
+    recibo = Recibo.criar("MERCADO X", "11.111.111/0001-11", "1234", "N/A", "2025-04-25", "10:31:02", [])
+    item = Item.criar("789", "ARROZ TIPO 1 5KG", "1", "UN", "39,90", "39,90")
+    valores = [7, 11111111000111, 5, 2490.0, 0.0, 2490.0, 3990, 4.5, 0]
+    ep._notificar_assinantes([(recibo, item, valores)])
+    assert enviadas == []
+    liberar.set()
+    ep.aguardar_alertas()
+    assert [chat_id for chat_id, _ in enviadas] == [111, 222]
+    assert "ARROZ TIPO 1 5KG: R$39.90 em MERCADO X (2025-04-25), 4.5 desvios" in enviadas[0][1]
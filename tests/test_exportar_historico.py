@@ -0,0 +1,35 @@
+import datetime
+import json
+import os
+import time
+import pytest
+import exportar_historico
+
+def test_data_nfce_e_sat():
+    assert exportar_historico._data("2025-04-25") == datetime.date(2025, 4, 25)
+    assert exportar_historico._data("25/04/2025") == datetime.date(2025, 4, 25)
+    assert exportar_historico._data("N/A") is None
+
+def _linha(empresa, data, is_sat):
+    return [empresa, "11.111.111/0001-11", "1", "", "789", "ARROZ", "Graos e Cereais", "ARROZ 5KG", "1", "UN", "4,99", "4,99", data, "10:00", str(is_sat)]
+
+def test_linhas_insights_le_so_a_aba_e_mantem_a_data(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(exportar_historico, "PASTA_HISTORICO", str(tmp_path))
+    monkeypatch.setattr(exportar_historico, "INSIGHTS_DOS_ARQUIVOS", True)
+    pasta = exportar_historico._pasta_particao(datetime.date(2025, 4, 1), "11.111.111/0001-11")
+    partes = {
+        "DADOS_2025_04": [_linha("LOJA", "2025-04-25", False), _linha("LOJA", "26/04/2025", True)],
+        "CONTA_42_2025_04": [_linha("OUTRO CHAT", "2025-04-20", False)],
+        "DADOS": [_linha("LOJA", "2025-04-25", False)],
+    }
+    for aba, linhas in partes.items():
+        caminho = os.path.join(pasta, f"parte-{aba}-000000000.arrow")
+        exportar_historico._gravar_arquivo(exportar_historico._tabela(linhas), caminho, "arrow")
+    estado = {aba: {"linhas": len(linhas), "exportado_em": time.time()} for aba, linhas in partes.items()}
+    with open(tmp_path / "_exportacao.json", "w", encoding="utf-8") as f:
+        json.dump(estado, f)
+
+    linhas = exportar_historico.linhas_insights("DADOS_2025_04")
+    assert [(linha[0], linha[11], linha[12]) for linha in linhas] == [("LOJA", "4.99", "2025-04-25"), ("LOJA", "4.99", "26/04/2025")]
+    assert [linha[0] for linha in exportar_historico.linhas_insights("CONTA_42_2025_04")] == ["OUTRO CHAT"]
@@ -0,0 +1,50 @@
+import pytest
+import fila_jobs
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+@pytest.fixture
+def relogio(tmp_path, monkeypatch):
+    monkeypatch.setattr(fila_jobs, "URL_BROKER", "")
+    relogio = Relogio()
+    monkeypatch.setattr(fila_jobs.time, "time", relogio)
+    original = fila_jobs.ARQUIVO_FILA
+    fila_jobs.usar_arquivo(str(tmp_path / "fila.db"))
+    yield relogio
+    fila_jobs.usar_arquivo(original)
+
+def test_lease_vencido_volta_para_a_fila(relogio):
+    chave = "1" * 44
+    fila_jobs.criar_pedido(42, "chave", [(chave, False)])
+    job = fila_jobs.proximo_job("worker-a")
+    assert (job["chave"], job["tentativas"], job["desistir"]) == (chave, 1, False)
+    # Com o lease valendo, nenhum outro worker pega o job
+    assert fila_jobs.proximo_job("worker-b") is None
+
+    # O heartbeat renova o lease
+    relogio.agora += fila_jobs.LEASE_SEGUNDOS - 1
+    assert fila_jobs.heartbeat("worker-a", [job["id"]]) == [job["id"]]
+    relogio.agora += fila_jobs.LEASE_SEGUNDOS - 1
+    assert fila_jobs.proximo_job("worker-b") is None
+
+    # Sem heartbeat, o lease vence e o job passa para outro worker
+    relogio.agora += 2
+    reatribuido = fila_jobs.proximo_job("worker-b")
+    assert (reatribuido["id"], reatribuido["worker"], reatribuido["tentativas"]) == (job["id"], "worker-b", 2)
+    assert fila_jobs.heartbeat("worker-a", [job["id"]]) == []
+    assert fila_jobs.concluir_job(job["id"], "worker-a") is None
+    pedido = fila_jobs.concluir_job(job["id"], "worker-b")
+    assert (pedido["chat_id"], [j["estado"] for j in pedido["jobs"]]) == (42, [fila_jobs.CONCLUIDO])
+
+def test_job_desiste_depois_de_vencer_todos_os_leases(relogio):
+    fila_jobs.criar_pedido(42, "chave", [("2" * 44, False)])
+    for tentativa in range(1, fila_jobs.MAXIMO_TENTATIVAS + 2):
+        job = fila_jobs.proximo_job(f"worker-{tentativa}")
+        assert job["tentativas"] == tentativa
+        relogio.agora += fila_jobs.LEASE_SEGUNDOS + 1
+    assert job["desistir"]
@@ -0,0 +1,43 @@
+import importador
+
+CABECALHO = "Empresa,CNPJ,NumeroRecibo,Consumidor,Codigo,NomeCurto,Categoria,Descricao,Quantidade,Unidade,ValorUnitario,ValorTotal,Data,Hora,SAT\n"
+
+def _ler(tmp_path, *linhas):
+    caminho = tmp_path / "NFCes_backup_20250425_diario.csv"
+    caminho.write_text(CABECALHO + "".join(linha + "\n" for linha in linhas), encoding="utf-8")
+    return importador.ler_backup_csv(str(caminho))
+
+def test_linha_sem_virgulas_extras(tmp_path):
+    linha = "MERCADO X,11.111.111/0001-11,1234,N/A,789,ARROZ TIPO,Graos e Cereais,ARROZ TIPO 1 5KG,1.0,UN,24.9,24.9,2025-04-25,10:31:02,False"
+    assert _ler(tmp_path, linha) == [linha.split(",")]
+
+def test_dinheiro_e_quantidade_com_virgula_decimal(tmp_path):
+    [row] = _ler(tmp_path, "MERCADO X,11.111.111/0001-11,1234,N/A,789,BANANA PRATA,Frutas,BANANA PRATA KG,0,850,KG,5,99,5,09,25/04/2025,10:31:02,True")
+    assert row[5:] == ["BANANA PRATA", "Frutas", "BANANA PRATA KG", "0,850", "KG", "5,99", "5,09", "25/04/2025", "10:31:02", "True"]
+
+def test_virgulas_na_descricao_e_no_nome_curto(tmp_path):
+    [row] = _ler(tmp_path, "MERCADO X,11.111.111/0001-11,1234,N/A,789,LEITE,INTEGRAL,Laticinios,LEITE,INTEGRAL 1L,2,UN,4,99,9,98,2025-04-25,10:31:02,False")
+    assert row[5:12] == ["LEITE,INTEGRAL", "Laticinios", "LEITE,INTEGRAL 1L", "2", "UN", "4,99", "9,98"]
+    assert len(row) == importador.COLUNAS_DADOS
+
+def test_linhas_que_nao_encaixam_sao_descartadas(tmp_path):
+    assert _ler(
+        tmp_path,
+        # Sem a coluna SAT no fim
+        "MERCADO X,11.111.111/0001-11,1234,N/A,789,ARROZ TIPO,Graos e Cereais,ARROZ TIPO 1 5KG,1.0,UN,24.9,24.9,2025-04-25,10:31:02",
+        # Data no lugar do valor total
+        "MERCADO X,11.111.111/0001-11,1234,N/A,789,ARROZ TIPO,Graos e Cereais,ARROZ,1.0,UN,24.9,2025-04-25,2025-04-25,10:31:02,False",
+        # Categoria desconhecida
+        "MERCADO X,11.111.111/0001-11,1234,N/A,789,ARROZ TIPO,Arroz,ARROZ TIPO 1 5KG,1.0,UN,24.9,24.9,2025-04-25,10:31:02,False",
+    ) == []
+
+def test_virgula_na_empresa(tmp_path):
+    [row] = _ler(tmp_path, "MERCADO X, LTDA,11.111.111/0001-11,1234,N/A,789,ARROZ TIPO,Graos e Cereais,ARROZ TIPO 1 5KG,1.0,UN,24.9,24.9,2025-04-25,10:31:02,False")
+    assert row[:8] == ["MERCADO X, LTDA", "11.111.111/0001-11", "1234", "N/A", "789", "ARROZ TIPO", "Graos e Cereais", "ARROZ TIPO 1 5KG"]
+
+def test_sat_sem_cnpj(tmp_path):
+    [row] = _ler(tmp_path, "N/A,N/A,N/A,N/A,789,ARROZ TIPO,Graos e Cereais,ARROZ TIPO 1 5KG,1.0,UN,24.9,24.9,N/A,N/A,True")
+    assert row[:3] == ["N/A", "N/A", "N/A"]
+
+def test_empresa_com_virgula_sem_cnpj_e_descartada(tmp_path):
+    assert _ler(tmp_path, "MERCADO X, LTDA,123,1234,N/A,789,ARROZ TIPO,Graos e Cereais,ARROZ TIPO 1 5KG,1.0,UN,24.9,24.9,2025-04-25,10:31:02,False") == []
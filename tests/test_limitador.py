@@ -0,0 +1,89 @@
+import json
+import os
+import subprocess
+import sys
+import limitador
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _processo(tmp_path, codigo, orcamento):
+    # Outro processo com o mesmo LIMITADOR_ARQUIVO: só o arquivo de estado é compartilhado
+    ambiente = dict(os.environ, LIMITADOR_ARQUIVO=str(tmp_path / "limitador.json"), LIMITE_PORTAL_NFCE=orcamento, PYTHONPATH=RAIZ)
+    return subprocess.Popen([sys.executable, "-c", "import limitador\n" + codigo], env=ambiente, stdout=subprocess.PIPE, text=True)
+
+def _fichas(tmp_path, codigo, orcamento="4/1000"):
+    processo = _processo(tmp_path, codigo, orcamento)
+    saida, _ = processo.communicate(timeout=60)
+    assert processo.returncode == 0
+    return json.loads(saida)
+
+TIRAR = "import json; print(json.dumps([limitador._tentar('portal_nfce', limitador.PRIORIDADE_{}) for _ in range({})]))"
+
+def test_lote_deixa_a_reserva_para_o_bot_de_outro_processo(tmp_path):
+    # Balde de 4 com reserva de 25%: o lote para quando sobra 1 ficha, que fica para o interativo
+    lote = _fichas(tmp_path, TIRAR.format("LOTE", 4))
+    assert [espera == 0 for espera in lote] == [True, True, True, False]
+    interativo = _fichas(tmp_path, TIRAR.format("INTERATIVA", 2))
+    assert interativo[0] == 0 and interativo[1] > 0
+
+def test_balde_reabastece_pelo_tempo_gravado_no_arquivo(tmp_path):
+    assert all(espera == 0 for espera in _fichas(tmp_path, TIRAR.format("INTERATIVA", 4)))
+    assert 240 < _fichas(tmp_path, TIRAR.format("INTERATIVA", 1))[0] <= 250
+    # Meio período depois (4 fichas a cada 1000s), o outro processo encontra 2 fichas
+    arquivo = tmp_path / "limitador.json"
+    estado = json.loads(arquivo.read_text(encoding="utf-8"))
+    estado["portal_nfce"]["atualizado"] -= 500
+    arquivo.write_text(json.dumps(estado), encoding="utf-8")
+    assert [espera == 0 for espera in _fichas(tmp_path, TIRAR.format("INTERATIVA", 3))] == [True, True, False]
+
+def test_dois_processos_nao_gastam_a_mesma_ficha(tmp_path):
+    processos = [_processo(tmp_path, TIRAR.format("INTERATIVA", 50), "60/100000") for _ in range(2)]
+    esperas = []
+    for processo in processos:
+        saida, _ = processo.communicate(timeout=60)
+        esperas += json.loads(saida)
+    assert esperas.count(0) == 60
+
+class Erro429(Exception):
+    def __init__(self, retry_after):
+        super().__init__("429")
+        self.response = type("Resposta", (), {"status_code": 429, "headers": {"Retry-After": retry_after}})()
+
+def test_executar_repete_uma_vez_depois_do_retry_after(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(limitador, "ARQUIVO_ESTADO", str(tmp_path / "limitador.json"))
+    relogio = [1000.0]
+    dormiu = []
+    monkeypatch.setattr(limitador.time, "time", lambda: relogio[0])
+    def dormir(segundos):
+        dormiu.append(segundos)
+        relogio[0] += segundos
+    monkeypatch.setattr(limitador.time, "sleep", dormir)
+    chamadas = []
+    def pedido():
+        chamadas.append(relogio[0])
+        if len(chamadas) == 1:
+            raise Erro429("30")
+        return "ok"
+    erros = limitador.contadores["portal_nfce"]["erros_429"]
+
+    assert limitador.executar("portal_nfce", pedido) == "ok"
+    # O bloqueio vale para o balde inteiro, e em 30s o balde (6/60) já reabasteceu
+    assert chamadas == [1000.0, 1030.0]
+    assert sum(dormiu) == 30
+    assert limitador.contadores["portal_nfce"]["erros_429"] == erros + 1
+    estado = json.loads((tmp_path / "limitador.json").read_text(encoding="utf-8"))
+    assert estado["portal_nfce"]["bloqueado_ate"] == 1030.0
+
+def test_executar_nao_repete_outros_erros(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(limitador, "ARQUIVO_ESTADO", str(tmp_path / "limitador.json"))
+    chamadas = []
+    def pedido():
+        chamadas.append(1)
+        raise ValueError("falhou")
+    try:
+        limitador.executar("portal_nfce", pedido)
+    except ValueError:
+        pass
+    assert chamadas == [1]
@@ -0,0 +1,68 @@
+import json
+import pytest
+import manifesto
+from modelo import Item, Recibo
+
+CHAVE = "3" * 20 + "65" + "4" * 22
+
+def recibo_exemplo(chave=CHAVE):
+    itens = [Item.criar("789", "ARROZ TIPO 1 5KG", "1", "UN", "24,90", "24,90")]
+    return Recibo.criar("MERCADO X", "11.111.111/0001-11", "1234", "N/A", "2025-04-25", "10:31:02", itens, chave=chave)
+
+@pytest.fixture
+def imagem(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifesto, "ARQUIVO_MANIFESTO", str(tmp_path / "manifesto.json"))
+    monkeypatch.setattr(manifesto, "_manifesto", None)
+    caminho = tmp_path / "recibo.jpg"
+    caminho.write_bytes(b"")
+    return caminho
+
+def queda():
+    # O processo morre sem finalizar(): a próxima execução só vê o que ficou no arquivo
+    manifesto._manifesto = None
+
+def test_retoma_da_etapa_consultada(imagem, tmp_path):
+    assert manifesto.iniciar() == 0
+    manifesto.registrar_chaves(str(imagem), {CHAVE: False})
+    manifesto.registrar_etapa([recibo_exemplo()], manifesto.CONSULTADA)
+    queda()
+
+    assert manifesto.iniciar() == 1
+    assert manifesto.chaves_da_imagem(str(imagem)) == {CHAVE: False}
+    recibo = manifesto.recibo_consultado(CHAVE)
+    assert recibo.linhas_planilha() == recibo_exemplo().linhas_planilha()
+    assert not recibo.is_duplicate
+    assert json.loads((tmp_path / "manifesto.json").read_text(encoding="utf-8"))["execucao"] == 2
+
+def test_etapa_nao_volta_atras(imagem):
+    manifesto.iniciar()
+    manifesto.registrar_chaves(str(imagem), {CHAVE: False})
+    manifesto.registrar_etapa([recibo_exemplo()], manifesto.CONSULTADA)
+    manifesto.registrar_etapa([recibo_exemplo()], manifesto.GRAVADA_DADOS)
+    manifesto.registrar_etapa([recibo_exemplo()], manifesto.CONSULTADA)
+    queda()
+    manifesto.iniciar()
+    assert manifesto._manifesto["chaves"][CHAVE]["etapa"] == manifesto.GRAVADA_DADOS
+    # Gravada também na chaves44: não há mais consulta a retomar
+    manifesto.registrar_etapa([recibo_exemplo()], manifesto.GRAVADA_CHAVES44)
+    assert manifesto.recibo_consultado(CHAVE) is None
+
+def test_imagem_apagada_nao_e_retomada(imagem):
+    manifesto.iniciar()
+    manifesto.registrar_chaves(str(imagem), {CHAVE: False})
+    queda()
+    imagem.unlink()
+    assert manifesto.iniciar() == 0
+    assert manifesto._manifesto["chaves"] == {}
+
+def test_arquivo_apagado_sem_pendencias(imagem, tmp_path):
+    arquivo = tmp_path / "manifesto.json"
+    manifesto.iniciar()
+    manifesto.registrar_chaves(str(imagem), {CHAVE: False})
+    assert manifesto.finalizar().endswith("1 imagem(ns) pela metade ficam no manifesto para a próxima execução")
+    assert arquivo.exists()
+
+    manifesto.iniciar()
+    manifesto.concluir_imagem(str(imagem))
+    assert manifesto.finalizar() == "execução 2"
+    assert not arquivo.exists()
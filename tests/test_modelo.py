@@ -0,0 +1,51 @@
+import pytest
+from modelo import Item, Recibo, centavos, numero
+
+@pytest.mark.parametrize("texto, esperado", [
+    ("1.234,56", 123456),
+    ("R$ 1.234,56", 123456),
+    ("1,234.56", 123456),
+    ("4,99", 499),
+    ("9.98", 998),
+    ("0,850", 85),
+    (4.99, 499),
+    ("", 0),
+    ("N/A", 0),
+])
+def test_centavos(texto, esperado):
+    assert centavos(texto) == esperado
+
+@pytest.mark.parametrize("texto, esperado", [
+    ("1.234,56", 1234.56),
+    ("4,99", 4.99),
+    ("0,850", 0.85),
+    ("2", 2.0),
+    ("", 0.0),
+    ("N/A", 0.0),
+])
+def test_numero(texto, esperado):
+    assert numero(texto) == pytest.approx(esperado)
+
+def test_numero_sem_valor_usa_o_padrao():
+    assert numero("", 1.0) == 1.0
+    assert numero("N/A", 1.0) == 1.0
+
+def _recibo(is_sat, data):
+    itens = [
+        Item.criar("789", "ARROZ TIPO 1 5KG", "1", "UN", "24,90", "24,90"),
+        Item.criar("123", "BANANA PRATA KG", "0,850", "kg", "5,99", "5,09"),
+    ]
+    return Recibo.criar("MERCADO X", "11.111.111/0001-11", "1234", "N/A", data, "10:31:02", itens, is_sat=is_sat, chave="3" * 44)
+
+@pytest.mark.parametrize("is_sat, data", [(False, "2025-04-25"), (True, "25/04/2025")])
+def test_linhas_da_planilha_remontam_o_recibo(is_sat, data):
+    recibo = _recibo(is_sat, data)
+    # Como a planilha devolve: tudo texto
+    linhas = [[str(valor) for valor in linha] for linha in recibo.linhas_planilha()]
+    remontado = Recibo.de_linhas(linhas, chave=recibo.chave)
+    assert remontado.is_sat is is_sat
+    assert remontado.is_duplicate
+    assert remontado.itens == recibo.itens
+    assert (remontado.empresa, remontado.cnpj, remontado.numero, remontado.data, remontado.hora) == ("MERCADO X", "11.111.111/0001-11", "1234", data, "10:31:02")
+    assert remontado.total == recibo.total == 2999
+    assert remontado.linhas_planilha() == recibo.linhas_planilha()
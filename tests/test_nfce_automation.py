@@ -0,0 +1,152 @@
+import sys
+import types
+import pytest
+import limitador
+import manifesto
+from test_manifesto import CHAVE, queda, recibo_exemplo
+
+# nfce_automation abre o Chrome e o Google Sheets: sem as dependências instaladas, o módulo não importa
+for _modulo in ("selenium", "bs4", "gspread", "oauth2client", "pyzbar", "PIL"):
+    pytest.importorskip(_modulo)
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+class Aba:
+    def __init__(self, title):
+        self.title = title
+        self.escritas = []
+
+    def append_rows(self, linhas, value_input_option=None):
+        self.escritas.append(linhas)
+
+class Planilha:
+    def __init__(self):
+        self.abas = {}
+
+    def worksheet(self, nome):
+        return self.abas.setdefault(nome, Aba(nome))
+
+    def worksheets(self):
+        return list(self.abas.values())
+
+class Cliente:
+    def open(self, nome):
+        return Planilha()
+
+def _importar():
+    # Na importação o módulo autentica e abre a planilha: aqui ele recebe a planilha falsa
+    if "nfce_automation" not in sys.modules:
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            monkeypatch.setattr(ServiceAccountCredentials, "from_json_keyfile_name", lambda *a, **k: None)
+            monkeypatch.setattr(gspread, "authorize", lambda creds: Cliente())
+            import nfce_automation  # noqa: F401
+    return sys.modules["nfce_automation"]
+
+class Roteador:
+    def __init__(self):
+        self.gravadas = []
+
+    def abas_do_recibo(self, data=None, chave=None):
+        return []
+
+    def gravar(self, linhas):
+        self.gravadas.extend(linhas)
+
+@pytest.fixture
+def cenario(tmp_path, monkeypatch):
+    nfce = _importar()
+    cenario = types.SimpleNamespace(nfce=nfce, roteador=Roteador(), chaves44=Aba("chaves44"), consultadas=[], em_dados={}, falhas=set())
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(limitador, "executar", lambda recurso, funcao, *a, **k: funcao(*a, **k))
+    monkeypatch.setattr(manifesto, "ARQUIVO_MANIFESTO", str(tmp_path / "manifesto.json"))
+    monkeypatch.setattr(manifesto, "_manifesto", None)
+    monkeypatch.setattr(nfce, "chaves_sheet", cenario.chaves44)
+    monkeypatch.setattr(nfce, "contas_chat", types.SimpleNamespace(roteador=lambda conta: cenario.roteador))
+    monkeypatch.setattr(nfce, "salvar_backup", lambda linhas: None)
+    monkeypatch.setattr(nfce.estatisticas_precos, "registrar_recibos", lambda recibos: None)
+    monkeypatch.setattr(nfce, "buscar_chaves_processadas", lambda chaves, debug_level=0, conta=None: {})
+    monkeypatch.setattr(nfce, "ler_duplicatas", lambda abas, lidas=None: [])
+    # cenario.em_dados: recibos que já estão na aba DADOS, por chave
+    monkeypatch.setattr(nfce, "montar_dados_existentes", lambda leituras, numero, cnpj=None, is_sat=None, chave=None: cenario.em_dados.get(chave))
+
+    def consultar_chaves(chaves, navegador=None, debug_level=0, resolver_captcha=None, chat_id=None):
+        cenario.consultadas.append(dict(chaves))
+        return {chave: None if chave in cenario.falhas else recibo_exemplo(chave) for chave in chaves}
+
+    monkeypatch.setattr(nfce, "consultar_chaves", consultar_chaves)
+    return cenario
+
+def _lida_na_execucao_anterior(tmp_path, etapa):
+    imagem = tmp_path / "recibo.jpg"
+    imagem.write_bytes(b"")
+    manifesto.iniciar()
+    manifesto.registrar_chaves(str(imagem), {CHAVE: False})
+    for anterior in manifesto.ETAPAS[1:manifesto.ETAPAS.index(etapa) + 1]:
+        manifesto.registrar_etapa([recibo_exemplo()], anterior)
+    queda()
+    assert manifesto.iniciar() == 1
+    return imagem
+
+def _sem_qr_code(*args, **kwargs):
+    raise AssertionError("a imagem não deveria ser lida de novo")
+
+def test_retomada_da_consulta_nao_volta_ao_portal(cenario, tmp_path, monkeypatch):
+    imagem = _lida_na_execucao_anterior(tmp_path, manifesto.CONSULTADA)
+    monkeypatch.setattr(cenario.nfce, "preprocessar_imagem", _sem_qr_code)
+
+    [(chave, recibo)] = cenario.nfce.processar_recibos(str(imagem))
+    assert chave == CHAVE and recibo.numero == "1234"
+    assert cenario.consultadas == []
+    assert cenario.roteador.gravadas == recibo_exemplo().linhas_planilha()
+    assert cenario.chaves44.escritas == [[[CHAVE, "1234", ""]]]
+    assert (tmp_path / "OK_recibo.jpg").exists()
+    assert manifesto.finalizar().startswith("execução 2, retomada sem refazer 1 leitura(s) de QR code, 1 consulta(s)")
+    assert not (tmp_path / "manifesto.json").exists()
+
+def test_retomada_depois_da_aba_dados_so_grava_a_chaves44(cenario, tmp_path, monkeypatch):
+    imagem = _lida_na_execucao_anterior(tmp_path, manifesto.GRAVADA_DADOS)
+    monkeypatch.setattr(cenario.nfce, "preprocessar_imagem", _sem_qr_code)
+    cenario.em_dados[CHAVE] = recibo_exemplo()
+
+    cenario.nfce.processar_recibos(str(imagem))
+    assert cenario.consultadas == []
+    assert cenario.roteador.gravadas == []
+    assert cenario.chaves44.escritas == [[[CHAVE, "1234", ""]]]
+    assert manifesto.finalizar().endswith("1 gravação(ões) na aba DADOS")
+    assert not (tmp_path / "manifesto.json").exists()
+
+OUTRA = "3" * 20 + "59" + "5" * 22
+
+def _foto_com_dois_recibos(tmp_path, monkeypatch, cenario):
+    imagem = tmp_path / "foto.jpg"
+    imagem.write_bytes(b"")
+    codigos = [
+        f"https://www.nfce.fazenda.sp.gov.br/qrcode?p={CHAVE}|2|1|1|ABC",
+        "s" + OUTRA,
+        CHAVE,  # o mesmo recibo lido de novo
+        "https://exemplo.com/qrcode-sem-chave",
+        "texto qualquer",
+    ]
+    monkeypatch.setattr(cenario.nfce, "preprocessar_imagem", lambda caminho, debug_level=0, conteudo=None: (codigos, ""))
+    return imagem
+
+def test_varios_qr_codes_na_mesma_foto(cenario, tmp_path, monkeypatch):
+    imagem = _foto_com_dois_recibos(tmp_path, monkeypatch, cenario)
+
+    resultados = cenario.nfce.processar_recibos(str(imagem))
+    assert [chave for chave, _ in resultados] == [CHAVE, OUTRA]
+    assert all(recibo is not None for _, recibo in resultados)
+    # Uma consulta só, com cada chave uma vez
+    assert cenario.consultadas == [{CHAVE: False, OUTRA: True}]
+    assert [linha[0] for linha in cenario.chaves44.escritas[0]] == [CHAVE, OUTRA]
+    assert (tmp_path / "OK_foto.jpg").exists()
+
+def test_foto_com_chave_que_falhou_nao_e_renomeada(cenario, tmp_path, monkeypatch):
+    imagem = _foto_com_dois_recibos(tmp_path, monkeypatch, cenario)
+    cenario.falhas.add(OUTRA)
+
+    resultados = cenario.nfce.processar_recibos(str(imagem))
+    assert [(chave, recibo is not None) for chave, recibo in resultados] == [(CHAVE, True), (OUTRA, False)]
+    assert [linha[0] for linha in cenario.chaves44.escritas[0]] == [CHAVE]
+    assert imagem.exists() and not (tmp_path / "OK_foto.jpg").exists()
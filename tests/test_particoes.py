@@ -0,0 +1,99 @@
+import datetime
+import re
+import pytest
+import limitador
+import particoes
+import planilha as leitura
+from modelo import data_da_compra
+
+class Aba:
+    def __init__(self, title, linhas=None):
+        self.title = title
+        self.linhas = linhas if linhas is not None else []  # com o cabeçalho
+
+    def row_values(self, numero):
+        return list(self.linhas[numero - 1]) if len(self.linhas) >= numero else []
+
+    def get_all_values(self):
+        return [list(linha) for linha in self.linhas]
+
+    def append_rows(self, linhas, value_input_option=None):
+        self.linhas.extend(list(linha) for linha in linhas)
+
+    def batch_get(self, intervalos):
+        # Só os intervalos "A<linha>:<coluna>" de planilha.ler_a_partir
+        return [[list(linha) for linha in self.linhas[int(re.match(r"A(\d+):", intervalo).group(1)) - 1:]] for intervalo in intervalos]
+
+class Planilha:
+    def __init__(self, nomes):
+        self.abas = [Aba(nome) for nome in nomes]
+
+    def worksheets(self):
+        return self.abas
+
+    def worksheet(self, nome):
+        return next(aba for aba in self.abas if aba.title == nome)
+
+    def add_worksheet(self, title, rows, cols):
+        self.abas.append(Aba(title))
+        return self.abas[-1]
+
+def test_data_da_compra_nos_dois_formatos():
+    assert data_da_compra("2025-04-25") == datetime.date(2025, 4, 25)
+    assert data_da_compra("25/04/2025") == datetime.date(2025, 4, 25)
+    assert data_da_compra("5/4/2025 - 10:31:02") == datetime.date(2025, 4, 5)
+    assert data_da_compra("2025-13-01") is None
+    assert data_da_compra("31/02/2025") is None
+    assert data_da_compra("N/A") is None
+    assert data_da_compra(None) is None
+
+def test_mes_da_data_nfce_e_sat():
+    assert particoes.mes_da_data("2025-04-25") == "2025_04"
+    assert particoes.mes_da_data("25/04/2025") == "2025_04"
+    assert particoes.mes_da_data("") is None
+
+def test_linhas_nfce_e_sat_vao_para_o_mes(tmp_path, monkeypatch):
+    monkeypatch.setattr(limitador, "executar", lambda recurso, funcao, *a, **k: funcao(*a, **k))
+    planilha = Planilha(["DADOS", "DADOS_2025_04", "DADOS_SEM_DATA"])
+    roteador = particoes.Roteador(planilha, planilha.worksheet("DADOS"), arquivo=str(tmp_path / "particoes.json"))
+
+    def linha(data):
+        return [""] * particoes.COLUNA_DATA + [data]
+
+    grupos = roteador.agrupar([linha("2025-04-25"), linha("25/04/2025"), linha("N/A")])
+    assert [(aba.title, len(linhas)) for aba, linhas in grupos] == [("DADOS_2025_04", 2), ("DADOS_SEM_DATA", 1)]
+    # Sem migração registrada, a aba DADOS continua na verificação de duplicatas
+    assert [aba.title for aba in roteador.abas_do_recibo(data="2025-04-25")] == ["DADOS_2025_04", "DADOS_SEM_DATA", "DADOS"]
+    assert [aba.title for aba in roteador.abas_recentes()] == ["DADOS_2025_04", "DADOS_SEM_DATA"]
+
+def test_aba_dados_fica_na_busca_ate_o_mes_ser_migrado(tmp_path, monkeypatch):
+    monkeypatch.setattr(limitador, "executar", lambda recurso, funcao, *a, **k: funcao(*a, **k))
+    monkeypatch.setattr(leitura, "_cache", {})
+    cabecalho = ["Empresa"] + [""] * (particoes.COLUNA_DATA - 1) + ["Data"]
+    planilha = Planilha([])
+    dados = Aba("DADOS", [cabecalho] + [["X"] + [""] * (particoes.COLUNA_DATA - 1) + [data] for data in ("2025-04-25", "02/05/2025")])
+    planilha.abas.append(dados)
+    arquivo = str(tmp_path / "particoes.json")
+    # O bot já está rodando quando a migração começa, em outro processo
+    bot = particoes.Roteador(planilha, dados, arquivo=arquivo)
+    assert bot.abas_do_recibo(data="2025-05-02") == [dados]
+
+    acrescentar = particoes._acrescentar
+    def interromper_em_maio(aba, linhas, tamanho_lote):
+        if aba.title == "DADOS_2025_05":
+            raise RuntimeError("cota do Sheets")
+        acrescentar(aba, linhas, tamanho_lote)
+    monkeypatch.setattr(particoes, "_acrescentar", interromper_em_maio)
+    with pytest.raises(RuntimeError):
+        particoes.migrar(particoes.Roteador(planilha, dados, arquivo=arquivo), dados)
+
+    assert [aba.title for aba in bot.abas_do_recibo(data="2025-04-25")] == ["DADOS_2025_04"]
+    assert [aba.title for aba in bot.abas_do_recibo(data="2025-05-02")] == ["DADOS_2025_05", "DADOS"]
+    assert [aba.title for aba in bot.abas_do_recibo()] == ["DADOS_2025_04", "DADOS_2025_05", "DADOS"]
+
+    monkeypatch.setattr(particoes, "_acrescentar", acrescentar)
+    assert particoes.migrar(particoes.Roteador(planilha, dados, arquivo=arquivo), dados) == 1
+    assert [aba.title for aba in bot.abas_do_recibo(data="2025-05-02")] == ["DADOS_2025_05"]
+    # Mês que nunca existiu na aba DADOS: depois da migração completa, ela sai da busca
+    assert [aba.title for aba in bot.abas_do_recibo(data="2025-06-10")] == []
+    assert [aba.title for aba in bot.abas_do_recibo()] == ["DADOS_2025_04", "DADOS_2025_05"]
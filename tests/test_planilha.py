@@ -0,0 +1,83 @@
+import re
+import limitador
+import planilha
+
+def _coluna(letras):
+    indice = 0
+    for letra in letras:
+        indice = indice * 26 + ord(letra) - ord("A") + 1
+    return indice - 1
+
+class Aba:
+    """Aba falsa: batch_get devolve os intervalos como a API, sem as células vazias do final."""
+
+    def __init__(self, title, linhas):
+        self.title = title
+        self.linhas = linhas  # sem o cabeçalho
+        self.intervalos = []
+
+    def batch_get(self, intervalos):
+        self.intervalos.append(list(intervalos))
+        resultado = []
+        for intervalo in intervalos:
+            inicio, linha, fim, ultima = re.fullmatch(r"([A-Z]+)(\d+):([A-Z]+)(\d*)", intervalo).groups()
+            ate = int(ultima) - 1 if ultima else len(self.linhas)
+            valores = [linha[_coluna(inicio):_coluna(fim) + 1] for linha in self.linhas[int(linha) - 2:ate]]
+            while valores and not any(valores[-1]):
+                valores.pop()
+            resultado.append(valores)
+        return resultado
+
+def _preparar(monkeypatch, linhas):
+    monkeypatch.setattr(limitador, "executar", lambda recurso, funcao, *a, **k: funcao(*a, **k))
+    monkeypatch.setattr(planilha, "_cache", {})
+    relogio = [1000.0]
+    monkeypatch.setattr(planilha.time, "time", lambda: relogio[0])
+    return relogio, Aba("DADOS", linhas)
+
+def _linha(n):
+    return [f"c{n}", f"n{n}", "x", "x", f"cod{n}"]
+
+def test_ler_colunas_so_busca_as_linhas_novas(monkeypatch):
+    relogio, aba = _preparar(monkeypatch, [_linha(1), _linha(2)])
+    assert planilha.ler_colunas(aba, (4, 0, 1)) == [["c1", "n1", "", "", "cod1"], ["c2", "n2", "", "", "cod2"]]
+    assert aba.intervalos == [["A2:B", "E2:E"]]
+
+    # Dentro de PLANILHA_CACHE_FRESCO a leitura sai da memória
+    aba.linhas.append(_linha(3))
+    relogio[0] += 1
+    assert len(planilha.ler_colunas(aba, (0, 1, 4))) == 2
+    assert len(aba.intervalos) == 1
+
+    relogio[0] += planilha.FRESCO_SEGUNDOS
+    linhas = planilha.ler_colunas(aba, (0, 1, 4))
+    assert aba.intervalos[-1] == ["A4:B", "E4:E"]
+    assert [linha[0] for linha in linhas] == ["c1", "c2", "c3"]
+
+def test_escrita_do_processo_aparece_na_hora(monkeypatch):
+    relogio, aba = _preparar(monkeypatch, [_linha(1)])
+    planilha.ler_colunas(aba, (0,))
+    aba.linhas.append(_linha(2))
+    planilha.anotar_escrita(aba)
+    assert planilha.ler_colunas(aba, (0,)) == [["c1"], ["c2"]]
+    assert aba.intervalos == [["A2:A"], ["A3:A"]]
+
+def test_releitura_completa_pega_edicoes(monkeypatch):
+    relogio, aba = _preparar(monkeypatch, [_linha(1), _linha(2)])
+    planilha.ler_colunas(aba, (0,))
+    aba.linhas[0] = ["editada"]
+    del aba.linhas[1]
+    relogio[0] += planilha.FRESCO_SEGUNDOS + 1
+    # Incremental: a edição ainda não aparece
+    assert planilha.ler_colunas(aba, (0,)) == [["c1"], ["c2"]]
+    relogio[0] += planilha.CACHE_SEGUNDOS + 1
+    assert planilha.ler_colunas(aba, (0,)) == [["editada"]]
+    assert aba.intervalos == [["A2:A"], ["A4:A"], ["A2:A"]]
+
+def test_ler_a_partir_completa_a_largura(monkeypatch):
+    relogio, aba = _preparar(monkeypatch, [_linha(1), _linha(2), _linha(3)])
+    assert planilha.ler_a_partir(aba, 1, largura=6) == [_linha(2) + [""], _linha(3) + [""]]
+    assert aba.intervalos == [["A3:F"]]
+    # Sem cache: cada chamada é uma requisição
+    planilha.ler_a_partir(aba, 1, largura=6)
+    assert len(aba.intervalos) == 2
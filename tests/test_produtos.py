@@ -0,0 +1,21 @@
+from produtos import IndiceProdutos
+
+def test_dois_processos_nao_repetem_ids(tmp_path):
+    caminho = str(tmp_path / "produtos.json")
+    # Dois índices sobre o mesmo arquivo fazem o papel de dois processos
+    bot, lote = IndiceProdutos.carregar(caminho), IndiceProdutos.carregar(caminho)
+    arroz = bot.identificar("ARROZ TIPO 1 5KG")
+    feijao = lote.identificar("FEIJAO CARIOCA 1KG")
+    assert (arroz, feijao) == (0, 1)
+    # O produto criado pelo outro processo é encontrado, não criado de novo
+    assert bot.identificar("FEIJAO CARIOCA 1KG") == feijao
+    assert lote.identificar("ARROZ TIPO 1 5KG", "11.111.111/0001-11", "123") == arroz
+    assert IndiceProdutos.carregar(caminho).nomes == ["ARROZ TIPO 1 5KG", "FEIJAO CARIOCA 1KG"]
+    assert IndiceProdutos.carregar(caminho).por_codigo == {"11111111000111|123": arroz}
+
+def test_linhas_indexadas_sobrevivem(tmp_path):
+    caminho = str(tmp_path / "produtos.json")
+    indice = IndiceProdutos.carregar(caminho)
+    linha = ["LOJA", "11.111.111/0001-11", "", "", "123", "", "", "LEITE INTEGRAL 1L"]
+    assert indice.indexar_linhas([linha, linha], "DADOS_2025_04") == [0, 0]
+    assert IndiceProdutos.carregar(caminho).ids_linhas == {"DADOS_2025_04": [0, 0]}
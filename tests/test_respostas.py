@@ -0,0 +1,20 @@
+import produtos
+import respostas
+from modelo import Item, Recibo
+from produtos import IndiceProdutos
+
+def test_insights_nao_criam_produtos(tmp_path, monkeypatch):
+    indice = IndiceProdutos.carregar(str(tmp_path / "produtos.json"))
+    monkeypatch.setattr(produtos, "_indice", indice)
+    # Histórico (colunas de COLUNAS_INSIGHTS): o arroz já foi comprado em outra loja
+    linha = ["LOJA Y", "22.222.222/0001-22", "", "", "123", "", "", "ARROZ TIPO 1 5KG", "", "", "", "20.00", "2025-04-01"]
+    ids_linhas = indice.indexar_linhas([linha], "DADOS_2025_04")
+    itens = [
+        Item.criar("789", "ARROZ TIPO 1 5KG", "1", "UN", "24,90", "24,90"),
+        Item.criar("456", "DETERGENTE NEUTRO 500ML", "1", "UN", "2,49", "2,49"),
+    ]
+    recibo = Recibo.criar("LOJA X", "11.111.111/0001-11", "1234", "N/A", "2025-04-25", "10:31:02", itens)
+
+    insights = respostas.calcular_insights(recibo, ([linha], ids_linhas))
+    assert insights["outros_precos"] == [{"descricao": "ARROZ TIPO 1 5KG", "pago": 2490, "media_outros": 2000}]
+    assert indice.nomes == ["ARROZ TIPO 1 5KG"]
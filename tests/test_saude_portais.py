@@ -0,0 +1,79 @@
+import json
+import saude_portais
+
+def test_retentativas_de_outro_processo_nao_se_perdem(tmp_path, monkeypatch):
+    arquivo = tmp_path / "retentativas.json"
+    monkeypatch.setattr(saude_portais, "ARQUIVO_RETENTATIVAS", str(arquivo))
+    monkeypatch.setattr(saude_portais, "_retentativas", {"versao": None, "fila": {}})
+    saude_portais.agendar_retentativa("1" * 44, motivo="portal NFCE indisponível")
+    # Outro processo agenda uma chave depois da nossa leitura
+    fila = json.loads(arquivo.read_text(encoding="utf-8"))
+    fila["2" * 44] = {"is_sat": True, "tentativas": 1, "motivo": "", "proxima_em": 0}
+    arquivo.write_text(json.dumps(fila), encoding="utf-8")
+
+    saude_portais.concluir_retentativa("1" * 44)
+    assert list(json.loads(arquivo.read_text(encoding="utf-8"))) == ["2" * 44]
+    assert saude_portais.na_fila("2" * 44)
+    assert saude_portais.retentativas_pendentes() == {None: ["s" + "2" * 44]}
+
+def test_retentativa_volta_para_cada_chat(tmp_path, monkeypatch):
+    monkeypatch.setattr(saude_portais, "ARQUIVO_RETENTATIVAS", str(tmp_path / "retentativas.json"))
+    monkeypatch.setattr(saude_portais, "_retentativas", {"versao": None, "fila": {}})
+    monkeypatch.setattr(saude_portais.time, "time", lambda: 1000.0)
+    chave = "3" * 44
+    saude_portais.agendar_retentativa(chave, chat_id=111)
+    saude_portais.agendar_retentativa(chave, chat_id=222)
+    monkeypatch.setattr(saude_portais.time, "time", lambda: 10000.0)
+    assert saude_portais.retentativas_pendentes() == {111: [chave], 222: [chave]}
+    saude_portais.concluir_retentativa(chave, 111)
+    assert saude_portais.retentativas_pendentes() == {222: [chave]}
+    saude_portais.concluir_retentativa(chave, 222)
+    assert not saude_portais.na_fila(chave)
+
+def _disjuntor(monkeypatch):
+    relogio = [1000.0]
+    monkeypatch.setattr(saude_portais.time, "time", lambda: relogio[0])
+    saude = {"amostras": saude_portais.collections.deque(maxlen=saude_portais.JANELA), "estado": saude_portais.FECHADO,
+             "falhas_seguidas": 0, "aberto_ate": 0, "espera": 60, "teste_em_andamento": False}
+    monkeypatch.setitem(saude_portais._portais, "nfce", saude)
+    monkeypatch.setattr(saude_portais, "FALHAS_SEGUIDAS", 3)
+    monkeypatch.setattr(saude_portais, "ESPERA_ABERTO", 60)
+    return relogio, saude
+
+def test_disjuntor_abre_testa_e_fecha(monkeypatch):
+    relogio, saude = _disjuntor(monkeypatch)
+    for _ in range(3):
+        assert saude_portais.liberado("nfce")
+        saude_portais.registrar("nfce", False, 30)
+    assert saude["estado"] == saude_portais.ABERTO and saude["aberto_ate"] == 1060
+    assert not saude_portais.liberado("nfce")
+    # Falha de uma consulta que já estava em andamento não reinicia a espera
+    relogio[0] = 1050
+    saude_portais.registrar("nfce", False, 30)
+    assert saude["aberto_ate"] == 1060
+    relogio[0] = 1060
+    assert saude_portais.liberado("nfce")
+    assert saude["estado"] == saude_portais.MEIO_ABERTO
+    # Só uma consulta de teste por vez
+    assert not saude_portais.liberado("nfce")
+    saude_portais.registrar("nfce", True, 2)
+    assert saude["estado"] == saude_portais.FECHADO
+    assert list(saude["amostras"]) == [(True, 2)]
+    assert saude_portais.liberado("nfce")
+
+def test_teste_que_falha_reabre_com_o_dobro_da_espera(monkeypatch):
+    relogio, saude = _disjuntor(monkeypatch)
+    for _ in range(3):
+        saude_portais.registrar("nfce", False, 30)
+    relogio[0] = 1060
+    assert saude_portais.liberado("nfce")
+    saude_portais.registrar("nfce", False, 30)
+    assert saude["estado"] == saude_portais.ABERTO
+    assert saude["espera"] == 120 and saude["aberto_ate"] == 1180
+    # Sucesso atrasado com o circuito aberto também é ignorado
+    saude_portais.registrar("nfce", True, 1)
+    assert saude["estado"] == saude_portais.ABERTO
+    relogio[0] = 1180
+    assert saude_portais.liberado("nfce")
+    saude_portais.registrar("nfce", True, 1)
+    assert saude["estado"] == saude_portais.FECHADO and saude["espera"] == 60
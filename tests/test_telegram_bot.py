@@ -0,0 +1,81 @@
+import asyncio
+import os
+import threading
+import types
+import pytest
+
+# O bot precisa do python-telegram-bot e do python-dotenv, e de um token para importar
+pytest.importorskip("telegram")
+pytest.importorskip("dotenv")
+os.environ.setdefault("TELEGRAM_TOKEN", "teste")
+import fila_jobs
+import telegram_bot
+
+CHAVE = "3525" * 11
+
+def _mensagem(texto, bot_data, chat_id=42):
+    respostas = []
+
+    async def reply_text(resposta):
+        respostas.append(resposta)
+
+    update = types.SimpleNamespace(
+        message=types.SimpleNamespace(text=texto, reply_text=reply_text),
+        effective_chat=types.SimpleNamespace(id=chat_id),
+    )
+    asyncio.run(telegram_bot.handle_text(update, types.SimpleNamespace(bot_data=bot_data)))
+    return respostas
+
+@pytest.fixture
+def consultas(monkeypatch):
+    pedidas = []
+
+    async def executar_consulta(update, context, **kwargs):
+        pedidas.append(kwargs["chave_manual"])
+        return "✅ Compra processada!"
+
+    monkeypatch.setattr(telegram_bot, "executar_consulta", executar_consulta)
+    return pedidas
+
+def test_captcha_pendente_recebe_so_respostas_curtas(consultas):
+    pendente = {"evento": threading.Event(), "resposta": None}
+    bot_data = {"captchas_pendentes": {42: [pendente]}}
+
+    # Chave (com espaços, ou com o "S" do SAT) enviada enquanto o CAPTCHA espera: vai para a consulta
+    _mensagem(" ".join([CHAVE[i:i + 4] for i in range(0, 44, 4)]), bot_data)
+    _mensagem("S" + CHAVE, bot_data)
+    assert consultas == [CHAVE, "S" + CHAVE]
+    assert not pendente["evento"].is_set()
+
+    # Frase com espaços também não é resposta
+    _mensagem("qual o status?", bot_data)
+    assert not pendente["evento"].is_set()
+
+    assert _mensagem("x7Kp2", bot_data) == ["Resposta do CAPTCHA recebida, consultando... ⏳"]
+    assert pendente["evento"].is_set() and pendente["resposta"] == "x7Kp2"
+
+@pytest.fixture
+def fila(tmp_path, monkeypatch):
+    monkeypatch.setattr(fila_jobs, "URL_BROKER", "")
+    original = fila_jobs.ARQUIVO_FILA
+    fila_jobs.usar_arquivo(str(tmp_path / "fila.db"))
+    yield {"fila": True}
+    fila_jobs.usar_arquivo(original)
+
+def test_modo_fila_entrega_a_resposta_ao_captcha_do_worker(fila):
+    fila_jobs.criar_pedido(42, "chave", [("1" * 44, False)])
+    job = fila_jobs.proximo_job("worker-a")
+    # O worker enviou a imagem do CAPTCHA direto ao chat e registrou a espera na tabela captchas
+    captcha_id = fila_jobs.registrar_captcha(job["id"], 42)
+
+    # Uma chave enviada no meio vira pedido novo, sem responder o CAPTCHA
+    assert _mensagem(CHAVE, fila) == ["Processando sua chave... 🔍"]
+    assert fila_jobs.resposta_captcha(captcha_id) is None
+    assert fila_jobs.proximo_job("worker-b")["chave"] == CHAVE
+
+    # Resposta de outro chat não serve
+    _mensagem("x7Kp2", fila, chat_id=7)
+    assert fila_jobs.resposta_captcha(captcha_id) is None
+
+    assert _mensagem("x7Kp2", fila) == ["Resposta do CAPTCHA recebida, consultando... ⏳"]
+    assert fila_jobs.aguardar_captcha(captcha_id, timeout=0) == "x7Kp2"
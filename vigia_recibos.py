@@ -0,0 +1,284 @@
+import argparse
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import limitador
+import nfce_automation
+from extratores import log
+
+# watchdog (inotify no Linux) é opcional: sem ele a pasta é varrida a cada VIGIA_INTERVALO segundos
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# Ingestão contínua da pasta recibos/: cada imagem nova passa por leitura do QR code, verificação
+# de duplicatas, consulta e gravação assim que termina de ser copiada.
+# Uso: python vigia_recibos.py [--pasta recibos] [--polling] [--debug 1]
+#   - uma imagem só é processada depois de VIGIA_DEBOUNCE segundos (padrão 2) sem mudar de tamanho;
+#   - imagens concluídas viram OK_<nome>, como no nfce_automation.py;
+#   - o estado (VIGIA_ESTADO, padrão recibos/.vigia.json) guarda só as imagens não concluídas: sem QR
+#     code, que não são lidas de novo enquanto o arquivo não mudar, e as que falharam, com as chaves
+#     já lidas e a hora da próxima tentativa. Reiniciar o vigia não relê nenhuma delas.
+PASTA_RECIBOS = os.getenv("VIGIA_PASTA", "recibos")
+DEBOUNCE = float(os.getenv("VIGIA_DEBOUNCE", "2"))
+INTERVALO_POLLING = float(os.getenv("VIGIA_INTERVALO", "5"))
+VARREDURA_COM_EVENTOS = 60  # com watchdog, varredura de segurança para eventos perdidos
+MAXIMO_TENTATIVAS = int(os.getenv("VIGIA_TENTATIVAS", "8"))
+RESUMO_A_CADA = 600  # segundos entre resumos de latência no log
+EXTENSOES = (".png", ".jpg", ".jpeg")
+
+SEM_QR = "sem_qr"
+FALHOU = "falhou"
+DESISTIU = "desistiu"
+
+class _Eventos(FileSystemEventHandler):
+    def __init__(self, vigia):
+        self.vigia = vigia
+
+    def on_created(self, evento):
+        self.vigia.avisar(evento.src_path)
+
+    def on_modified(self, evento):
+        self.vigia.avisar(evento.src_path)
+
+    def on_moved(self, evento):
+        self.vigia.avisar(evento.dest_path)
+
+class VigiaRecibos:
+    def __init__(self, pasta=PASTA_RECIBOS, arquivo_estado=None, debug_level=0):
+        self.pasta = pasta
+        self.arquivo_estado = arquivo_estado or os.getenv("VIGIA_ESTADO", os.path.join(pasta, ".vigia.json"))
+        self.debug_level = debug_level
+        self.estado = self._carregar_estado()
+        # nome -> {"visto_em", "assinatura", "estavel_desde"}: imagens esperando terminar de ser copiadas
+        self.candidatos = {}
+        self.em_processamento = set()
+        self.latencias = collections.deque(maxlen=200)
+        self.gravados = 0
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=nfce_automation.TAMANHO_POOL_NAVEGADORES)
+
+    def _carregar_estado(self):
+        try:
+            with open(self.arquivo_estado, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _gravar_estado(self):
+        # Chamado com self._lock: grava numa cópia temporária e troca, nunca deixa o estado pela metade
+        temporario = f"{self.arquivo_estado}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(self.estado, f, ensure_ascii=False, indent=1)
+        os.replace(temporario, self.arquivo_estado)
+
+    @staticmethod
+    def _relevante(nome):
+        return nome.lower().endswith(EXTENSOES) and not nome.startswith(("OK", "."))
+
+    @staticmethod
+    def _assinatura(caminho):
+        info = os.stat(caminho)
+        return [info.st_size, info.st_mtime_ns]
+
+    def avisar(self, caminho):
+        """Registra uma imagem nova ou alterada; ela é processada quando parar de mudar."""
+        nome = os.path.basename(caminho)
+        if os.path.dirname(os.path.abspath(caminho)) != os.path.abspath(self.pasta) or not self._relevante(nome):
+            return
+        with self._lock:
+            if nome not in self.em_processamento:
+                self.candidatos.setdefault(nome, {"visto_em": time.time(), "assinatura": None, "estavel_desde": None})
+
+    def varrer(self):
+        """Confere a pasta: imagens fora do estado viram candidatas e as falhas vencidas são tentadas de novo."""
+        agora = time.time()
+        presentes = set()
+        with os.scandir(self.pasta) as entradas:
+            for entrada in entradas:
+                if not entrada.is_file() or not self._relevante(entrada.name):
+                    continue
+                presentes.add(entrada.name)
+                conhecido = self.estado.get(entrada.name)
+                if conhecido is None or conhecido["assinatura"] != [entrada.stat().st_size, entrada.stat().st_mtime_ns]:
+                    self.avisar(entrada.path)
+                elif conhecido["situacao"] == FALHOU and conhecido["proxima_em"] <= agora:
+                    self._enviar(entrada.name, agora, conhecido["chaves"], medir=False)
+        with self._lock:
+            # Imagens apagadas ou renomeadas fora do vigia saem do estado
+            removidas = [nome for nome in self.estado if nome not in presentes]
+            for nome in removidas:
+                del self.estado[nome]
+            if removidas:
+                self._gravar_estado()
+
+    def verificar_prontos(self):
+        agora = time.time()
+        prontos = []
+        with self._lock:
+            for nome, candidato in list(self.candidatos.items()):
+                try:
+                    assinatura = self._assinatura(os.path.join(self.pasta, nome))
+                except OSError:
+                    del self.candidatos[nome]
+                    continue
+                if assinatura != candidato["assinatura"]:
+                    candidato["assinatura"] = assinatura
+                    candidato["estavel_desde"] = agora
+                elif assinatura[0] > 0 and agora - candidato["estavel_desde"] >= DEBOUNCE:
+                    del self.candidatos[nome]
+                    prontos.append((nome, candidato["visto_em"]))
+        for nome, visto_em in prontos:
+            self._enviar(nome, visto_em)
+
+    def _enviar(self, nome, visto_em, chaves=None, medir=True):
+        with self._lock:
+            if nome in self.em_processamento:
+                return
+            self.em_processamento.add(nome)
+        self.executor.submit(self.processar, nome, visto_em, chaves, medir)
+
+    def processar(self, nome, visto_em, chaves=None, medir=True):
+        caminho = os.path.join(self.pasta, nome)
+        try:
+            assinatura = self._assinatura(caminho)
+            inicio = time.time()
+            if chaves is None:
+                codigos, mensagem = nfce_automation.preprocessar_imagem(caminho, self.debug_level)
+                chaves = [codigo for codigo in codigos or [] if nfce_automation.extrair_chave(codigo)[0]]
+                if not chaves:
+                    log(f"{nome}: {mensagem if not codigos else 'QR code sem chave de acesso'}; ignorada até o arquivo mudar.", self.debug_level)
+                    self._atualizar(nome, {"assinatura": assinatura, "situacao": SEM_QR})
+                    return
+            lido = time.time()
+
+            # from_bot=True só faz a chamada devolver os recibos que já estavam na planilha em vez de None,
+            # para separar "já gravado" de "consulta falhou"; a prioridade de lote vem de executar()
+            resultados = nfce_automation.processar_recibos(codigos=chaves, from_bot=True, debug_level=self.debug_level)
+            fim = time.time()
+            if not resultados or not all(recibo for _, recibo in resultados):
+                self._falhou(nome, assinatura, chaves)
+                return
+
+            nfce_automation.renomear_imagem_processada(caminho, self.debug_level)
+            self._atualizar(nome, None)
+            novos = [recibo for _, recibo in resultados if not recibo.is_duplicate]
+            if novos and medir:
+                latencia = fim - visto_em
+                with self._lock:
+                    self.latencias.append(latencia)
+                    self.gravados += len(novos)
+                logging.info(
+                    f"{nome}: {len(novos)} recibo(s) na planilha {latencia:.1f}s depois de chegar "
+                    f"(espera {inicio - visto_em:.1f}s, QR code {lido - inicio:.1f}s, consulta e gravação {fim - lido:.1f}s)"
+                )
+            else:
+                log(f"{nome}: recibo(s) já estavam na planilha.", self.debug_level)
+        except Exception as e:
+            logging.error(f"Erro ao processar {nome}: {e}")
+        finally:
+            with self._lock:
+                self.em_processamento.discard(nome)
+
+    def _atualizar(self, nome, entrada):
+        with self._lock:
+            if entrada is None:
+                self.estado.pop(nome, None)
+            else:
+                self.estado[nome] = entrada
+            self._gravar_estado()
+
+    def _falhou(self, nome, assinatura, chaves):
+        with self._lock:
+            anterior = self.estado.get(nome, {})
+            # Um arquivo substituído (ou tocado) começa uma nova série de tentativas
+            tentativas = anterior.get("tentativas", 0) + 1 if anterior.get("assinatura") == assinatura else 1
+        # As chaves já lidas ficam no estado: a próxima tentativa não lê o QR code de novo
+        situacao = DESISTIU if tentativas >= MAXIMO_TENTATIVAS else FALHOU
+        espera = min(3600, 60 * 2 ** (tentativas - 1))
+        self._atualizar(nome, {
+            "assinatura": assinatura,
+            "situacao": situacao,
+            "chaves": chaves,
+            "tentativas": tentativas,
+            "proxima_em": time.time() + espera,
+        })
+        if situacao == DESISTIU:
+            logging.error(f"{nome}: {tentativas} tentativas sem sucesso; fica na pasta sem novas tentativas automáticas (altere ou toque o arquivo para tentar de novo).")
+        else:
+            logging.info(f"{nome}: consulta incompleta, nova tentativa em {espera}s (tentativa {tentativas}).")
+
+    def resumo_latencias(self):
+        with self._lock:
+            latencias = sorted(self.latencias)
+            gravados = self.gravados
+            desistidas = sorted(nome for nome, entrada in self.estado.items() if entrada["situacao"] == DESISTIU)
+        if not latencias:
+            resumo = "nenhuma imagem nova gravada ainda"
+        else:
+            p50 = latencias[len(latencias) // 2]
+            p95 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))]
+            resumo = (
+                f"{gravados} recibo(s) gravados; latência da chegada à planilha nas últimas {len(latencias)} imagens: "
+                f"mediana {p50:.1f}s, p95 {p95:.1f}s, máxima {latencias[-1]:.1f}s"
+            )
+        if desistidas:
+            # Sem novas tentativas automáticas: só voltam à fila se o arquivo mudar
+            nomes = ", ".join(desistidas[:10]) + (f" e mais {len(desistidas) - 10}" if len(desistidas) > 10 else "")
+            resumo += f"; {len(desistidas)} imagem(ns) desistidas depois de {MAXIMO_TENTATIVAS} tentativas, esperando o arquivo mudar: {nomes}"
+        return resumo
+
+    def executar(self, polling=False):
+        # A pasta é trabalho em lote: consultas do bot passam na frente
+        limitador.definir_prioridade_padrao(limitador.PRIORIDADE_LOTE)
+        observador = None
+        if Observer is not None and not polling:
+            observador = Observer()
+            observador.schedule(_Eventos(self), self.pasta, recursive=False)
+            observador.start()
+            logging.info(f"Vigiando {self.pasta} por eventos do sistema de arquivos (watchdog)")
+        else:
+            logging.info(f"Vigiando {self.pasta} por varredura a cada {INTERVALO_POLLING:g}s")
+        if any(entrada["situacao"] == DESISTIU for entrada in self.estado.values()):
+            logging.warning(f"Vigia: {self.resumo_latencias()}")
+        intervalo_varredura = VARREDURA_COM_EVENTOS if observador else INTERVALO_POLLING
+        ultima_varredura = 0
+        ultimo_resumo = time.time()
+        try:
+            while True:
+                agora = time.time()
+                if agora - ultima_varredura >= intervalo_varredura:
+                    self.varrer()
+                    ultima_varredura = agora
+                self.verificar_prontos()
+                if agora - ultimo_resumo >= RESUMO_A_CADA:
+                    logging.info(f"Vigia: {self.resumo_latencias()}")
+                    ultimo_resumo = agora
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            logging.info("Encerrando o vigia depois das imagens em andamento...")
+        finally:
+            if observador is not None:
+                observador.stop()
+                observador.join()
+            self.executor.shutdown(wait=True)
+            nfce_automation.fechar_navegadores()
+            logging.info(f"Vigia: {self.resumo_latencias()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Processa continuamente as imagens que chegam na pasta recibos/")
+    parser.add_argument("--pasta", default=PASTA_RECIBOS, help="Pasta vigiada (padrão recibos)")
+    parser.add_argument("--polling", action="store_true", help="Usa varredura periódica mesmo com o watchdog instalado")
+    parser.add_argument("--debug", type=int, default=0, choices=[0, 1], help="Nível de debug: 0 (mínimo), 1 (completo)")
+    args = parser.parse_args()
+    VigiaRecibos(args.pasta, debug_level=args.debug).executar(polling=args.polling)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import time
+import traceback
+import telegram
+from dotenv import load_dotenv
+import contas
+import fila_jobs
+from modelo import Recibo
+from respostas import montar_resposta_recibos, dividir_resposta, FALHA_CHAVE, FALHA_IMAGEM
+
+# Worker de consultas: tira os jobs enfileirados pelo bot (telegram_bot.py --fila), consulta os
+# portais com o pool de navegadores e responde direto ao chat pela Bot API.
+# Uso: python worker.py [--threads N] [--debug 1]
+# Cada thread atende um job por vez; o padrão é uma thread por navegador (NFCE_NAVEGADORES).
+# Em outras máquinas, FILA_URL=http://maquina-da-fila:8770 liga o worker ao broker_fila.py.
+# Com --simulado SEGUNDOS a consulta vira uma espera (sem Chrome nem planilha), para o gerar_carga.py.
+
+load_dotenv()
+
+TOKEN = os.getenv("TELEGRAM_TOKEN")
+
+# Com TELEGRAM_API_URL=http://127.0.0.1:8081/bot as mensagens vão para o telegram_fake.py
+API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+CAPTCHA_TIMEOUT = int(os.getenv("CAPTCHA_TIMEOUT", "180"))
+
+_local = threading.local()
+_lock = threading.Lock()
+# job_id -> início, jobs deste processo com lease a renovar
+_em_andamento = {}
+
+def chamar_telegram(metodo, **kwargs):
+    """Chama um método do telegram.Bot (send_message, send_photo...) na thread atual.
+
+    Cada thread do worker tem o seu event loop e o seu Bot, criados na primeira chamada.
+    """
+    if not TOKEN:
+        raise ValueError("Token do Telegram não encontrado. Certifique-se de que a variável TELEGRAM_TOKEN está definida no arquivo .env")
+    if getattr(_local, "bot", None) is None:
+        _local.loop = asyncio.new_event_loop()
+        _local.bot = telegram.Bot(TOKEN, base_url=API_URL)
+        _local.loop.run_until_complete(_local.bot.initialize())
+    return _local.loop.run_until_complete(getattr(_local.bot, metodo)(**kwargs))
+
+def criar_resolvedor_captcha(job):
+    # A imagem vai direto ao chat; a resposta chega em qualquer réplica do bot e volta pela fila
+    def resolver(imagem, chave, portal):
+        chamar_telegram(
+            "send_photo",
+            chat_id=job["chat_id"],
+            photo=imagem,
+            caption=f"🔐 Responda com o texto do CAPTCHA ({portal.upper()}) da chave {chave}. Você tem {CAPTCHA_TIMEOUT}s."
+        )
+        captcha_id = fila_jobs.registrar_captcha(job["id"], job["chat_id"])
+        resposta = fila_jobs.aguardar_captcha(captcha_id, CAPTCHA_TIMEOUT)
+        if resposta is None:
+            logging.info(f"CAPTCHA da chave {chave} não respondido pelo chat {job['chat_id']}")
+        return resposta
+    return resolver
+
+def chave_resultado(chave, chat_id):
+    # Com contas por chat, o mesmo recibo é gravado (e consultado) uma vez por conta
+    conta = contas.conta_do_chat(chat_id)
+    return chave if conta == contas.COMPARTILHADA else f"{chave}@{conta}"
+
+def consultar_chave(job):
+    """Consulta a chave do job e grava o resultado; devolve True se há recibo para a chave."""
+    if fila_jobs.resultado(chave_resultado(job["chave"], job["chat_id"])) is not None:
+        # Já consultada por outro job (ou por uma tentativa anterior deste): não volta ao portal
+        return True
+    import nfce_automation
+    codigo = ("s" if job["is_sat"] else "") + job["chave"]
+    resolver = criar_resolvedor_captcha(job) if job["chat_id"] is not None else None
+    resultados = nfce_automation.processar_recibos(codigos=[codigo], from_bot=True, debug_level=job["debug_level"], resolver_captcha=resolver, chat_id=job["chat_id"])
+    recibo = resultados[0][1] if resultados else None
+    if recibo is None:
+        return False
+    fila_jobs.gravar_resultado(chave_resultado(job["chave"], job["chat_id"]), recibo.is_sat, recibo.linhas_planilha(), job["id"], not recibo.is_duplicate)
+    return True
+
+def ler_chaves_da_imagem(job):
+    import nfce_automation
+    codigos, mensagem = nfce_automation.preprocessar_imagem(debug_level=job["debug_level"], conteudo=job["conteudo"])
+    if not codigos:
+        logging.info(f"Job {job['id']}: {mensagem}")
+        return []
+    # Chaves únicas, na ordem em que aparecem (fotos com vários recibos podem repetir QR codes)
+    chaves = {}
+    for codigo in codigos:
+        chave, is_sat = nfce_automation.extrair_chave(codigo, job["debug_level"])
+        if chave and chave not in chaves:
+            chaves[chave] = is_sat
+    return list(chaves.items())
+
+def responder_pedido(pedido):
+    """Envia ao chat uma única resposta com os recibos de todas as chaves do pedido."""
+    if pedido["chat_id"] is None:
+        return
+    resultados = []
+    for job in pedido["jobs"]:
+        dados = fila_jobs.resultado(chave_resultado(job["chave"], pedido["chat_id"])) if job["estado"] == fila_jobs.CONCLUIDO else None
+        recibo = None
+        if dados:
+            recibo = Recibo.de_linhas(dados["linhas"], is_sat=bool(dados["is_sat"]), chave=job["chave"])
+            # Só é "compra processada" para o job que gravou o recibo na planilha
+            recibo.is_duplicate = not (dados["novo"] and dados["job_id"] == job["id"])
+        resultados.append((job["chave"], recibo))
+    resposta = montar_resposta_recibos(resultados, pedido["chat_id"]) if resultados else None
+    if not resposta:
+        chamar_telegram("send_message", chat_id=pedido["chat_id"], text=FALHA_CHAVE if pedido["tipo"] == "chave" else FALHA_IMAGEM)
+        return
+    for bloco in dividir_resposta(resposta):
+        chamar_telegram("send_message", chat_id=pedido["chat_id"], text=bloco)
+
+def executar_job(job, simulado=None):
+    """Executa o job e o encerra na fila; devolve o pedido completo quando cabe a este job respondê-lo."""
+    if job["desistir"]:
+        logging.error(f"Job {job['id']} abandonado depois de {job['tentativas'] - 1} leases vencidos")
+    if job["tipo"] == "imagem":
+        # Foto ilegível (ou abandonada) fecha o pedido sem chaves: o usuário recebe a mensagem de falha
+        chaves = []
+        if not job["desistir"]:
+            try:
+                chaves = ler_chaves_da_imagem(job)
+            except Exception as e:
+                logging.error(f"Erro ao ler os QR codes do job {job['id']}: {e}")
+        return fila_jobs.expandir_pedido(job["id"], job["worker"], chaves)
+
+    sucesso = False
+    if not job["desistir"]:
+        try:
+            if simulado is not None:
+                time.sleep(simulado)
+                sucesso = True
+            else:
+                sucesso = consultar_chave(job)
+        except Exception as e:
+            logging.error(f"Erro ao processar o job {job['id']}: {e}")
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"Traceback: {traceback.format_exc()}")
+    return fila_jobs.concluir_job(job["id"], job["worker"], sucesso)
+
+def processar_job(job, simulado=None):
+    with _lock:
+        _em_andamento[job["id"]] = time.time()
+    try:
+        pedido = executar_job(job, simulado)
+    finally:
+        with _lock:
+            _em_andamento.pop(job["id"], None)
+    if pedido is not None:
+        try:
+            responder_pedido(pedido)
+        except Exception as e:
+            logging.error(f"Erro ao responder o pedido {pedido['id']} ao chat {pedido['chat_id']}: {e}")
+
+def manter_leases(nome, parar):
+    # Heartbeat do processo: renova o lease de todos os jobs em andamento (inclusive os que
+    # esperam a resposta de um CAPTCHA) e mantém o worker na contagem de ativos
+    while not parar.wait(fila_jobs.LEASE_SEGUNDOS / 3):
+        with _lock:
+            ids = list(_em_andamento)
+        try:
+            mantidos = fila_jobs.heartbeat(nome, ids)
+        except fila_jobs.ERROS_FILA as e:
+            logging.error(f"Erro no heartbeat do worker {nome}: {e}")
+            continue
+        for job_id in set(ids) - set(mantidos):
+            logging.warning(f"Job {job_id}: lease perdido, o resultado deste worker pode ser descartado")
+
+def executar(nome, parar, simulado=None):
+    while not parar.is_set():
+        try:
+            job = fila_jobs.proximo_job(nome)
+        except fila_jobs.ERROS_FILA as e:
+            # Fila (ou broker) fora do ar: tenta de novo sem derrubar o worker
+            logging.error(f"Erro ao buscar job na fila: {e}")
+            parar.wait(5)
+            continue
+        if job is None:
+            parar.wait(fila_jobs.INTERVALO_CONSULTA)
+            continue
+        logging.info(f"{nome}: job {job['id']} ({job['chave'] or job['tipo']}, prioridade {job['prioridade']}) do chat {job['chat_id']}")
+        try:
+            processar_job(job, simulado)
+        except fila_jobs.ERROS_FILA as e:
+            # O lease vence e outro worker assume o job
+            logging.error(f"Erro ao encerrar o job {job['id']} na fila: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker que consulta nos portais as chaves enfileiradas pelo bot")
+    parser.add_argument("--threads", type=int, default=None, help="Jobs atendidos ao mesmo tempo (padrão: NFCE_NAVEGADORES)")
+    parser.add_argument("--simulado", type=float, default=None, metavar="SEGUNDOS", help="Troca a consulta por uma espera (teste de carga)")
+    parser.add_argument("--debug", type=int, default=0, choices=[0, 1], help="Nível de debug: 0 para INFO (padrão), 1 para DEBUG")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG if args.debug else logging.INFO
+    )
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    threads_worker = args.threads
+    if threads_worker is None:
+        if args.simulado is None:
+            import nfce_automation
+            threads_worker = nfce_automation.TAMANHO_POOL_NAVEGADORES
+        else:
+            threads_worker = 1
+
+    parar = threading.Event()
+    nome = fila_jobs.nome_worker()
+    threading.Thread(target=manter_leases, args=(nome, parar), daemon=True).start()
+    fila_jobs.heartbeat(nome, [])
+    threads = [threading.Thread(target=executar, args=(nome, parar, args.simulado), daemon=True) for _ in range(max(1, threads_worker))]
+    for thread in threads:
+        thread.start()
+    logging.info(f"Worker {nome} com {len(threads)} thread(s) aguardando jobs em {fila_jobs.URL_BROKER or fila_jobs.ARQUIVO_FILA}")
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+    except KeyboardInterrupt:
+        logging.info("Encerrando o worker depois dos jobs em andamento...")
+        parar.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        if args.simulado is None:
+            import nfce_automation
+            nfce_automation.fechar_navegadores()
+
+if __name__ == "__main__":
+    main()